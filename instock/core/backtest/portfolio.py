@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import datetime
+import logging
+import numpy as np
+import pandas as pd
+import instock.core.tablestructure as tbs
+import instock.core.hist_store as hst
+import instock.lib.database as mdb
+import instock.lib.executor as exe
+import instock.core.strategy.features as fts
+import instock.core.strategy.screen as scr
+from instock.core.hist_panel import stock_hist_panel
+from instock.core.stockfetch import fetch_stock_top_entity_data
+from instock.core.strategy import high_tight_flag
+from instock.core.strategy.turtle_trade import BALANCE
+
+__author__ = 'myh '
+__date__ = '2023/3/10 '
+
+# 组合回测。
+# 按交易日回放策略信号：信号日收盘后产生，次一交易日开盘按等额分仓买入；持有hold_days根K线或触及止损、止盈后，
+# 次一根K线开盘卖出。遵守T+1(买入当日不能卖出)，开盘涨停不能买入、开盘跌停不能卖出，停牌不能成交，
+# 计算佣金(不足最低佣金按最低佣金)和卖出印花税。每个交易日一步，当日全部股票的成交、持仓、资金向量化计算。
+COMMISSION = 0.00025  # 佣金费率，买卖双向
+MIN_COMMISSION = 5.0  # 每笔最低佣金
+STAMP_TAX = 0.0005  # 印花税，卖出单向
+LOT_SIZE = 100  # 每手股数
+LIMIT_TOLERANCE = 0.002  # 复权价格有误差，涨跌停判断的容差
+TRADE_DAYS = 252  # 每年交易日数，用于年化
+
+TRADES_COLUMNS = ('code', 'name', 'buy_date', 'buy_price', 'sell_date', 'sell_price', 'shares', 'profit', 'rate')
+EQUITY_COLUMNS = ('date', 'cash', 'market_value', 'equity', 'positions')
+
+
+# 各股票的涨跌幅限制：ST 5%，创业板、科创板20%，北证30%，其余10%。
+def limit_ratios(codes, names):
+    ratios = np.full(len(codes), 0.1)
+    for j, (code, name) in enumerate(zip(codes, names)):
+        if name and name.startswith(("*ST", "ST")):
+            ratios[j] = 0.05
+        elif code.startswith(("300", "301", "688", "689")):
+            ratios[j] = 0.2
+        elif code.startswith(("43", "83", "87", "92")):
+            ratios[j] = 0.3
+    return ratios
+
+
+# 股票代码对应的名称，取实时行情表最新一日的数据。列式存储构建的面板没有名称，用于判断ST。
+def stock_names():
+    table = tbs.TABLE_CN_STOCK_SPOT['name']
+    try:
+        rows = mdb.executeSqlFetch(f"SELECT `code`, `name` FROM `{table}` WHERE `date` = (SELECT MAX(`date`) FROM `{table}`)")
+        if rows:
+            return {r[0]: r[1] for r in rows}
+    except Exception as e:
+        logging.error(f"portfolio.stock_names处理异常：{e}")
+    return {}
+
+
+# 各日期龙虎榜机构买入的股票代码集合，与 strategy_data_daily_job.run_check_all 一样按日期取，供高而窄的旗形使用。
+def top_codes(dates):
+    tops = {}
+    for date in dates:
+        codes = fetch_stock_top_entity_data(date)
+        if codes is not None:
+            tops[date] = codes
+    return tops
+
+
+# 面板行号与日期的转换，dates为YYYY-MM-DD、date或None。
+def _rows(panel, start=None, end=None):
+    t0 = 0 if start is None else int(np.searchsorted(panel.dates, hst.date_to_num(str(start)), side='left'))
+    t1 = panel.date_cut(end)
+    return t0, t1
+
+
+# 逐日生成策略信号，返回 (日期数, 股票数) 的bool矩阵，与面板的日期、股票对齐。
+# strategy_fun 为 TABLE_CN_STOCK_STRATEGIES 中的 func，只检查 [start, end] 内的交易日。
+# 有向量化实现(screen.SCREENS)的策略每日对全部股票一次计算，否则逐只股票调用检查函数。
+# tops为 {日期: 龙虎榜机构买入的股票代码集合}，高而窄的旗形在tops为None时按日期下载。
+def strategy_signals(panel, strategy_fun, start=None, end=None, tops=None, mode=exe.MODE_SERIAL, workers=None):
+    t0, t1 = _rows(panel, start, end)
+    signals = np.zeros(panel.mask.shape, dtype=bool)
+    dates = [datetime.date.fromisoformat(d) for d in hst.num_to_dates(panel.dates[t0:t1])]
+    if not dates:
+        return signals
+    is_top = strategy_fun is high_tight_flag.check_high_tight
+    if is_top and tops is None:
+        tops = top_codes(dates)
+    if strategy_fun in scr.SCREENS:
+        strategies = [{'name': strategy_fun.__name__, 'func': strategy_fun}]
+        for i, date in enumerate(dates):
+            result = scr.screen(panel, date, strategies, tops=None if tops is None else tops.get(date))
+            signals[t0 + i] = result.values[0]
+        return signals
+
+    task_kwargs = None
+    if is_top:
+        top_dates = {}
+        for date, codes in tops.items():
+            for code in codes:
+                top_dates.setdefault(code, set()).add(date)
+        task_kwargs = {k: {'top_dates': top_dates.get(k[1], set())} for k in panel.keys()}
+    results = exe.map_stocks(_check_dates, panel, panel.keys(), strategy_fun, dates, t0, task_kwargs=task_kwargs,
+                             mode=mode, workers=workers, label=f"portfolio.strategy_signals{strategy_fun.__name__}")
+    for key, rows in results.items():
+        if rows:
+            signals[rows, panel.key_index(key)] = True
+    return signals
+
+
+# 单只股票在各交易日的策略检查，返回命中的面板行号。均线等衍生数据各日期共用。
+# top_dates不为None时为该股票上龙虎榜的日期。
+def _check_dates(code_name, data, strategy_fun, dates, t0, top_dates=None):
+    rows = []
+    if data is None:
+        return rows
+    kwargs = {'features': fts.feature_cache()} if fts.accepts(strategy_fun) else {}
+    for i, date in enumerate(dates):
+        if top_dates is not None:
+            kwargs['istop'] = date in top_dates
+        if strategy_fun(code_name, data, date=date, **kwargs):
+            rows.append(t0 + i)
+    return rows
+
+
+# 回放信号，返回 {'equity': 每日资金DataFrame, 'trades': 已平仓交易DataFrame, 'stats': 统计dict}。
+# signals为 (日期数, 股票数) bool矩阵，与面板对齐；max_positions为最多持仓数，每只股票按上一日总资产的1/max_positions买入。
+# stop_loss、take_profit为按收盘价计算的亏损、盈利比例(如0.1)，None为不设置。
+# names为 {代码: 名称}，面板中没有名称的股票用它判断ST，None时只用面板的名称。
+def simulate(panel, signals, start=None, end=None, balance=BALANCE, max_positions=10, hold_days=5,
+             stop_loss=None, take_profit=None, commission=COMMISSION, min_commission=MIN_COMMISSION,
+             stamp_tax=STAMP_TAX, names=None):
+    t0, t1 = _rows(panel, start, end)
+    size = panel.mask.shape[1]
+    mask = panel.mask
+    open_ = panel.column('open')
+    close = panel.column('close')
+    amount = panel.column('amount')
+    names = [k[2] or ('' if names is None else names.get(k[1], '')) for k in panel.keys_list]
+    ratios = limit_ratios(panel.codes, names)
+
+    cash = float(balance)
+    shares = np.zeros(size, dtype=np.int64)
+    buy_price = np.zeros(size)
+    buy_cost = np.zeros(size)
+    buy_row = np.full(size, -1, dtype=np.int64)
+    held_bars = np.zeros(size, dtype=np.int64)
+    exit_flag = np.zeros(size, dtype=bool)
+    # 截至前一交易日的最后收盘价，停牌时沿用。
+    last_close = np.full(size, np.nan)
+    if t0 > 0:
+        seen = mask[:t0].any(axis=0)
+        last_row = t0 - 1 - np.argmax(mask[:t0][::-1], axis=0)
+        last_close[seen] = close[last_row[seen], np.flatnonzero(seen)]
+    equity = cash
+
+    trades = []
+    days = []
+    for t in range(t0, t1):
+        bar = mask[t]
+        o = open_[t]
+        # 卖出：到期或触发止损止盈，T+1，当日有K线且开盘未跌停。
+        held = shares > 0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            limit_down = o <= last_close * (1 - ratios + LIMIT_TOLERANCE)
+            limit_up = o >= last_close * (1 + ratios - LIMIT_TOLERANCE)
+        sell = held & (buy_row < t) & ((held_bars >= hold_days) | exit_flag) & bar & ~limit_down
+        if sell.any():
+            idx = np.flatnonzero(sell)
+            value = shares[idx] * o[idx]
+            fee = np.maximum(value * commission, min_commission) + value * stamp_tax
+            cash += float((value - fee).sum())
+            profit = value - fee - buy_cost[idx]
+            trades.append((idx, buy_row[idx], buy_price[idx], np.full(len(idx), t), o[idx], shares[idx].copy(),
+                           profit, profit / buy_cost[idx]))
+            shares[idx] = 0
+            held_bars[idx] = 0
+            exit_flag[idx] = False
+            buy_row[idx] = -1
+
+        # 买入：前一交易日的信号，未持有，当日有K线且开盘未涨停，按前一日成交额从大到小填满空仓位。
+        free = max_positions - int((shares > 0).sum())
+        if free > 0 and t > 0:
+            buy = signals[t - 1] & (shares == 0) & bar & ~limit_up & (o > 0)
+            if buy.any():
+                idx = np.flatnonzero(buy)
+                prev_amount = np.nan_to_num(amount[t - 1, idx], nan=0.0)
+                idx = idx[np.argsort(-prev_amount, kind='stable')][:free]
+                slot = min(equity / max_positions, cash)
+                lots = np.floor(slot / (o[idx] * (1 + commission)) / LOT_SIZE)
+                qty = (lots * LOT_SIZE).astype(np.int64)
+                value = qty * o[idx]
+                cost = value + np.maximum(value * commission, min_commission)
+                ok = (qty > 0) & (np.cumsum(np.where(qty > 0, cost, 0.0)) <= cash)
+                idx, qty, cost = idx[ok], qty[ok], cost[ok]
+                if len(idx) > 0:
+                    cash -= float(cost.sum())
+                    shares[idx] = qty
+                    buy_price[idx] = o[idx]
+                    buy_cost[idx] = cost
+                    buy_row[idx] = t
+                    held_bars[idx] = 0
+
+        # 收盘记账。
+        last_close = np.where(bar, close[t], last_close)
+        held = shares > 0
+        held_bars[held & bar] += 1
+        if stop_loss is not None or take_profit is not None:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                rate = last_close / buy_price - 1
+            flag = np.zeros(size, dtype=bool)
+            if stop_loss is not None:
+                flag |= rate <= -stop_loss
+            if take_profit is not None:
+                flag |= rate >= take_profit
+            exit_flag = held & flag
+        market_value = float((shares[held] * last_close[held]).sum())
+        equity = cash + market_value
+        days.append((t, cash, market_value, equity, int(held.sum())))
+
+    return {'equity': _equity_frame(panel, days), 'trades': _trades_frame(panel, names, trades),
+            'stats': _stats(days, trades, balance)}
+
+
+def _equity_frame(panel, days):
+    data = pd.DataFrame(days, columns=('row',) + EQUITY_COLUMNS[1:])
+    data.insert(0, 'date', hst.num_to_dates(panel.dates[data['row'].values.astype(np.int64)]))
+    return data.drop(columns='row')
+
+
+def _trades_frame(panel, names, trades):
+    if not trades:
+        return pd.DataFrame(columns=TRADES_COLUMNS)
+    idx, buy_row, buy_price, sell_row, sell_price, shares, profit, rate = [np.concatenate(x) for x in zip(*trades)]
+    names = np.array(names, dtype=object)
+    codes = np.array(panel.codes, dtype=object)
+    return pd.DataFrame({'code': codes[idx], 'name': names[idx],
+                         'buy_date': hst.num_to_dates(panel.dates[buy_row]), 'buy_price': buy_price,
+                         'sell_date': hst.num_to_dates(panel.dates[sell_row]), 'sell_price': sell_price,
+                         'shares': shares, 'profit': profit, 'rate': rate})
+
+
+def _stats(days, trades, balance):
+    if not days:
+        return {}
+    equity = np.array([d[3] for d in days])
+    returns = np.diff(np.concatenate(([balance], equity))) / np.concatenate(([balance], equity[:-1]))
+    total = equity[-1] / balance - 1
+    peak = np.maximum.accumulate(np.concatenate(([balance], equity)))
+    drawdown = 1 - np.concatenate(([balance], equity)) / peak
+    std = returns.std()
+    profit = np.concatenate([t[6] for t in trades]) if trades else np.empty(0)
+    return {
+        'total_return': float(total),
+        'annual_return': float((1 + total) ** (TRADE_DAYS / len(days)) - 1) if total > -1 else -1.0,
+        'max_drawdown': float(drawdown.max()),
+        'sharpe': float(returns.mean() / std * np.sqrt(TRADE_DAYS)) if std > 0 else 0.0,
+        'trades': int(len(profit)),
+        'win_rate': float((profit > 0).mean()) if len(profit) > 0 else 0.0,
+        'end_equity': float(equity[-1]),
+    }
+
+
+# 单个策略：生成信号并回放，在子进程中运行时panel为共享内存中的面板。
+def run_strategy(panel, strategy, start=None, end=None, tops=None, **kwargs):
+    signals = strategy_signals(panel, strategy['func'], start, end, tops)
+    result = simulate(panel, signals, start, end, **kwargs)
+    result['name'] = strategy['name']
+    return result
+
+
+# 多个策略按物理核数分发到进程池，每个进程计算一个策略。panel为None时从本地历史数据存储构建。
+# strategies为 TABLE_CN_STOCK_STRATEGIES 中的项，返回与strategies对应的结果列表。
+# 面板中有股票没有名称且没有给出names时，从实时行情表取名称；有高而窄的旗形时先取区间内各日期的龙虎榜，各进程共用。
+def run_strategies(strategies, start=None, end=None, panel=None, adjust="qfq", workers=None, **kwargs):
+    if panel is None:
+        panel = stock_hist_panel.from_store(adjust)
+    if kwargs.get('names') is None and not all(k[2] for k in panel.keys_list):
+        kwargs['names'] = stock_names()
+    tops = None
+    if any(s['func'] is high_tight_flag.check_high_tight for s in strategies):
+        t0, t1 = _rows(panel, start, end)
+        tops = top_codes([datetime.date.fromisoformat(d) for d in hst.num_to_dates(panel.dates[t0:t1])])
+    tasks = [{'name': s['name'], 'func': s['func']} for s in strategies]
+    return exe.map_panel(run_strategy, panel, tasks, start, end, tops, workers=workers,
+                         label="portfolio.run_strategies", **kwargs)
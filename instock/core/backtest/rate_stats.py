@@ -4,6 +4,9 @@
 import logging
 import numpy as np
 import pandas as pd
+import instock.core.hist_store as hst
+import instock.core.hist_index as hix
+import instock.core.tablestructure as tbs
 
 __author__ = 'myh '
 __date__ = '2023/3/10 '
@@ -20,9 +23,8 @@ def get_rates(code_name, data, stock_column, threshold=101):
         # 设置返回数组。
         stock_data_list = [start_date, code]
 
-        mask = (data['date'] >= start_date)
-        data = data.loc[mask].copy()
-        data = data.head(n=threshold)
+        begin = hix.start(data, start_date)
+        data = data.iloc[begin:begin + threshold].copy()
 
         if len(data.index) <= 1:
             return None
@@ -48,3 +50,44 @@ def get_rates(code_name, data, stock_column, threshold=101):
         logging.error(f"rate_stats.get_rates处理异常：{code}代码{e}")
 
     return pd.Series(stock_data_list, index=stock_column)
+
+
+# 批量计算全部信号的N日收益率，结果与get_rates一致：
+# 以信号日及之后第一根K线的收盘价为基准，第i列为其后第i根K线的累计涨跌幅(%)，保留两位小数，K线不足的为NaN。
+# panel为stock_hist_panel，codes、dates为各信号的代码和日期(YYYY-MM-DD)。
+# 返回 ((信号数, count) 数组, valid)，代码不在面板中或基准日之后没有K线的信号valid为False。
+def get_rates_panel(panel, codes, dates, count=tbs.RATE_FIELDS_COUNT):
+    try:
+        size = len(codes)
+        # 全部K线按 (股票, 日期) 排序展开，每只股票占连续一段。
+        n_idx, t_idx = np.nonzero(panel.mask.T)
+        close = panel.column('close')[t_idx, n_idx]
+        starts = np.zeros(panel.mask.shape[1] + 1, dtype=np.int64)
+        np.cumsum(panel.mask.sum(axis=0), out=starts[1:])
+        keys = (n_idx.astype(np.int64) << 32) + (panel.dates[t_idx].astype(np.int64) + (1 << 31))
+
+        # 每个信号在展开数组中的起始位置，即该股票第一根日期>=信号日的K线。
+        j = np.array([-1 if i is None else i for i in map(panel.code_index, codes)], dtype=np.int64)
+        found = j >= 0
+        j = np.maximum(j, 0)
+        d = hst.dates_to_num(np.asarray(dates, dtype=str)).astype(np.int64)
+        pos = np.searchsorted(keys, (j << 32) + (d + (1 << 31)), side='left')
+        end = starts[j + 1]
+        valid = found & (end - pos >= 2)
+
+        # 一次取出全部信号的基准及后count根K线。
+        offsets = pos[:, None] + np.arange(count + 1)[None, :]
+        inside = offsets < end[:, None]
+        if len(close) > 0:
+            values = close[np.minimum(offsets, len(close) - 1)]
+        else:
+            values = np.full(offsets.shape, np.nan)
+        base = values[:, :1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rates = np.around(100 * (values[:, 1:] - base) / base, decimals=2)
+        rates[~inside[:, 1:]] = np.nan
+        rates[~valid] = np.nan
+        return rates.reshape(size, count), valid
+    except Exception as e:
+        logging.error(f"rate_stats.get_rates_panel处理异常：{e}")
+    return None
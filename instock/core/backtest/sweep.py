@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import itertools
+import datetime
+import numpy as np
+import pandas as pd
+import instock.core.hist_store as hst
+import instock.lib.executor as exe
+import instock.core.backtest.rate_stats as rate
+import instock.core.strategy.features as fts
+from instock.core.hist_panel import stock_hist_panel
+
+__author__ = 'myh '
+__date__ = '2023/3/10 '
+
+# 策略参数扫描。
+# 对一组参数取值的全部组合，在全市场、指定日期区间内运行策略检查函数，统计每组参数的信号数、触发率和之后N日收益率。
+# 按股票分批分发到进程池，面板在共享内存中；每只股票的DataFrame和均线等衍生数据只生成一次，全部日期、全部参数组合共用。
+# 信号的N日收益率按去重后的 (股票, 日期) 一次算出，各参数组合共用。
+HORIZONS = (1, 5, 10, 20)  # 统计的收益率天数
+
+
+# 参数网格展开为参数dict列表，如 {'min_vol_ratio': [1.5, 2, 3]}。
+def param_grid(grid):
+    names = list(grid.keys())
+    return [dict(zip(names, values)) for values in itertools.product(*[grid[n] for n in names])]
+
+
+# 一批股票在全部日期、全部参数组合上的检查，在子进程中运行。
+# 返回 (参数序号, 面板行号, 股票序号) 数组和检查的股票日数。
+def _check_chunk(panel, index, strategy_fun, t0, t1, params):
+    dates = [datetime.date.fromisoformat(d) for d in hst.num_to_dates(panel.dates[t0:t1])]
+    hits = []
+    checked = 0
+    use_features = fts.accepts(strategy_fun)
+    for j in index:
+        rows = t0 + np.flatnonzero(panel.mask[t0:t1, j])
+        if len(rows) == 0:
+            continue
+        data = panel.frame(j)
+        code_name = panel.keys_list[j]
+        checked += len(rows)
+        features = {'features': fts.feature_cache()} if use_features else {}
+        for t in rows:
+            date = dates[t - t0]
+            for p, kwargs in enumerate(params):
+                if strategy_fun(code_name, data, date=date, **kwargs, **features):
+                    hits.append((p, t, j))
+    return np.array(hits, dtype=np.int64).reshape(-1, 3), checked
+
+
+# 扫描参数网格，返回每组参数一行的DataFrame：
+# 参数列、signals(信号数)、hit_rate(信号数/检查的股票日数)，以及每个horizon的 mean_N、median_N(平均、中位收益率%)和 win_N(收益率>0的比例)。
+# panel为None时从本地历史数据存储构建。
+def sweep(strategy_fun, grid, start=None, end=None, panel=None, adjust="qfq", horizons=HORIZONS, workers=None):
+    if panel is None:
+        panel = stock_hist_panel.from_store(adjust)
+    params = param_grid(grid) if isinstance(grid, dict) else list(grid)
+    t0 = 0 if start is None else int(np.searchsorted(panel.dates, hst.date_to_num(str(start)), side='left'))
+    t1 = panel.date_cut(end)
+    if workers is None:
+        workers = exe.physical_cores()
+
+    size = len(panel.codes)
+    chunk = max(1, -(-size // (workers * 4)))
+    tasks = [np.arange(b, min(b + chunk, size)) for b in range(0, size, chunk)]
+    results = exe.map_panel(_check_chunk, panel, tasks, strategy_fun, t0, t1, params, workers=workers,
+                            label=f"sweep.sweep{strategy_fun.__name__}")
+    results = [r for r in results if r is not None]
+    hits = np.concatenate([r[0] for r in results]) if results else np.empty((0, 3), dtype=np.int64)
+    checked = sum(r[1] for r in results)
+
+    # 去重后的信号一次计算收益率。
+    signals, inverse = np.unique(hits[:, 1:], axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    codes = [panel.codes[j] for j in signals[:, 1]]
+    dates = hst.num_to_dates(panel.dates[signals[:, 0]])
+    count = max(horizons)
+    rates = rate.get_rates_panel(panel, codes, dates, count=count)
+    values = rates[0] if rates is not None else np.full((len(signals), count), np.nan)
+
+    data = []
+    for p, kwargs in enumerate(params):
+        sel = values[inverse[hits[:, 0] == p]]
+        row = dict(kwargs)
+        row['signals'] = len(sel)
+        row['hit_rate'] = len(sel) / checked if checked > 0 else 0.0
+        for h in horizons:
+            r = sel[:, h - 1]
+            r = r[~np.isnan(r)]
+            row[f'mean_{h}'] = float(r.mean()) if len(r) > 0 else np.nan
+            row[f'median_{h}'] = float(np.median(r)) if len(r) > 0 else np.nan
+            row[f'win_{h}'] = float((r > 0).mean()) if len(r) > 0 else np.nan
+        data.append(row)
+    return pd.DataFrame(data)
@@ -6,9 +6,9 @@ Desc: 东方财富-ETF 行情
 https://quote.eastmoney.com/sh513500.html
 """
 from functools import lru_cache
-import math
 import pandas as pd
-import requests
+import instock.core.crawling.http_client as http_client
+import instock.core.crawling.paging as paging
 
 
 def fund_etf_spot_em() -> pd.DataFrame:
@@ -35,24 +35,10 @@ def fund_etf_spot_em() -> pd.DataFrame:
         "fields": "f1,f2,f3,f4,f5,f6,f7,f8,f9,f10,f12,f13,f14,f15,f16,f17,f18,f20,f21,f23,f24,f25,f22,f11,f62,f128,f136,f115,f152",
         "_": "1672806290972",
     }
-    r = requests.get(url, params=params)
-    data_json = r.json()
-
-    data = data_json["data"]["diff"]
+    data = paging.fetch_pages(url, params, page_size)
     if not data:
         return pd.DataFrame()
 
-    data_count = data_json["data"]["total"]
-    page_count = math.ceil(data_count/page_size)
-    while page_count > 1:
-        page_current = page_current + 1
-        params["pn"] = page_current
-        r = requests.get(url, params=params)
-        data_json = r.json()
-        _data = data_json["data"]["diff"]
-        data.extend(_data)
-        page_count =page_count - 1
-
     temp_df = pd.DataFrame(data)
     temp_df.rename(
         columns={
@@ -129,21 +115,21 @@ def _fund_etf_code_id_map_em() -> dict:
         "fields": "f12,f13",
         "_": "1672806290972",
     }
-    r = requests.get(url, params=params)
+    r = http_client.get(url, params=params)
     data_json = r.json()
     temp_df = pd.DataFrame(data_json["data"]["diff"])
     temp_dict = dict(zip(temp_df["f12"], temp_df["f13"]))
     return temp_dict
 
-def fund_etf_hist_em(
+def fund_etf_hist_em_request(
     symbol: str = "159707",
     period: str = "daily",
     start_date: str = "19700101",
     end_date: str = "20500101",
     adjust: str = "",
-) -> pd.DataFrame:
+) -> tuple:
     """
-    东方财富-ETF 行情
+    东方财富-ETF 行情的请求地址和参数
     https://quote.eastmoney.com/sz159707.html
     :param symbol: ETF 代码
     :type symbol: str
@@ -155,8 +141,8 @@ def fund_etf_hist_em(
     :type end_date: str
     :param adjust: choice of {"qfq": "前复权", "hfq": "后复权", "": "不复权"}
     :type adjust: str
-    :return: 每日行情
-    :rtype: pandas.DataFrame
+    :return: (请求地址, 请求参数)
+    :rtype: tuple
     """
     code_id_dict = _fund_etf_code_id_map_em()
     adjust_dict = {"qfq": "1", "hfq": "2", "": "0"}
@@ -173,8 +159,17 @@ def fund_etf_hist_em(
         "end": end_date,
         "_": "1623766962675",
     }
-    r = requests.get(url, params=params)
-    data_json = r.json()
+    return url, params
+
+
+def fund_etf_hist_em_frame(data_json: dict) -> pd.DataFrame:
+    """
+    东方财富-ETF 行情的返回json转换为DataFrame
+    :param data_json: 返回的json
+    :type data_json: dict
+    :return: 每日行情
+    :rtype: pandas.DataFrame
+    """
     if not (data_json["data"] and data_json["data"]["klines"]):
         return pd.DataFrame()
     temp_df = pd.DataFrame([item.split(",") for item in data_json["data"]["klines"]])
@@ -207,6 +202,34 @@ def fund_etf_hist_em(
     return temp_df
 
 
+def fund_etf_hist_em(
+    symbol: str = "159707",
+    period: str = "daily",
+    start_date: str = "19700101",
+    end_date: str = "20500101",
+    adjust: str = "",
+) -> pd.DataFrame:
+    """
+    东方财富-ETF 行情
+    https://quote.eastmoney.com/sz159707.html
+    :param symbol: ETF 代码
+    :type symbol: str
+    :param period: choice of {'daily', 'weekly', 'monthly'}
+    :type period: str
+    :param start_date: 开始日期
+    :type start_date: str
+    :param end_date: 结束日期
+    :type end_date: str
+    :param adjust: choice of {"qfq": "前复权", "hfq": "后复权", "": "不复权"}
+    :type adjust: str
+    :return: 每日行情
+    :rtype: pandas.DataFrame
+    """
+    url, params = fund_etf_hist_em_request(symbol, period, start_date, end_date, adjust)
+    r = http_client.get(url, params=params)
+    return fund_etf_hist_em_frame(r.json())
+
+
 def fund_etf_hist_min_em(
     symbol: str = "159707",
     start_date: str = "1979-09-01 09:32:00",
@@ -247,7 +270,7 @@ def fund_etf_hist_min_em(
             "secid": f"{code_id_dict[symbol]}.{symbol}",
             "_": "1623766962675",
         }
-        r = requests.get(url, params=params)
+        r = http_client.get(url, params=params)
         data_json = r.json()
         temp_df = pd.DataFrame(
             [item.split(",") for item in data_json["data"]["trends"]]
@@ -287,7 +310,7 @@ def fund_etf_hist_min_em(
             "end": "20500000",
             "_": "1630930917857",
         }
-        r = requests.get(url, params=params)
+        r = http_client.get(url, params=params)
         data_json = r.json()
         temp_df = pd.DataFrame(
             [item.split(",") for item in data_json["data"]["klines"]]
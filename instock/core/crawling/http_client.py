@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""
+Date: 2023/5/9 10:00
+Desc: 抓取共用的HTTP客户端
+每个主机一个保持连接的requests.Session，连接池大小与下载线程数一致，同一主机的请求复用TCP/TLS连接
+每个主机一个自适应限速的令牌桶，连接出错、超时和限流/服务端错误的响应按指数退避重试有限次数
+async_client 在一个线程的事件循环中同时发出大量请求，安装了aiohttp时用aiohttp，否则在POOL_SIZE个线程中使用上面的会话
+"""
+import asyncio
+import concurrent.futures
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from instock.core.crawling.rate_limit import token_bucket
+
+# 每个主机的连接池大小，与 stock_hist_data 下载历史数据的线程数一致
+POOL_SIZE = 16
+# (连接, 读取)超时秒数
+TIMEOUT = (10, 30)
+HEADERS = {"Accept-Encoding": "gzip, deflate"}
+# 失败后的重试次数
+RETRIES = 3
+# 第n次重试前等待 BACKOFF*2^n 秒(不超过BACKOFF_MAX)，再乘0.5~1的随机数错开并发线程
+BACKOFF = 0.5
+BACKOFF_MAX = 8.0
+# 需要重试的响应状态码
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+_sessions = {}
+_limiters = {}
+_stats = {}
+_lock = threading.Lock()
+
+
+def _host(url: str) -> tuple:
+    parts = urlsplit(url)
+    return parts.scheme, parts.netloc
+
+
+def _mount(session: requests.Session) -> None:
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+
+def configure(pool_size: int = None, timeout=None) -> None:
+    """
+    设置连接池大小和默认超时，已有的会话换用新的连接池
+    :param pool_size: 每个主机的连接池大小
+    :type pool_size: int
+    :param timeout: 默认超时秒数，数字或(连接, 读取)
+    :type timeout: float or tuple
+    """
+    global POOL_SIZE, TIMEOUT
+    with _lock:
+        if timeout is not None:
+            TIMEOUT = timeout
+        if pool_size is not None and pool_size != POOL_SIZE:
+            POOL_SIZE = pool_size
+            for session in _sessions.values():
+                _mount(session)
+
+
+def session(url: str) -> requests.Session:
+    """
+    url所在主机的会话，不存在时创建
+    :param url: 请求地址
+    :type url: str
+    :return: 会话
+    :rtype: requests.Session
+    """
+    key = _host(url)
+    _session = _sessions.get(key)
+    if _session is None:
+        with _lock:
+            _session = _sessions.get(key)
+            if _session is None:
+                _session = requests.Session()
+                _session.headers.update(HEADERS)
+                _mount(_session)
+                _sessions[key] = _session
+    return _session
+
+
+def limiter(url: str) -> token_bucket:
+    """
+    url所在主机的限速令牌桶，不存在时创建
+    :param url: 请求地址
+    :type url: str
+    :return: 令牌桶
+    :rtype: token_bucket
+    """
+    key = _host(url)
+    _limiter = _limiters.get(key)
+    if _limiter is None:
+        with _lock:
+            _limiter = _limiters.get(key)
+            if _limiter is None:
+                _limiter = token_bucket()
+                _limiters[key] = _limiter
+                _stats[key] = {"requests": 0, "retries": 0, "failures": 0}
+    return _limiter
+
+
+def _count(key: tuple, name: str) -> None:
+    with _lock:
+        _stats[key][name] += 1
+
+
+def stats() -> dict:
+    """
+    各主机的请求统计
+    :return: 主机名到 requests(请求次数)、retries(重试次数)、failures(重试后仍失败次数)、rate(当前每秒请求数) 的字典
+    :rtype: dict
+    """
+    with _lock:
+        return {key[1]: dict(value, rate=round(_limiters[key].rate, 2)) for key, value in _stats.items()}
+
+
+def _backoff(attempt: int) -> float:
+    return min(BACKOFF_MAX, BACKOFF * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+
+def get(url: str, params: dict = None, headers: dict = None, timeout=None, retries: int = None,
+        **kwargs) -> requests.Response:
+    """
+    GET请求，使用主机的共用会话和限速，timeout为None时用默认超时
+    连接出错、超时或响应状态码在RETRY_STATUS中时按指数退避重试，重试用完后抛出最后的异常或返回最后的响应
+    :param url: 请求地址
+    :type url: str
+    :param params: 请求参数
+    :type params: dict
+    :param headers: 请求头，与会话的请求头合并
+    :type headers: dict
+    :param timeout: 超时秒数
+    :type timeout: float or tuple
+    :param retries: 重试次数，None时用RETRIES
+    :type retries: int
+    :return: 响应
+    :rtype: requests.Response
+    """
+    key = _host(url)
+    _limiter = limiter(url)
+    _session = session(url)
+    retries = RETRIES if retries is None else retries
+    for attempt in range(retries + 1):
+        _limiter.acquire()
+        _count(key, "requests")
+        start = time.monotonic()
+        try:
+            r = _session.get(url, params=params, headers=headers,
+                             timeout=TIMEOUT if timeout is None else timeout, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            _limiter.failure()
+            if attempt == retries:
+                _count(key, "failures")
+                raise
+        else:
+            if r.status_code not in RETRY_STATUS:
+                _limiter.success(time.monotonic() - start)
+                return r
+            _limiter.failure()
+            if attempt == retries:
+                _count(key, "failures")
+                return r
+        _count(key, "retries")
+        time.sleep(_backoff(attempt))
+
+
+class async_client:
+    """
+    异步GET请求，与get使用相同的限速、重试和统计
+    在事件循环所在线程中创建和使用，用完后调用close
+    :param concurrency: 同时进行的最大请求数
+    :type concurrency: int
+    """
+
+    def __init__(self, concurrency: int = 200):
+        self._semaphore = asyncio.Semaphore(concurrency)
+        try:
+            import aiohttp
+        except ImportError:
+            aiohttp = None
+        if aiohttp is None:
+            self._session = None
+            self._errors = (requests.ConnectionError, requests.Timeout)
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=POOL_SIZE)
+        else:
+            connect, read = TIMEOUT if isinstance(TIMEOUT, tuple) else (TIMEOUT, TIMEOUT)
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=concurrency, limit_per_host=concurrency),
+                timeout=aiohttp.ClientTimeout(sock_connect=connect, sock_read=read),
+                headers=HEADERS)
+            self._errors = (aiohttp.ClientError, asyncio.TimeoutError)
+            self._executor = None
+
+    async def _request(self, url: str, params: dict) -> tuple:
+        if self._session is not None:
+            async with self._session.get(url, params=params) as r:
+                return r.status, await r.read()
+        _session = session(url)
+        r = await asyncio.get_running_loop().run_in_executor(
+            self._executor, lambda: _session.get(url, params=params, timeout=TIMEOUT))
+        return r.status_code, r.content
+
+    async def get(self, url: str, params: dict = None, retries: int = None) -> tuple:
+        """
+        GET请求，连接出错、超时或响应状态码在RETRY_STATUS中时按指数退避重试
+        重试用完后抛出最后的异常或返回最后的响应
+        :param url: 请求地址
+        :type url: str
+        :param params: 请求参数
+        :type params: dict
+        :param retries: 重试次数，None时用RETRIES
+        :type retries: int
+        :return: (状态码, 响应内容)
+        :rtype: tuple
+        """
+        key = _host(url)
+        _limiter = limiter(url)
+        retries = RETRIES if retries is None else retries
+        for attempt in range(retries + 1):
+            async with self._semaphore:
+                await asyncio.sleep(_limiter.reserve())
+                _count(key, "requests")
+                start = time.monotonic()
+                try:
+                    status, content = await self._request(url, params)
+                except self._errors:
+                    _limiter.failure()
+                    if attempt == retries:
+                        _count(key, "failures")
+                        raise
+                else:
+                    if status not in RETRY_STATUS:
+                        _limiter.success(time.monotonic() - start)
+                        return status, content
+                    _limiter.failure()
+                    if attempt == retries:
+                        _count(key, "failures")
+                        return status, content
+            _count(key, "retries")
+            await asyncio.sleep(_backoff(attempt))
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""
+Date: 2023/5/9 10:00
+Desc: 分页接口并发抓取
+"""
+import math
+import concurrent.futures
+import instock.core.crawling.http_client as http_client
+
+# 第1页之后的页同时请求的最大数量
+MAX_WORKERS = 8
+
+
+def _get_path(data_json: dict, path: tuple):
+    for key in path:
+        if data_json is None:
+            return None
+        data_json = data_json[key]
+    return data_json
+
+
+def _fetch_page(url: str, params: dict, page_key: str, page: int, data_path: tuple) -> list:
+    params = dict(params)
+    params[page_key] = page
+    r = http_client.get(url, params=params)
+    return _get_path(r.json(), data_path) or []
+
+
+def fetch_pages(
+    url: str,
+    params: dict,
+    page_size: int,
+    page_key: str = "pn",
+    data_path: tuple = ("data", "diff"),
+    total_path: tuple = ("data", "total"),
+    max_workers: int = MAX_WORKERS,
+) -> list:
+    """
+    分页接口的全部数据
+    先请求第1页得到总数，其余页按max_workers并发请求，按页码顺序拼接
+    :param url: 接口地址
+    :type url: str
+    :param params: 请求参数，页码由page_key指定
+    :type params: dict
+    :param page_size: 每页条数，与params中的一致
+    :type page_size: int
+    :param page_key: 页码参数名
+    :type page_key: str
+    :param data_path: 返回json中数据列表的路径
+    :type data_path: tuple
+    :param total_path: 返回json中总数的路径
+    :type total_path: tuple
+    :param max_workers: 最大并发数
+    :type max_workers: int
+    :return: 全部页的数据，第1页没有数据返回空列表
+    :rtype: list
+    """
+    params = dict(params)
+    params[page_key] = 1
+    r = http_client.get(url, params=params)
+    data_json = r.json()
+    data = _get_path(data_json, data_path)
+    if not data:
+        return []
+
+    page_count = math.ceil(_get_path(data_json, total_path) / page_size)
+    if page_count <= 1:
+        return data
+    pages = range(2, page_count + 1)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(max_workers, len(pages))) as executor:
+        for _data in executor.map(lambda page: _fetch_page(url, params, page_key, page, data_path), pages):
+            data.extend(_data)
+    return data
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+"""
+Date: 2023/5/9 10:00
+Desc: 每个主机的自适应限速
+令牌桶控制每秒请求数，速率按观察到的结果加性增、乘性减(AIMD)：
+请求成功且耗时正常时每秒请求数每秒约增加INCREASE，出错、被限流或耗时过长时乘DECREASE，减速之后冷却一段时间再允许下一次减速，
+同一批并发请求同时失败只算一次。
+"""
+import threading
+import time
+
+# 初始每秒请求数
+RATE = 20.0
+# 速率下限和上限
+MIN_RATE = 1.0
+MAX_RATE = 100.0
+# 令牌桶容量，允许的瞬时并发
+BURST = 4.0
+# 成功时每秒请求数每秒增加的数量(每次成功增加INCREASE/rate)
+INCREASE = 2.0
+# 出错时速率乘的系数
+DECREASE = 0.7
+# 两次减速之间的最短秒数
+COOLDOWN = 1.0
+# 单次请求超过该秒数视为拥塞
+SLOW = 5.0
+
+
+class token_bucket:
+    def __init__(self, rate: float = RATE, min_rate: float = MIN_RATE, max_rate: float = MAX_RATE,
+                 burst: float = BURST):
+        self.rate = float(rate)
+        self.min_rate = float(min_rate)
+        self.max_rate = float(max_rate)
+        self.burst = float(burst)
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._decreased = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def reserve(self) -> float:
+        """
+        预占一个令牌，不等待，异步调用方自行等待返回的秒数
+        :return: 需要等待的秒数
+        :rtype: float
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def acquire(self) -> float:
+        """
+        取一个令牌，没有令牌时预占下一个并等待
+        :return: 等待的秒数
+        :rtype: float
+        """
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def success(self, elapsed: float) -> None:
+        """
+        请求成功，耗时过长按拥塞减速，否则加速
+        :param elapsed: 请求耗时秒数
+        :type elapsed: float
+        """
+        if elapsed > SLOW:
+            self.failure()
+            return
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = min(self.max_rate, self.rate + INCREASE / self.rate)
+
+    def failure(self) -> None:
+        """
+        请求出错或被限流，按DECREASE减速，冷却期内不重复减速
+        """
+        with self._lock:
+            now = time.monotonic()
+            if now - self._decreased < COOLDOWN:
+                return
+            self._refill(now)
+            self._decreased = now
+            self.rate = max(self.min_rate, self.rate * DECREASE)
@@ -11,7 +11,7 @@ from functools import lru_cache
 import math
 
 import pandas as pd
-import requests
+import instock.core.crawling.http_client as http_client
 
 __author__ = 'myh '
 __date__ = '2023/6/12 '
@@ -59,7 +59,7 @@ def stock_individual_fund_flow_rank(indicator: str = "5日") -> pd.DataFrame:
         "fs": "m:0+t:6+f:!2,m:0+t:13+f:!2,m:0+t:80+f:!2,m:1+t:2+f:!2,m:1+t:23+f:!2,m:0+t:7+f:!2,m:1+t:3+f:!2",
         "fields": indicator_map[indicator][1],
     }
-    r = requests.get(url, params=params)
+    r = http_client.get(url, params=params)
     data_json = r.json()
     data = data_json["data"]["diff"]
     data_count = data_json["data"]["total"]
@@ -67,7 +67,7 @@ def stock_individual_fund_flow_rank(indicator: str = "5日") -> pd.DataFrame:
     while page_count > 1:
         page_current = page_current + 1
         params["pn"] = page_current
-        r = requests.get(url, params=params)
+        r = http_client.get(url, params=params)
         data_json = r.json()
         _data = data_json["data"]["diff"]
         data.extend(_data)
@@ -288,7 +288,7 @@ def stock_sector_fund_flow_rank(
         "cb": "jQuery18308357908311220152_1589256588824",
         "_": int(time.time() * 1000),
     }
-    r = requests.get(url, params=params, headers=headers)
+    r = http_client.get(url, params=params, headers=headers)
     text_data = r.text
     data_json = json.loads(text_data[text_data.find("{") : -2])
     data = data_json["data"]["diff"]
@@ -298,7 +298,7 @@ def stock_sector_fund_flow_rank(
     while page_count > 1:
         page_current = page_current + 1
         params["pn"] = page_current
-        r = requests.get(url, params=params, headers=headers)
+        r = http_client.get(url, params=params, headers=headers)
         text_data = r.text
         json_data = json.loads(text_data[text_data.find("{"): -2])
         _data = json_data["data"]["diff"]
@@ -4,9 +4,9 @@
 Date: 2022/6/19 15:26
 Desc: 东方财富网-行情首页-沪深京 A 股
 """
-import requests
+import instock.core.crawling.http_client as http_client
+import instock.core.crawling.paging as paging
 import pandas as pd
-import math
 from functools import lru_cache
 
 
@@ -33,23 +33,10 @@ def stock_zh_a_spot_em() -> pd.DataFrame:
         "fields": "f2,f3,f4,f5,f6,f7,f8,f9,f10,f11,f12,f14,f15,f16,f17,f18,f20,f21,f22,f23,f24,f25,f26,f37,f38,f39,f40,f41,f45,f46,f48,f49,f57,f61,f100,f112,f113,f114,f115,f221",
         "_": "1623833739532",
     }
-    r = requests.get(url, params=params)
-    data_json = r.json()
-    data = data_json["data"]["diff"]
+    data = paging.fetch_pages(url, params, page_size)
     if not data:
         return pd.DataFrame()
 
-    data_count = data_json["data"]["total"]
-    page_count = math.ceil(data_count/page_size)
-    while page_count > 1:
-        page_current = page_current + 1
-        params["pn"] = page_current
-        r = requests.get(url, params=params)
-        data_json = r.json()
-        _data = data_json["data"]["diff"]
-        data.extend(_data)
-        page_count =page_count - 1
-
     temp_df = pd.DataFrame(data)
     temp_df.columns = [
         "最新价",
@@ -202,23 +189,10 @@ def code_id_map_em() -> dict:
         "fields": "f12",
         "_": "1623833739532",
     }
-    r = requests.get(url, params=params)
-    data_json = r.json()
-    data = data_json["data"]["diff"]
+    data = paging.fetch_pages(url, params, page_size)
     if not data:
         return dict()
 
-    data_count = data_json["data"]["total"]
-    page_count = math.ceil(data_count/page_size)
-    while page_count > 1:
-        page_current = page_current + 1
-        params["pn"] = page_current
-        r = requests.get(url, params=params)
-        data_json = r.json()
-        _data = data_json["data"]["diff"]
-        data.extend(_data)
-        page_count =page_count - 1
-
     temp_df = pd.DataFrame(data)
     temp_df["market_id"] = 1
     temp_df.columns = ["sh_code", "sh_id"]
@@ -237,23 +211,10 @@ def code_id_map_em() -> dict:
         "fields": "f12",
         "_": "1623833739532",
     }
-    r = requests.get(url, params=params)
-    data_json = r.json()
-    data = data_json["data"]["diff"]
+    data = paging.fetch_pages(url, params, page_size)
     if not data:
         return dict()
 
-    data_count = data_json["data"]["total"]
-    page_count = math.ceil(data_count/page_size)
-    while page_count > 1:
-        page_current = page_current + 1
-        params["pn"] = page_current
-        r = requests.get(url, params=params)
-        data_json = r.json()
-        _data = data_json["data"]["diff"]
-        data.extend(_data)
-        page_count =page_count - 1
-
     temp_df_sz = pd.DataFrame(data)
     temp_df_sz["sz_id"] = 0
     code_id_dict.update(dict(zip(temp_df_sz["f12"], temp_df_sz["sz_id"])))
@@ -271,38 +232,25 @@ def code_id_map_em() -> dict:
         "fields": "f12",
         "_": "1623833739532",
     }
-    r = requests.get(url, params=params)
-    data_json = r.json()
-    data = data_json["data"]["diff"]
+    data = paging.fetch_pages(url, params, page_size)
     if not data:
         return dict()
 
-    data_count = data_json["data"]["total"]
-    page_count = math.ceil(data_count/page_size)
-    while page_count > 1:
-        page_current = page_current + 1
-        params["pn"] = page_current
-        r = requests.get(url, params=params)
-        data_json = r.json()
-        _data = data_json["data"]["diff"]
-        data.extend(_data)
-        page_count =page_count - 1
-
     temp_df_sz = pd.DataFrame(data)
     temp_df_sz["bj_id"] = 0
     code_id_dict.update(dict(zip(temp_df_sz["f12"], temp_df_sz["bj_id"])))
     return code_id_dict
 
 
-def stock_zh_a_hist(
+def stock_zh_a_hist_request(
     symbol: str = "000001",
     period: str = "daily",
     start_date: str = "19700101",
     end_date: str = "20500101",
     adjust: str = "",
-) -> pd.DataFrame:
+) -> tuple:
     """
-    东方财富网-行情首页-沪深京 A 股-每日行情
+    东方财富网-行情首页-沪深京 A 股-每日行情的请求地址和参数
     https://quote.eastmoney.com/concept/sh603777.html?from=classic
     :param symbol: 股票代码
     :type symbol: str
@@ -314,8 +262,8 @@ def stock_zh_a_hist(
     :type end_date: str
     :param adjust: choice of {"qfq": "前复权", "hfq": "后复权", "": "不复权"}
     :type adjust: str
-    :return: 每日行情
-    :rtype: pandas.DataFrame
+    :return: (请求地址, 请求参数)
+    :rtype: tuple
     """
     code_id_dict = code_id_map_em()
     adjust_dict = {"qfq": "1", "hfq": "2", "": "0"}
@@ -332,8 +280,17 @@ def stock_zh_a_hist(
         "end": end_date,
         "_": "1623766962675",
     }
-    r = requests.get(url, params=params)
-    data_json = r.json()
+    return url, params
+
+
+def stock_zh_a_hist_frame(data_json: dict) -> pd.DataFrame:
+    """
+    东方财富网-行情首页-沪深京 A 股-每日行情的返回json转换为DataFrame
+    :param data_json: 返回的json
+    :type data_json: dict
+    :return: 每日行情
+    :rtype: pandas.DataFrame
+    """
     if not (data_json["data"] and data_json["data"]["klines"]):
         return pd.DataFrame()
     temp_df = pd.DataFrame(
@@ -369,6 +326,34 @@ def stock_zh_a_hist(
     return temp_df
 
 
+def stock_zh_a_hist(
+    symbol: str = "000001",
+    period: str = "daily",
+    start_date: str = "19700101",
+    end_date: str = "20500101",
+    adjust: str = "",
+) -> pd.DataFrame:
+    """
+    东方财富网-行情首页-沪深京 A 股-每日行情
+    https://quote.eastmoney.com/concept/sh603777.html?from=classic
+    :param symbol: 股票代码
+    :type symbol: str
+    :param period: choice of {'daily', 'weekly', 'monthly'}
+    :type period: str
+    :param start_date: 开始日期
+    :type start_date: str
+    :param end_date: 结束日期
+    :type end_date: str
+    :param adjust: choice of {"qfq": "前复权", "hfq": "后复权", "": "不复权"}
+    :type adjust: str
+    :return: 每日行情
+    :rtype: pandas.DataFrame
+    """
+    url, params = stock_zh_a_hist_request(symbol, period, start_date, end_date, adjust)
+    r = http_client.get(url, params=params)
+    return stock_zh_a_hist_frame(r.json())
+
+
 def stock_zh_a_hist_min_em(
     symbol: str = "000001",
     start_date: str = "1979-09-01 09:32:00",
@@ -409,7 +394,7 @@ def stock_zh_a_hist_min_em(
             "secid": f"{code_id_dict[symbol]}.{symbol}",
             "_": "1623766962675",
         }
-        r = requests.get(url, params=params)
+        r = http_client.get(url, params=params)
         data_json = r.json()
         temp_df = pd.DataFrame(
             [item.split(",") for item in data_json["data"]["trends"]]
@@ -449,7 +434,7 @@ def stock_zh_a_hist_min_em(
             "end": "20500000",
             "_": "1630930917857",
         }
-        r = requests.get(url, params=params)
+        r = http_client.get(url, params=params)
         data_json = r.json()
         temp_df = pd.DataFrame(
             [item.split(",") for item in data_json["data"]["klines"]]
@@ -528,7 +513,7 @@ def stock_zh_a_hist_pre_min_em(
         "secid": f"{code_id_dict[symbol]}.{symbol}",
         "_": "1623766962675",
     }
-    r = requests.get(url, params=params)
+    r = http_client.get(url, params=params)
     data_json = r.json()
     temp_df = pd.DataFrame(
         [item.split(",") for item in data_json["data"]["trends"]]
@@ -8,8 +8,7 @@ https://finance.sina.com.cn/realstock/company/klc_td_sh.txt
 """
 import datetime
 import pandas as pd
-import requests
-from py_mini_racer import MiniRacer
+import instock.core.crawling.http_client as http_client
 
 hk_js_decode = """
 function d(t) {
@@ -309,8 +308,10 @@ def tool_trade_date_hist_sina() -> pd.DataFrame:
     :return: 交易日历
     :rtype: pandas.DataFrame
     """
+    from py_mini_racer import MiniRacer  # 只有下载日历时才需要js引擎
+
     url = "https://finance.sina.com.cn/realstock/company/klc_td_sh.txt"
-    r = requests.get(url)
+    r = http_client.get(url)
     js_code = MiniRacer()
     js_code.eval(hk_js_decode)
     dict_list = js_code.call(
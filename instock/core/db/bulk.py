@@ -0,0 +1,60 @@
+import logging
+import time
+
+import pandas as pd
+from sqlalchemy import select, tuple_
+
+import instock.lib.database as mdb
+
+# 每批写入的行数，pymysql的executemany会把一批INSERT合并成多行VALUES语句
+BATCH_SIZE = mdb.UPSERT_BATCH_SIZE
+
+
+def table_columns(model, data):
+    """DataFrame中属于模型表的列，按表定义的顺序"""
+    columns = set(data.columns)
+    return [c.name for c in model.__table__.columns if c.name in columns]
+
+
+def primary_keys(model):
+    """模型表的主键列名"""
+    return [c.name for c in model.__table__.primary_key.columns]
+
+
+def upsert_df(db, model, data, where=None, batch_size=BATCH_SIZE):
+    """以INSERT ... ON DUPLICATE KEY UPDATE幂等写入，代替先删除再插入
+
+    where为本次写入范围的条件(如 StockSpot.date == date)，给出时先读出范围内的已有数据，
+    只写入新增或有变化的行，并删除范围内已不在data中的行；不给出时直接upsert全部行。
+    与会话中的其它操作在同一事务中，由调用方commit。返回写入的行数。
+    """
+    if data is None or len(data.index) == 0:
+        return 0
+    table = model.__table__
+    start = time.time()
+    keys = primary_keys(model)
+    data = data[table_columns(model, data)]
+    stale = []
+    if where is not None:
+        columns = data.columns.tolist()
+        result = db.execute(select(*[table.c[c] for c in columns]).where(where))
+        existing = pd.DataFrame(result.fetchall(), columns=columns)
+        data, stale = mdb.diff_rows(data, existing, keys)
+        if stale:
+            pk = tuple_(*[table.c[k] for k in keys])
+            for b in range(0, len(stale), batch_size):
+                db.execute(table.delete().where(pk.in_(stale[b:b + batch_size])))
+    cursor = db.connection().connection.cursor()
+    try:
+        count = mdb.upsert_rows(cursor, table.name, data, keys, batch_size)
+    finally:
+        cursor.close()
+    _log_rate("upsert_df", table.name, count, start)
+    if stale:
+        logging.info(f"bulk.upsert_df：{table.name}表删除{len(stale)}行")
+    return count
+
+
+def _log_rate(func, table, count, start):
+    elapsed = time.time() - start
+    logging.info(f"bulk.{func}：{table}表{count}行，{elapsed:.2f}秒，{count / max(elapsed, 1e-6):.0f}行/秒")
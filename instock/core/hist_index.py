@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import threading
+import weakref
+import numpy as np
+
+__author__ = 'myh '
+__date__ = '2023/3/10 '
+
+# 历史数据DataFrame的日期索引。
+# 历史数据按日期升序，date列为YYYY-MM-DD字符串。每个DataFrame对应一个int32天数(1970-01-01起)的有序数组，
+# 截止日期的位置用二分查找(O(log n))，按位置切片取前面的行，不再对整列做字符串比较生成掩码。
+# 切片是原DataFrame的视图，不复制；需要增加列时由调用方对截取后的少量行copy。
+# 索引按DataFrame对象缓存，对象释放时一起释放。列式存储、面板生成DataFrame时直接登记已有的天数，不需要再解析字符串。
+# 已登记的DataFrame不能再修改date列。
+# 日期转换用hist_store的函数，hist_store导入的tablestructure又通过策略模块导入本模块，在函数内导入避免循环导入。
+_indexes = {}
+_lock = threading.Lock()
+
+
+def _release(key):
+    with _lock:
+        _indexes.pop(key, None)
+
+
+# 登记DataFrame的日期索引，nums为与行对应的int32天数。
+def register(data, nums):
+    key = id(data)
+    with _lock:
+        _indexes[key] = (weakref.ref(data, lambda r, k=key: _release(k)), nums)
+    return data
+
+
+# DataFrame的日期索引(int32天数数组)，未登记的由date列生成并登记。
+def date_index(data):
+    item = _indexes.get(id(data))
+    if item is not None and item[0]() is data:
+        return item[1]
+    import instock.core.hist_store as hst
+    nums = hst.dates_to_num(data['date'].values)
+    register(data, nums)
+    return nums
+
+
+# 日期不晚于end_date的行数，即截止end_date(含)的切片终点。
+def cut(data, end_date):
+    import instock.core.hist_store as hst
+    return int(np.searchsorted(date_index(data), hst.date_to_num(end_date), side='right'))
+
+
+# 第一个日期不早于start_date的行号。
+def start(data, start_date):
+    import instock.core.hist_store as hst
+    return int(np.searchsorted(date_index(data), hst.date_to_num(start_date), side='left'))
+
+
+# 截止end_date(含)的最后length行，为原DataFrame的视图。end_date为None时不按日期截取，length为None时不限行数。
+def history(data, end_date=None, length=None):
+    end = len(data.index) if end_date is None else cut(data, end_date)
+    begin = 0 if length is None else max(0, end - length)
+    if begin == 0 and end == len(data.index):
+        return data
+    return data.iloc[begin:end]
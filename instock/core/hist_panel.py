@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import collections
+import threading
+import weakref
+import numpy as np
+import pandas as pd
+import instock.core.hist_store as hst
+import instock.core.hist_index as hix
+
+__author__ = 'myh '
+__date__ = '2023/3/10 '
+
+# 全市场历史数据面板。
+# 每列一个 (日期数, 股票数) 数组，mask标记该股票当日是否有K线(停牌、未上市为False)。
+# 价格、振幅等两位小数的列按分存为int32，成交量按手存为int32，读取时换算回float64，与原值完全相同；
+# 构建时逐列检查，不能无损换算的列(超出int32范围或不是两位小数)保存为float64。
+# p_change不保存，读取时由收盘价计算(与 tl.ROC(close, 1) 一致，每只股票第一根K线为0)。
+# 按 (date, code, name) 取值时才按需生成单只股票的DataFrame，兼容原来dict的用法；
+# 生成的DataFrame在仍被引用时和最近FRAME_CACHE个内重复取值返回同一对象。
+PANEL_COLUMNS = ('open', 'close', 'high', 'low', 'volume', 'amount', 'amplitude', 'quote_change',
+                 'ups_downs', 'turnover', 'p_change')
+STORED_COLUMNS = PANEL_COLUMNS[:-1]
+FRAME_CACHE = 64
+_MISSING = np.iinfo(np.int32).min
+# (运算, 系数)：保存值 运算 系数 = 原值。
+_CODECS = (("div", 100), ("mul", 100))
+
+
+def _decode(values, codec):
+    if codec is None:
+        return np.array(values, dtype=np.float64)
+    out = values.astype(np.float64)
+    out[values == _MISSING] = np.nan
+    op, k = codec
+    return out / k if op == "div" else out * k
+
+
+# 无损换算为int32的列返回 (int32数组, 换算方式)，否则返回 (float64数组, None)。
+def _encode(values):
+    valid = ~np.isnan(values)
+    for codec in _CODECS:
+        op, k = codec
+        with np.errstate(invalid="ignore", over="ignore"):
+            scaled = np.rint(values * k if op == "div" else values / k)
+        if not (np.abs(scaled[valid]) < _MISSING * -1.0).all():
+            continue
+        stored = np.where(valid, scaled, _MISSING).astype(np.int32)
+        if np.array_equal(_decode(stored, codec)[valid], values[valid]):
+            return stored, codec
+    return values, None
+
+
+class stock_hist_panel:
+    def __init__(self, keys, dates, arrays, mask, codecs):
+        self.keys_list = list(keys)
+        self.codes = [k[1] for k in self.keys_list]
+        self.dates = dates  # int32天数，升序
+        self.arrays = arrays  # {列名: (len(dates), len(codes))}，不含p_change
+        self.codecs = codecs  # {列名: 换算方式}，None为float64
+        self.mask = mask
+        self._key_index = {k: j for j, k in enumerate(self.keys_list)}
+        self._code_index = {c: j for j, c in enumerate(self.codes)}
+        self._frames = weakref.WeakValueDictionary()
+        self._recent = collections.OrderedDict()
+        self._frames_lock = threading.Lock()
+
+    @classmethod
+    def _build(cls, keys, dates, mask, fill):
+        arrays, codecs = {}, {}
+        for c in STORED_COLUMNS:
+            values = np.full(mask.shape, np.nan, dtype=np.float64)
+            fill(c, values)
+            arrays[c], codecs[c] = _encode(values)
+        return cls(keys, dates, arrays, mask, codecs)
+
+    # 由每只股票的DataFrame构建面板，构建后DataFrame可以释放。
+    @classmethod
+    def from_frames(cls, frames):
+        keys = list(frames.keys())
+        nums = {}
+        for k in keys:
+            nums[k] = hst.dates_to_num(frames[k]['date'].values)
+        if nums:
+            dates = np.unique(np.concatenate(list(nums.values())))
+        else:
+            dates = np.empty(0, dtype=np.int32)
+        mask = np.zeros((len(dates), len(keys)), dtype=bool)
+        rows = [np.searchsorted(dates, nums[k]) for k in keys]
+        for j in range(len(keys)):
+            mask[rows[j], j] = True
+
+        def fill(c, values):
+            for j, k in enumerate(keys):
+                values[rows[j], j] = frames[k][c].values
+        return cls._build(keys, dates, mask, fill)
+
+    # 直接由列式存储构建面板，不经过DataFrame，数据处理与fetch_stock_hist一致(p_change、成交量手变股)。
+    # names为 {代码: 名称}，只取其中的股票；为None时取存储中的全部股票，名称为空。
+    @classmethod
+    def from_store(cls, adjust="qfq", names=None, date_start=None):
+        codes, offsets, columns = hst.get_store(adjust).arrays()
+        codes = codes.tolist()
+        sel = [i for i, c in enumerate(codes) if names is None or c in names]
+        lengths = np.diff(offsets)[sel]
+        idx = np.concatenate([np.arange(offsets[i], offsets[i + 1]) for i in sel]) if sel else np.empty(0, dtype=np.int64)
+        col = np.repeat(np.arange(len(sel)), lengths)
+        date = np.asarray(columns["date"])[idx]
+        if date_start is not None:
+            keep = date >= hst.date_to_num(date_start)
+            idx, col, date = idx[keep], col[keep], date[keep]
+        dates = np.unique(date)
+        rows = np.searchsorted(dates, date)
+        mask = np.zeros((len(dates), len(sel)), dtype=bool)
+        mask[rows, col] = True
+
+        def fill(c, values):
+            values[rows, col] = np.asarray(columns[c])[idx]
+            if c == 'volume':
+                values *= 100  # 成交量单位从手变成股。
+        end = hst.num_to_dates(dates[-1:])[0] if len(dates) > 0 else None
+        keys = [(end, codes[i], '' if names is None else names[codes[i]]) for i in sel]
+        return cls._build(keys, dates, mask, fill)
+
+    # 与 tl.ROC(close, 1) 一致。close为按时间排列的收盘价，first标记每只股票的第一根K线(为0)。
+    @staticmethod
+    def _roc(close, first):
+        p = np.zeros(len(close))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            prev = close[:-1]
+            p[1:] = np.where(prev != 0.0, ((close[1:] / prev) - 1.0) * 100.0, 0.0)
+        p[first] = 0.0
+        return p
+
+    # (行, 股票) 之前最近一根K线的行号，没有为-1。
+    def _prev_rows(self, rows, cols):
+        t = np.arange(len(self.dates))[:, None]
+        last = np.maximum.accumulate(np.where(self.mask[:, cols], t, -1), axis=0)
+        k = np.arange(len(cols))
+        return np.where(rows > 0, last[np.maximum(rows - 1, 0), k], -1)
+
+    # 指定 (行, 股票) 的值，float64。
+    def cells(self, name, rows, cols):
+        rows = np.asarray(rows)
+        cols = np.asarray(cols)
+        if name == 'p_change':
+            close = self.cells('close', rows, cols)
+            prev = self._prev_rows(rows, cols)
+            prev_close = self.cells('close', np.maximum(prev, 0), cols)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                p = np.where((prev >= 0) & (prev_close != 0.0), ((close / prev_close) - 1.0) * 100.0, 0.0)
+            return np.where(self.mask[rows, cols], p, np.nan)
+        return _decode(self.arrays[name][rows, cols], self.codecs[name])
+
+    # 整列数据 (日期数, 股票数) float64，无K线处为NaN。每次调用生成新数组。
+    def column(self, name):
+        if name == 'p_change':
+            out = np.full(self.mask.shape, np.nan)
+            n_idx, t_idx = np.nonzero(self.mask.T)
+            close = _decode(self.arrays['close'][t_idx, n_idx], self.codecs['close'])
+            out[t_idx, n_idx] = self._roc(close, np.r_[True, n_idx[1:] != n_idx[:-1]])
+            return out
+        return _decode(self.arrays[name], self.codecs[name])
+
+    def code_index(self, code):
+        return self._code_index.get(code)
+
+    # (date, code, name) 对应的股票序号，不存在返回None。
+    def key_index(self, key):
+        return self._key_index.get(key)
+
+    # 日期(YYYY-MM-DD或date)对应的截止行，返回dates中<=该日期的行数。
+    def date_cut(self, end_date):
+        if end_date is None:
+            return len(self.dates)
+        return int(np.searchsorted(self.dates, hst.date_to_num(str(end_date)), side='right'))
+
+    # 每只股票截止end_date的最后length根K线，按股票右对齐(最后一行是每只股票的最后一根K线)，
+    # 不足length的在前面补NaN。返回 ({列名: (length, 股票数)}, 每只股票的K线数, 日期(length, 股票数))。
+    # index为股票序号数组时只取这些股票。
+    def packed(self, columns, end_date=None, length=None, index=None):
+        cut = self.date_cut(end_date)
+        mask = self.mask[:cut]
+        if index is not None:
+            mask = mask[:, index]
+        counts = mask.sum(axis=0)
+        if length is None:
+            length = int(counts.max()) if len(counts) > 0 else 0
+        n_idx, t_idx = np.nonzero(mask.T)
+        starts = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=starts[1:])
+        pos = np.arange(len(n_idx)) - starts[n_idx]
+        dest = length - counts[n_idx] + pos
+        # 多取每只股票窗口前的一根K线，用来计算窗口第一根的p_change。
+        keep = dest >= -1
+        n_idx, t_idx, dest, pos = n_idx[keep], t_idx[keep], dest[keep], pos[keep]
+        src = n_idx if index is None else np.asarray(index)[n_idx]
+        inside = dest >= 0
+        result = {}
+        for c in columns:
+            if c == 'p_change':
+                close = _decode(self.arrays['close'][t_idx, src], self.codecs['close'])
+                values = self._roc(close, pos == 0)
+            else:
+                values = _decode(self.arrays[c][t_idx, src], self.codecs[c])
+            out = np.full((length, len(counts)), np.nan, dtype=np.float64)
+            out[dest[inside], n_idx[inside]] = values[inside]
+            result[c] = out
+        date_out = np.full((length, len(counts)), -1, dtype=np.int32)
+        date_out[dest[inside], n_idx[inside]] = self.dates[t_idx[inside]]
+        return result, np.minimum(counts, length), date_out
+
+    # 单只股票的DataFrame，列与fetch_stock_hist返回的一致。
+    def frame(self, j):
+        with self._frames_lock:
+            data = self._frames.get(j)
+            if data is not None:
+                self._recent[j] = data
+                self._recent.move_to_end(j)
+                return data
+        rows = np.flatnonzero(self.mask[:, j])
+        nums = self.dates[rows]
+        data = {'date': hst.num_to_dates(nums).astype(object)}
+        for c in STORED_COLUMNS:
+            data[c] = _decode(self.arrays[c][rows, j], self.codecs[c])
+        data['p_change'] = self._roc(data['close'], np.arange(len(rows)) == 0)
+        data = hix.register(pd.DataFrame(data, columns=['date', *PANEL_COLUMNS]), nums)
+        with self._frames_lock:
+            self._frames[j] = data
+            self._recent[j] = data
+            while len(self._recent) > FRAME_CACHE:
+                self._recent.popitem(last=False)
+        return data
+
+    # 以下兼容 dict[(date, code, name)] = DataFrame 的用法。
+    def __getitem__(self, key):
+        return self.frame(self._key_index[key])
+
+    def get(self, key, default=None):
+        j = self._key_index.get(key)
+        if j is None:
+            return default
+        return self.frame(j)
+
+    def __contains__(self, key):
+        return key in self._key_index
+
+    def __iter__(self):
+        return iter(self.keys_list)
+
+    def __len__(self):
+        return len(self.keys_list)
+
+    def keys(self):
+        return list(self.keys_list)
+
+    def items(self):
+        for j, k in enumerate(self.keys_list):
+            yield k, self.frame(j)
+
+    def values(self):
+        return [self.frame(j) for j in range(len(self.keys_list))]
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import contextlib
+import logging
+import os.path
+import shutil
+import threading
+import time
+import numpy as np
+import pandas as pd
+import instock.core.tablestructure as tbs
+import instock.core.hist_index as hix
+
+__author__ = 'myh '
+__date__ = '2023/3/10 '
+
+# 股票历史数据列式存储。
+# 每个复权类型一个目录，每列一个.npy文件，所有股票按代码顺序首尾相接存放，
+# offsets记录每只股票在列中的起止位置。日期保存为int32天数(1970-01-01起)，
+# 其它列为float64，读取时np.load(mmap_mode="r")直接映射，不需要解压和反序列化。
+# 写入时整体生成新版本目录，再原子替换CURRENT文件，正在读的进程不受影响。
+# 多个进程写入时用LOCK文件加锁，锁内重新读取CURRENT再合并写出，不会覆盖其它进程刚写入的版本。
+cpath_current = os.path.dirname(os.path.dirname(__file__))
+stock_hist_columnar_path = os.path.join(cpath_current, "cache", "hist", "columnar")
+
+HIST_COLUMNS = tuple(tbs.CN_STOCK_HIST_DATA['columns'])
+HIST_VALUE_COLUMNS = HIST_COLUMNS[1:]
+_CURRENT_FILE = "CURRENT"
+_LOCK_FILE = "LOCK"
+_ADJUST_DIR = {"": "bfq", "qfq": "qfq", "hfq": "hfq"}
+
+
+# 日期字符串(YYYY-MM-DD或YYYYMMDD)或datetime.date转换为int32天数。
+def date_to_num(date):
+    if isinstance(date, str) and len(date) == 8:
+        date = f"{date[0:4]}-{date[4:6]}-{date[6:8]}"
+    return np.int32(np.datetime64(date, 'D').astype(np.int64))
+
+
+# 日期字符串数组转换为int32天数数组。
+def dates_to_num(dates):
+    return np.asarray(dates, dtype='datetime64[D]').astype(np.int32)
+
+
+# int32天数数组转换为日期字符串(YYYY-MM-DD)数组。
+def num_to_dates(nums):
+    return np.datetime_as_string(np.asarray(nums, dtype=np.int64).astype('datetime64[D]'), unit='D')
+
+
+# 进程间互斥锁，锁在path目录的LOCK文件上，进程退出时系统自动释放。
+@contextlib.contextmanager
+def _file_lock(path):
+    with open(os.path.join(path, _LOCK_FILE), "a+b") as f:
+        if os.name == "nt":
+            import msvcrt
+            while True:
+                try:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass  # LK_LOCK重试10秒后仍未取得，继续等待。
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class stock_hist_store:
+    def __init__(self, adjust=""):
+        self.path = os.path.join(stock_hist_columnar_path, _ADJUST_DIR[adjust])
+        self._lock = threading.RLock()
+        self._generation = None
+        self._codes = np.empty(0, dtype='U6')
+        self._starts = np.empty(0, dtype=np.int32)
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._columns = {}
+        self._index = {}
+        self._staged = {}
+        self.load()
+
+    # CURRENT文件记录的版本，没有返回None。
+    def _current(self):
+        current = os.path.join(self.path, _CURRENT_FILE)
+        if not os.path.isfile(current):
+            return None
+        with open(current, "r") as f:
+            return f.read().strip()
+
+    # 映射当前版本的所有列文件，其它进程已写入新版本时切换到新版本。
+    def load(self):
+        with self._lock:
+            try:
+                generation = self._current()
+                if generation is None or generation == self._generation:
+                    return
+                gen_path = os.path.join(self.path, generation)
+                self._codes = np.load(os.path.join(gen_path, "codes.npy"))
+                self._starts = np.load(os.path.join(gen_path, "starts.npy"))
+                self._offsets = np.load(os.path.join(gen_path, "offsets.npy"))
+                self._columns = {k: np.load(os.path.join(gen_path, f"{k}.npy"), mmap_mode="r") for k in HIST_COLUMNS}
+                self._index = {c: i for i, c in enumerate(self._codes.tolist())}
+                self._generation = generation
+            except Exception as e:
+                logging.error(f"hist_store.stock_hist_store.load处理异常：{self.path}{e}")
+
+    # 读取股票历史数据，返回(开始日期YYYYMMDD, DataFrame)，不存在返回None。
+    # 不检查其它进程写入的新版本，批量读取前由调用方load一次。
+    def get(self, code):
+        with self._lock:
+            staged = self._staged.get(code)
+            if staged is not None:
+                return staged[0], staged[1].copy()
+            i = self._index.get(code)
+            if i is None:
+                return None
+            start = num_to_dates([self._starts[i]])[0].replace("-", "")
+            return start, self._frame(i)
+
+    def _frame(self, i):
+        b, e = self._offsets[i], self._offsets[i + 1]
+        nums = np.array(self._columns["date"][b:e])
+        data = {"date": num_to_dates(nums).astype(object)}
+        for k in HIST_VALUE_COLUMNS:
+            data[k] = np.array(self._columns[k][b:e])
+        return hix.register(pd.DataFrame(data), nums)
+
+    # 暂存更新的股票数据，commit时统一写入。
+    def stage(self, code, start, data):
+        with self._lock:
+            self._staged[code] = (start, data.copy())
+
+    # 所有股票的列数据(只读映射)，供整体加载使用。
+    def arrays(self):
+        with self._lock:
+            self.load()
+            return self._codes, self._offsets, self._columns
+
+    # 将暂存数据与当前版本合并，写出新版本。
+    # 加进程间锁后重新加载CURRENT，合并的是最新版本，其它进程在本进程之前提交的数据不会丢失。
+    def commit(self):
+        with self._lock:
+            if not self._staged:
+                return
+            try:
+                os.makedirs(self.path, exist_ok=True)
+                with _file_lock(self.path):
+                    self._commit()
+            except Exception as e:
+                logging.error(f"hist_store.stock_hist_store.commit处理异常：{self.path}{e}")
+
+    def _commit(self):
+        self.load()
+        if self._current() != self._generation:
+            raise RuntimeError(f"加载当前版本{self._current()}失败")
+        codes = list(self._index.keys())
+        codes.extend(c for c in self._staged if c not in self._index)
+        codes.sort()
+        starts = np.empty(len(codes), dtype=np.int32)
+        lengths = np.empty(len(codes), dtype=np.int64)
+        parts = {k: [] for k in HIST_COLUMNS}
+        for j, code in enumerate(codes):
+            staged = self._staged.get(code)
+            if staged is not None:
+                starts[j] = date_to_num(staged[0])
+                parts["date"].append(dates_to_num(staged[1]["date"].values))
+                for k in HIST_VALUE_COLUMNS:
+                    parts[k].append(staged[1][k].values.astype(np.float64))
+            else:
+                i = self._index[code]
+                b, e = self._offsets[i], self._offsets[i + 1]
+                starts[j] = self._starts[i]
+                for k in HIST_COLUMNS:
+                    parts[k].append(self._columns[k][b:e])
+            lengths[j] = len(parts["date"][-1])
+        offsets = np.zeros(len(codes) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+
+        # 版本名按写入时间排序。
+        now = time.time_ns()
+        generation = f"{time.strftime('%Y%m%d%H%M%S', time.localtime(now // 1000000000))}_" \
+                     f"{now % 1000000000:09d}_{os.getpid()}"
+        gen_path = os.path.join(self.path, generation)
+        os.makedirs(gen_path)
+        np.save(os.path.join(gen_path, "codes.npy"), np.array(codes, dtype='U6'))
+        np.save(os.path.join(gen_path, "starts.npy"), starts)
+        np.save(os.path.join(gen_path, "offsets.npy"), offsets)
+        for k in HIST_COLUMNS:
+            dtype = np.int32 if k == "date" else np.float64
+            col = np.concatenate(parts[k]).astype(dtype, copy=False) if parts[k] else np.empty(0, dtype=dtype)
+            np.save(os.path.join(gen_path, f"{k}.npy"), col)
+            parts[k] = None
+        tmp_current = os.path.join(self.path, f"{_CURRENT_FILE}.{os.getpid()}.tmp")
+        with open(tmp_current, "w") as f:
+            f.write(generation)
+        os.replace(tmp_current, os.path.join(self.path, _CURRENT_FILE))
+        old_generation = self._generation
+        self._staged = {}
+        self.load()
+        self._cleanup(old_generation)
+
+    # 删除比刚写入的版本更早的版本目录(保留被替换的keep)，在进程间锁内调用，不会删除其它进程正在写入的版本。
+    # 已映射旧文件的进程在Linux下不受影响，Windows下删除失败忽略。
+    def _cleanup(self, keep):
+        try:
+            for name in os.listdir(self.path):
+                gen_path = os.path.join(self.path, name)
+                if name >= self._generation or name == keep or not os.path.isdir(gen_path):
+                    continue
+                shutil.rmtree(gen_path, ignore_errors=True)
+        except Exception:
+            pass
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+# 每个复权类型一个存储对象。
+def get_store(adjust=""):
+    with _stores_lock:
+        store = _stores.get(adjust)
+        if store is None:
+            os.makedirs(os.path.join(stock_hist_columnar_path, _ADJUST_DIR[adjust]), exist_ok=True)
+            store = stock_hist_store(adjust)
+            _stores[adjust] = store
+        return store
@@ -5,6 +5,9 @@ import logging
 import pandas as pd
 import numpy as np
 import talib as tl
+import instock.core.indicator.calculate_indicator_panel as pidr
+import instock.core.indicator.kernels as krn
+import instock.core.hist_index as hix
 
 __author__ = "myh "
 __date__ = "2023/3/10 "
@@ -12,17 +15,9 @@ __date__ = "2023/3/10 "
 
 def get_indicators(data, end_date=None, threshold=120, calc_threshold=None):
     try:
-        isCopy = False
-        if end_date is not None:
-            mask = data["date"] <= end_date
-            data = data.loc[mask]
-            isCopy = True
-        if calc_threshold is not None:
-            data = data.tail(n=calc_threshold)
-            isCopy = True
-
-        if isCopy:
-            data = data.copy()
+        # 按日期索引截取最后calc_threshold行，只复制截取后的行。
+        if end_date is not None or calc_threshold is not None:
+            data = hix.history(data, end_date, calc_threshold).copy()
 
         # import stockstats
         # test = data.copy()
@@ -314,51 +309,9 @@ def get_indicators(data, end_date=None, threshold=120, calc_threshold=None):
             data.loc[:, "hl_avg"] = (data["high"].values + data["low"].values) / 2.0
             data.loc[:, "b_ub"] = data["hl_avg"].values + data["m_atr"].values
             data.loc[:, "b_lb"] = data["hl_avg"].values - data["m_atr"].values
-            size = len(data.index)
-            ub = np.empty(size, dtype=np.float64)
-            lb = np.empty(size, dtype=np.float64)
-            st = np.empty(size, dtype=np.float64)
-            for i in range(size):
-                if i == 0:
-                    ub[i] = data["b_ub"].iloc[i]
-                    lb[i] = data["b_lb"].iloc[i]
-                    if data["close"].iloc[i] <= ub[i]:
-                        st[i] = ub[i]
-                    else:
-                        st[i] = lb[i]
-                    continue
-
-                last_close = data["close"].iloc[i - 1]
-                curr_close = data["close"].iloc[i]
-                last_ub = ub[i - 1]
-                last_lb = lb[i - 1]
-                last_st = st[i - 1]
-                curr_b_ub = data["b_ub"].iloc[i]
-                curr_b_lb = data["b_lb"].iloc[i]
-
-                # calculate current upper band
-                if curr_b_ub < last_ub or last_close > last_ub:
-                    ub[i] = curr_b_ub
-                else:
-                    ub[i] = last_ub
-
-                # calculate current lower band
-                if curr_b_lb > last_lb or last_close < last_lb:
-                    lb[i] = curr_b_lb
-                else:
-                    lb[i] = last_lb
-
-                # calculate supertrend
-                if last_st == last_ub:
-                    if curr_close <= ub[i]:
-                        st[i] = ub[i]
-                    else:
-                        st[i] = lb[i]
-                elif last_st == last_lb:
-                    if curr_close > lb[i]:
-                        st[i] = lb[i]
-                    else:
-                        st[i] = ub[i]
+            ub, lb, st = krn.supertrend(
+                data["close"].values, data["b_ub"].values, data["b_lb"].values
+            )
 
             data.loc[:, "supertrend_ub"] = ub
             data.loc[:, "supertrend_lb"] = lb
@@ -553,6 +506,28 @@ def get_indicators(data, end_date=None, threshold=120, calc_threshold=None):
     return None
 
 
+# 只计算columns中的指标及其依赖，返回截取后的data加上这些列，同名列结果与get_indicators相同。
+# 可选列见 calculate_indicator_panel.all_columns。
+def compute(data, columns, end_date=None, threshold=120, calc_threshold=None):
+    try:
+        data = hix.history(data, end_date, calc_threshold).copy()
+        arrays = {c: data[c].values.astype(np.float64).reshape(-1, 1) for c in pidr.INPUT_COLUMNS}
+        d = pidr.compute(arrays, columns, np.array([len(data.index)]))
+        if d is None:
+            return None
+        for c in columns:
+            if c not in data.columns:
+                data[c] = d[c][:, 0]
+        if threshold is not None:
+            data = data.tail(n=threshold).copy()
+        return data
+    except Exception as e:
+        logging.error(
+            f"calculate_indicator.compute处理异常：{data['code'] if 'code' in data else ''}代码{e}"
+        )
+    return None
+
+
 def get_indicator(code_name, data, stock_column, date=None, calc_threshold=90):
     try:
         if date is None:
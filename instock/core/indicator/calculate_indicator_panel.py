@@ -0,0 +1,1088 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+import time
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+import instock.core.tablestructure as tbs
+import instock.core.indicator.kernels as krn
+
+__author__ = "myh "
+__date__ = "2023/3/10 "
+
+# 全市场指标一次计算。
+# 输入是 stock_hist_panel.packed 得到的 (K线数, 股票数) 二维数组，每只股票右对齐，前面不足部分为NaN。
+# 计算公式与 calculate_indicator.get_indicators 完全一致，talib函数按其C实现逐项复现：
+# 起算位置(跳过前导NaN后的lookback)、种子值(前n个值顺序累加求均值)、滑动和(先加后减的递推)，
+# 因此结果与逐只股票调用talib相同。递推只沿时间方向循环，每一步对所有股票同时计算，
+# 循环次数只和K线数有关，与股票数无关。
+
+INPUT_COLUMNS = ("open", "high", "low", "close", "volume", "amount", "p_change")
+
+
+# 每列第一个所有输入都不是NaN的行，对应talib包装层跳过前导NaN的处理，全为NaN返回行数。
+def _begin(*arrays):
+    ok = ~np.isnan(arrays[0])
+    for a in arrays[1:]:
+        ok &= ~np.isnan(a)
+    return np.where(ok.any(axis=0), ok.argmax(axis=0), ok.shape[0])
+
+
+def _rows(x):
+    return np.arange(x.shape[0])[:, None]
+
+
+# talib SUM：先累加前n-1个值，之后每步加新值、输出、再减去最早的值。
+def SUM(x, n):
+    size = x.shape[0]
+    b = _begin(x)
+    out = np.full(x.shape, np.nan)
+    total = np.zeros(x.shape[1])
+    for t in range(min(b.min(initial=size), size), size):
+        total = np.where(t >= b, total + x[t], total)
+        ready = t >= b + n - 1
+        out[t] = np.where(ready, total, np.nan)
+        if t - n + 1 >= 0:
+            total = np.where(ready, total - x[t - n + 1], total)
+    return out
+
+
+# talib MA(matype=0)，即SMA。
+def MA(x, n):
+    return SUM(x, n) / n
+
+
+# talib EMA：前n个值顺序累加求均值作为种子，之后 prev = (x - prev) * k + prev。
+# seed用于MACD的快线，种子位置后移到慢线的起算位置。
+def EMA(x, n, seed=None):
+    size = x.shape[0]
+    k = 2.0 / (n + 1)
+    r0 = _begin(x) + (n - 1 if seed is None else seed)
+    cols = np.arange(x.shape[1])
+    seed_val = np.zeros(x.shape[1])
+    for i in range(n):
+        seed_val += x[np.clip(r0 - n + 1 + i, 0, size - 1), cols]
+    seed_val /= n
+    out = np.full(x.shape, np.nan)
+    prev = np.full(x.shape[1], np.nan)
+    for t in range(min(r0.min(initial=size), size), size):
+        prev = np.where(t > r0, (x[t] - prev) * k + prev, np.where(t == r0, seed_val, np.nan))
+        out[t] = prev
+    return out
+
+
+# 滑动窗口最大/最小值，窗口过大时按时间分块，避免占用过多内存。
+def _rolling(x, n, func):
+    size = x.shape[0]
+    out = np.full(x.shape, np.nan)
+    if size < n:
+        return out
+    view = sliding_window_view(x, n, axis=0)
+    step = max(1, (1 << 23) // max(1, x.shape[1] * n))
+    for s in range(0, size - n + 1, step):
+        out[s + n - 1:s + n - 1 + step] = func(view[s:s + step], axis=2)
+    out[_rows(x) < (_begin(x) + n - 1)] = np.nan
+    return out
+
+
+def MAX(x, n):
+    return _rolling(x, n, np.max)
+
+
+def MIN(x, n):
+    return _rolling(x, n, np.min)
+
+
+# 按列移动，每只股票前k行填fill_value(与Series.shift(k, fill_value)一致)，前面补齐的行保持NaN。
+def _shift(x, k, start, fill_value=0.0):
+    out = np.full(x.shape, np.nan)
+    out[k:] = x[:-k]
+    rows = _rows(x)
+    out[(rows >= start) & (rows < start + k)] = fill_value
+    out[rows < start] = np.nan
+    return out
+
+
+# 与 np.insert(np.diff(x), 0, 0.0) 一致。
+def _diff(x, start):
+    out = np.full(x.shape, np.nan)
+    out[1:] = x[1:] - x[:-1]
+    rows = _rows(x)
+    out[rows == start] = 0.0
+    out[rows < start] = np.nan
+    return out
+
+
+def _fill(x, valid, inf=False):
+    bad = np.isnan(x)
+    if inf:
+        bad |= np.isinf(x)
+    x[bad & valid] = 0.0
+    return x
+
+
+def _pad(x, valid):
+    x[~valid] = np.nan
+    return x
+
+
+def MACD(x, fast=12, slow=26, signal=9):
+    slow_ema = EMA(x, slow)
+    fast_ema = EMA(x, fast, seed=slow - 1)
+    macd = fast_ema - slow_ema
+    macds = EMA(macd, signal)
+    b = _begin(x) + (slow - 1) + (signal - 1)
+    macd[_rows(x) < b] = np.nan
+    return macd, macds, macd - macds
+
+
+# talib STOCH，slowk/slowd 为EMA(matype=1)。
+def STOCH(high, low, close, fastk=9, slowk=5, slowd=5):
+    lowest = MIN(low, fastk)
+    highest = MAX(high, fastk)
+    diff = (highest - lowest) / 100.0
+    fk = np.where(diff != 0.0, (close - lowest) / diff, 0.0)
+    fk[np.isnan(highest) | np.isnan(lowest) | np.isnan(close)] = np.nan
+    k = EMA(fk, slowk)
+    d = EMA(k, slowd)
+    b = _begin(high, low, close) + (fastk - 1) + (slowk - 1) + (slowd - 1)
+    k[_rows(close) < b] = np.nan
+    return k, d
+
+
+def BBANDS(x, n=20, nbdev=2.0):
+    size = x.shape[0]
+    b = _begin(x)
+    mid = MA(x, n)
+    sd = np.full(x.shape, np.nan)
+    total2 = np.zeros(x.shape[1])
+    for t in range(min(b.min(initial=size), size), size):
+        total2 = np.where(t >= b, total2 + x[t] * x[t], total2)
+        ready = t >= b + n - 1
+        mean2 = total2 / n
+        if t - n + 1 >= 0:
+            total2 = np.where(ready, total2 - x[t - n + 1] * x[t - n + 1], total2)
+        mean2 = mean2 - mid[t] * mid[t]
+        sd[t] = np.where(ready, np.where(mean2 < 0.00000001, 0.0, np.sqrt(np.abs(mean2))), np.nan)
+    dev = sd * nbdev
+    return mid + dev, mid, mid - dev
+
+
+def ROC(x, n):
+    prev = np.full(x.shape, np.nan)
+    prev[n:] = x[:-n]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        out = np.where(prev != 0.0, ((x / prev) - 1.0) * 100.0, 0.0)
+    out[_rows(x) < _begin(x) + n] = np.nan
+    return out
+
+
+def TRIX(x, n):
+    e3 = EMA(EMA(EMA(x, n), n), n)
+    return ROC(e3, 1)
+
+
+def TEMA(x, n):
+    e1 = EMA(x, n)
+    e2 = EMA(e1, n)
+    e3 = EMA(e2, n)
+    return e3 + ((3.0 * e1) - (3.0 * e2))
+
+
+# talib RSI，Wilder平滑。
+def RSI(x, n):
+    size = x.shape[0]
+    b = _begin(x)
+    out = np.full(x.shape, np.nan)
+    gain = np.zeros(x.shape[1])
+    loss = np.zeros(x.shape[1])
+    for t in range(min(b.min(initial=size), size) + 1, size):
+        d = x[t] - x[t - 1]
+        neg = d < 0
+        init = (t > b) & (t <= b + n)
+        step = t > b + n
+        g = np.where(neg, 0.0, d)
+        lo = np.where(neg, -d, 0.0)
+        gain = np.where(init, gain + g, np.where(step, (gain * (n - 1) + g), gain))
+        loss = np.where(init, loss + lo, np.where(step, (loss * (n - 1) + lo), loss))
+        done = (t == b + n) | step
+        gain = np.where(done, gain / n, gain)
+        loss = np.where(done, loss / n, loss)
+        s = gain + loss
+        out[t] = np.where(done, np.where((-0.00000001 < s) & (s < 0.00000001), 0.0, 100.0 * (gain / s)), np.nan)
+    return out
+
+
+def TRANGE(high, low, close):
+    prev = np.full(close.shape, np.nan)
+    prev[1:] = close[:-1]
+    greatest = high - low
+    greatest = np.where(np.abs(prev - high) > greatest, np.abs(prev - high), greatest)
+    greatest = np.where(np.abs(prev - low) > greatest, np.abs(prev - low), greatest)
+    greatest[_rows(close) < _begin(high, low, close) + 1] = np.nan
+    return greatest
+
+
+def ATR(high, low, close, n):
+    size = close.shape[0]
+    tr = TRANGE(high, low, close)
+    b = _begin(high, low, close) + n
+    init = MA(tr, n)
+    out = np.full(close.shape, np.nan)
+    prev = np.full(close.shape[1], np.nan)
+    for t in range(min(b.min(initial=size), size), size):
+        prev = np.where(t > b, (prev * (n - 1) + tr[t]) / n, np.where(t == b, init[t], np.nan))
+        out[t] = prev
+    return out
+
+
+def WILLR(high, low, close, n):
+    highest = MAX(high, n)
+    lowest = MIN(low, n)
+    diff = (highest - lowest) / (-100.0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        out = np.where(diff != 0.0, (highest - close) / diff, 0.0)
+    out[_rows(close) < _begin(high, low, close) + n - 1] = np.nan
+    return out
+
+
+def CCI(high, low, close, n):
+    size = close.shape[0]
+    tp = (high + low + close) / 3
+    out = np.full(close.shape, np.nan)
+    if size < n:
+        return out
+    view = sliding_window_view(tp, n, axis=0)
+    step = max(1, (1 << 23) // max(1, close.shape[1] * n))
+    for s in range(0, size - n + 1, step):
+        w = view[s:s + step]
+        # 与talib一样顺序累加，价格不变的窗口均值与价格严格相等。
+        avg = np.zeros(w.shape[:2])
+        for i in range(n):
+            avg += w[:, :, i]
+        avg /= n
+        dev = np.zeros(w.shape[:2])
+        for i in range(n):
+            dev += np.abs(w[:, :, i] - avg)
+        last = tp[s + n - 1:s + n - 1 + step]
+        d = last - avg
+        with np.errstate(divide="ignore", invalid="ignore"):
+            out[s + n - 1:s + n - 1 + step] = np.where((np.abs(d) < 0.00000001) | (np.abs(dev) < 0.00000001), 0.0,
+                                                               d / (0.015 * (dev / n)))
+    out[_rows(close) < _begin(high, low, close) + n - 1] = np.nan
+    return out
+
+
+# talib(C库0.6起)MFI判断典型价格涨跌：相对误差不超过1e-14的视为不变，两位小数价格之和相等但浮点舍入不同时不计入资金流。
+# 返回1(流入)、-1(流出)、0(不变或NaN)。
+def mfi_flow(tp, prev):
+    flat = np.abs(tp - prev) <= 1e-14 * (np.abs(tp) + np.abs(prev))
+    return np.where(flat, 0, np.where(tp > prev, 1, np.where(tp < prev, -1, 0)))
+
+
+def MFI(high, low, close, volume, n):
+    size = close.shape[0]
+    b = _begin(high, low, close, volume)
+    tp = (high + low + close) / 3.0
+    pos = np.zeros(close.shape)
+    neg = np.zeros(close.shape)
+    flow = mfi_flow(tp[1:], tp[:-1])
+    money = tp * volume
+    pos[1:] = np.where(flow > 0, money[1:], 0.0)
+    neg[1:] = np.where(flow < 0, money[1:], 0.0)
+    out = np.full(close.shape, np.nan)
+    pos_sum = np.zeros(close.shape[1])
+    neg_sum = np.zeros(close.shape[1])
+    for t in range(min(b.min(initial=size), size) + 1, size):
+        active = t > b
+        if t - n >= 1:
+            trail = t > b + n
+            pos_sum = np.where(trail, pos_sum - pos[t - n], pos_sum)
+            neg_sum = np.where(trail, neg_sum - neg[t - n], neg_sum)
+        pos_sum = np.where(active, pos_sum + pos[t], pos_sum)
+        neg_sum = np.where(active, neg_sum + neg[t], neg_sum)
+        s = pos_sum + neg_sum
+        out[t] = np.where(t >= b + n, np.where(s < 1.0, 0.0, 100.0 * (pos_sum / s)), np.nan)
+    return out
+
+
+# talib PPO(matype=1)，快慢线都是普通EMA。
+def PPO(x, fast=12, slow=26):
+    fast_ema = EMA(x, fast)
+    slow_ema = EMA(x, slow)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        out = np.where((-0.00000001 < slow_ema) & (slow_ema < 0.00000001), 0.0,
+                       ((fast_ema - slow_ema) / slow_ema) * 100.0)
+    out[np.isnan(slow_ema)] = np.nan
+    return out
+
+
+def OBV(close, volume):
+    b = _begin(close, volume)
+    prev = np.full(close.shape, np.nan)
+    prev[1:] = close[:-1]
+    sign = np.where(close > prev, 1.0, np.where(close < prev, -1.0, 0.0))
+    step = np.where(_rows(close) == b, volume, sign * volume)
+    step[_rows(close) < b] = 0.0
+    out = np.cumsum(step, axis=0)
+    out[_rows(close) < b] = np.nan
+    return out
+
+
+# 指标按节点注册，每个节点声明计算出的列和依赖的列(输入列或其它节点的列)，
+# compute只计算所需列及其依赖，各节点的计算过程与 calculate_indicator.get_indicators 逐行对应。
+# 节点中的talib函数、移位和差分都通过计算上下文调用：_context对整段K线计算，
+# indicator_state的增量上下文换成每次推进一根K线的状态，两者共用同一套节点定义。
+_NODES = {}
+
+
+def _node(outputs, inputs):
+    def register(func):
+        node = (tuple(outputs), tuple(inputs), func)
+        for name in node[0]:
+            _NODES[name] = node
+        return func
+
+    return register
+
+
+# 计算上下文，保存有效行、起始行和已计算的列。
+class _context:
+    def __init__(self, arrays, counts):
+        close = arrays["close"]
+        if counts is None:
+            counts = (~np.isnan(close)).sum(axis=0)
+        self.start = close.shape[0] - np.asarray(counts)
+        self.valid = _rows(close) >= self.start
+        self.d = {c: _pad(arrays[c].copy(), self.valid) for c in INPUT_COLUMNS}
+        self.node = None  # 正在计算的节点
+
+    def fill(self, x, inf=False):
+        return _fill(x, self.valid, inf)
+
+    def shift(self, x, k):
+        return _shift(x, k, self.start)
+
+    def diff(self, x):
+        return _diff(x, self.start)
+
+    def pad(self, x):
+        return _pad(x, self.valid)
+
+    def SUM(self, x, n):
+        return SUM(x, n)
+
+    def MA(self, x, n):
+        return MA(x, n)
+
+    def EMA(self, x, n):
+        return EMA(x, n)
+
+    def MAX(self, x, n):
+        return MAX(x, n)
+
+    def MIN(self, x, n):
+        return MIN(x, n)
+
+    def MACD(self, x, fast, slow, signal):
+        return MACD(x, fast, slow, signal)
+
+    def STOCH(self, high, low, close, fastk, slowk, slowd):
+        return STOCH(high, low, close, fastk, slowk, slowd)
+
+    def BBANDS(self, x, n, nbdev):
+        return BBANDS(x, n, nbdev)
+
+    def TRIX(self, x, n):
+        return TRIX(x, n)
+
+    def TEMA(self, x, n):
+        return TEMA(x, n)
+
+    def RSI(self, x, n):
+        return RSI(x, n)
+
+    def ATR(self, high, low, close, n):
+        return ATR(high, low, close, n)
+
+    def WILLR(self, high, low, close, n):
+        return WILLR(high, low, close, n)
+
+    def CCI(self, high, low, close, n):
+        return CCI(high, low, close, n)
+
+    def MFI(self, high, low, close, volume, n):
+        return MFI(high, low, close, volume, n)
+
+    def PPO(self, x, fast, slow):
+        return PPO(x, fast, slow)
+
+    def ROC(self, x, n):
+        return ROC(x, n)
+
+    def OBV(self, close, volume):
+        return OBV(close, volume)
+
+    def SAR(self, high, low):
+        return krn.sar_batch(high, low)
+
+    def SUPERTREND(self, close, b_ub, b_lb):
+        return krn.supertrend_batch(close, b_ub, b_lb, self.valid)
+
+    def resolve(self, name):
+        if name in self.d:
+            return self.d[name]
+        outputs, inputs, func = _NODES[name]
+        args = [self.resolve(i) for i in inputs]
+        self.node = outputs[0]
+        result = func(self, *args)
+        if len(outputs) == 1:
+            result = (result,)
+        for k, v in zip(outputs, result):
+            self.d[k] = v
+        return self.d[name]
+
+
+# macd
+@_node(("macd", "macds", "macdh"), ("close",))
+def _macd(c, close):
+    macd, macds, macdh = c.MACD(close, 12, 26, 9)
+    return c.fill(macd), c.fill(macds), c.fill(macdh)
+
+
+# kdjk
+@_node(("kdjk", "kdjd"), ("high", "low", "close"))
+def _kdj(c, high, low, close):
+    kdjk, kdjd = c.STOCH(high, low, close, 9, 5, 5)
+    return c.fill(kdjk), c.fill(kdjd)
+
+
+@_node(("kdjj",), ("kdjk", "kdjd"))
+def _kdjj(c, kdjk, kdjd):
+    return 3 * kdjk - 2 * kdjd
+
+
+# boll
+@_node(("boll_ub", "boll", "boll_lb"), ("close",))
+def _boll(c, close):
+    boll_ub, boll, boll_lb = c.BBANDS(close, 20, 2)
+    return c.fill(boll_ub), c.fill(boll), c.fill(boll_lb)
+
+
+# trix
+@_node(("trix",), ("close",))
+def _trix(c, close):
+    return c.fill(c.TRIX(close, 12))
+
+
+@_node(("trix_20_sma",), ("trix",))
+def _trix_20_sma(c, trix):
+    return c.fill(c.MA(trix, 20))
+
+
+# cr
+@_node(("m_price",), ("amount", "volume"))
+def _m_price(c, amount, volume):
+    return amount / volume
+
+
+@_node(("m_price_sf1",), ("m_price",))
+def _m_price_sf1(c, m_price):
+    return c.shift(m_price, 1)
+
+
+@_node(("cr",), ("high", "low", "m_price_sf1"))
+def _cr(c, high, low, m_price_sf1):
+    h_m = high - np.min(np.stack((m_price_sf1, high)), axis=0)
+    m_l = m_price_sf1 - np.min(np.stack((m_price_sf1, low)), axis=0)
+    return c.fill(c.SUM(h_m, 26) / c.SUM(m_l, 26), True) * 100
+
+
+@_node(("cr_ma1",), ("cr",))
+def _cr_ma1(c, cr):
+    return c.fill(c.MA(cr, 5))
+
+
+@_node(("cr_ma2",), ("cr",))
+def _cr_ma2(c, cr):
+    return c.fill(c.MA(cr, 10))
+
+
+@_node(("cr_ma3",), ("cr",))
+def _cr_ma3(c, cr):
+    return c.fill(c.MA(cr, 20))
+
+
+# rsi
+@_node(("rsi",), ("close",))
+def _rsi(c, close):
+    return c.fill(c.RSI(close, 14))
+
+
+@_node(("rsi_6",), ("close",))
+def _rsi_6(c, close):
+    return c.fill(c.RSI(close, 6))
+
+
+@_node(("rsi_12",), ("close",))
+def _rsi_12(c, close):
+    return c.fill(c.RSI(close, 12))
+
+
+@_node(("rsi_24",), ("close",))
+def _rsi_24(c, close):
+    return c.fill(c.RSI(close, 24))
+
+
+# vr
+@_node(("vr",), ("p_change", "volume"))
+def _vr(c, p_change, volume):
+    avs = c.SUM(c.pad(np.where(p_change > 0, volume, 0)), 26)
+    bvs = c.SUM(c.pad(np.where(p_change < 0, volume, 0)), 26)
+    cvs = c.SUM(c.pad(np.where(p_change == 0, volume, 0)), 26)
+    return c.fill((avs + cvs / 2) / (bvs + cvs / 2), True) * 100
+
+
+@_node(("vr_6_sma",), ("vr",))
+def _vr_6_sma(c, vr):
+    return c.fill(c.MA(vr, 6))
+
+
+# atr
+@_node(("prev_close",), ("close",))
+def _prev_close(c, close):
+    return c.shift(close, 1)
+
+
+@_node(("h_l",), ("high", "low"))
+def _h_l(c, high, low):
+    return high - low
+
+
+@_node(("h_cy",), ("high", "prev_close"))
+def _h_cy(c, high, prev_close):
+    return high - prev_close
+
+
+@_node(("cy_l",), ("prev_close", "low"))
+def _cy_l(c, prev_close, low):
+    return prev_close - low
+
+
+@_node(("tr",), ("h_l", "h_cy", "cy_l"))
+def _tr(c, h_l, h_cy, cy_l):
+    return c.fill(np.fmax(np.fmax(h_l, abs(h_cy)), abs(cy_l)))
+
+
+@_node(("atr",), ("high", "low", "close"))
+def _atr(c, high, low, close):
+    return c.fill(c.ATR(high, low, close, 14))
+
+
+# DMI，stockstats计算公式
+@_node(("high_m", "low_m"), ("high", "low"))
+def _dm(c, high, low):
+    high_delta = c.diff(high)
+    low_delta = -c.diff(low)
+    return (high_delta + abs(high_delta)) / 2, (low_delta + abs(low_delta)) / 2
+
+
+@_node(("pdm",), ("high_m", "low_m"))
+def _pdm(c, high_m, low_m):
+    return c.fill(c.EMA(c.pad(np.where(high_m > low_m, high_m, 0)), 14))
+
+
+@_node(("mdm",), ("high_m", "low_m"))
+def _mdm(c, high_m, low_m):
+    return c.fill(c.EMA(c.pad(np.where(low_m > high_m, low_m, 0)), 14))
+
+
+@_node(("pdi",), ("pdm", "atr"))
+def _pdi(c, pdm, atr):
+    return c.fill(pdm / atr, True) * 100
+
+
+@_node(("mdi",), ("mdm", "atr"))
+def _mdi(c, mdm, atr):
+    return c.fill(mdm / atr, True) * 100
+
+
+@_node(("dx",), ("pdi", "mdi"))
+def _dx(c, pdi, mdi):
+    return c.fill(abs(pdi - mdi) / (pdi + mdi), True) * 100
+
+
+@_node(("adx",), ("dx",))
+def _adx(c, dx):
+    return c.fill(c.EMA(dx, 6))
+
+
+@_node(("adxr",), ("adx",))
+def _adxr(c, adx):
+    return c.fill(c.EMA(adx, 6))
+
+
+# wr
+@_node(("wr_6",), ("high", "low", "close"))
+def _wr_6(c, high, low, close):
+    return c.fill(c.WILLR(high, low, close, 6))
+
+
+@_node(("wr_10",), ("high", "low", "close"))
+def _wr_10(c, high, low, close):
+    return c.fill(c.WILLR(high, low, close, 10))
+
+
+@_node(("wr_14",), ("high", "low", "close"))
+def _wr_14(c, high, low, close):
+    return c.fill(c.WILLR(high, low, close, 14))
+
+
+# cci
+@_node(("cci",), ("high", "low", "close"))
+def _cci(c, high, low, close):
+    return c.fill(c.CCI(high, low, close, 14))
+
+
+@_node(("cci_84",), ("high", "low", "close"))
+def _cci_84(c, high, low, close):
+    return c.fill(c.CCI(high, low, close, 84))
+
+
+# dma
+@_node(("ma10",), ("close",))
+def _ma10(c, close):
+    return c.fill(c.MA(close, 10))
+
+
+@_node(("ma50",), ("close",))
+def _ma50(c, close):
+    return c.fill(c.MA(close, 50))
+
+
+@_node(("dma",), ("ma10", "ma50"))
+def _dma(c, ma10, ma50):
+    return ma10 - ma50
+
+
+@_node(("dma_10_sma",), ("dma",))
+def _dma_10_sma(c, dma):
+    return c.fill(c.MA(dma, 10))
+
+
+# tema
+@_node(("tema",), ("close",))
+def _tema(c, close):
+    return c.fill(c.TEMA(close, 14))
+
+
+# mfi
+@_node(("mfi",), ("high", "low", "close", "volume"))
+def _mfi(c, high, low, close, volume):
+    return c.fill(c.MFI(high, low, close, volume, 14))
+
+
+@_node(("mfisma",), ("mfi",))
+def _mfisma(c, mfi):
+    return c.MA(mfi, 6)
+
+
+# vwma
+@_node(("vwma",), ("amount", "volume"))
+def _vwma(c, amount, volume):
+    return c.fill(c.SUM(amount, 14) / c.SUM(volume, 14), True)
+
+
+@_node(("mvwma",), ("vwma",))
+def _mvwma(c, vwma):
+    return c.MA(vwma, 6)
+
+
+# ppo
+@_node(("ppo",), ("close",))
+def _ppo(c, close):
+    return c.fill(c.PPO(close, 12, 26))
+
+
+@_node(("ppos",), ("ppo",))
+def _ppos(c, ppo):
+    return c.fill(c.EMA(ppo, 9))
+
+
+@_node(("ppoh",), ("ppo", "ppos"))
+def _ppoh(c, ppo, ppos):
+    return ppo - ppos
+
+
+# stochrsi
+@_node(("stochrsi_k",), ("rsi",))
+def _stochrsi_k(c, rsi):
+    rsi_min = c.MIN(rsi, 14)
+    rsi_max = c.MAX(rsi, 14)
+    return c.fill((rsi - rsi_min) / (rsi_max - rsi_min), True) * 100
+
+
+@_node(("stochrsi_d",), ("stochrsi_k",))
+def _stochrsi_d(c, stochrsi_k):
+    return c.MA(stochrsi_k, 3)
+
+
+# wt
+@_node(("esa_ci",), ("m_price",))
+def _esa_ci(c, m_price):
+    esa = c.fill(c.EMA(m_price, 10))
+    esa_d = c.EMA(abs(m_price - esa), 10)
+    return c.fill((m_price - esa) / (0.015 * esa_d), True)
+
+
+@_node(("wt1",), ("esa_ci",))
+def _wt1(c, esa_ci):
+    return c.fill(c.EMA(esa_ci, 21))
+
+
+@_node(("wt2",), ("wt1",))
+def _wt2(c, wt1):
+    return c.fill(c.MA(wt1, 4))
+
+
+# Supertrend
+@_node(("hl_avg",), ("high", "low"))
+def _hl_avg(c, high, low):
+    return (high + low) / 2.0
+
+
+@_node(("supertrend_ub", "supertrend_lb", "supertrend"), ("close", "hl_avg", "atr"))
+def _supertrend(c, close, hl_avg, atr):
+    m_atr = atr * 3
+    return c.SUPERTREND(close, hl_avg + m_atr, hl_avg - m_atr)
+
+
+# roc
+@_node(("roc",), ("close",))
+def _roc(c, close):
+    return c.fill(c.ROC(close, 12))
+
+
+@_node(("rocma",), ("roc",))
+def _rocma(c, roc):
+    return c.fill(c.MA(roc, 6))
+
+
+@_node(("rocema",), ("roc",))
+def _rocema(c, roc):
+    return c.fill(c.EMA(roc, 9))
+
+
+# obv
+@_node(("obv",), ("close", "volume"))
+def _obv(c, close, volume):
+    return c.fill(c.OBV(close, volume))
+
+
+# sar
+@_node(("sar",), ("high", "low"))
+def _sar(c, high, low):
+    return c.fill(c.SAR(high, low))
+
+
+# psy
+@_node(("psy",), ("close", "prev_close"))
+def _psy(c, close, prev_close):
+    price_up = c.pad(np.where(close > prev_close, 1.0, 0.0))
+    return c.fill(c.SUM(price_up, 12) / 12.0) * 100
+
+
+@_node(("psyma",), ("psy",))
+def _psyma(c, psy):
+    return c.MA(psy, 6)
+
+
+# BRAR
+@_node(("ar",), ("high", "open", "low"))
+def _ar(c, high, open_price, low):
+    return c.fill(c.SUM(high - open_price, 26) / c.SUM(open_price - low, 26), True) * 100
+
+
+@_node(("br",), ("h_cy", "cy_l"))
+def _br(c, h_cy, cy_l):
+    return c.fill(c.SUM(h_cy, 26) / c.SUM(cy_l, 26), True) * 100
+
+
+# EMV
+@_node(("prev_high",), ("high",))
+def _prev_high(c, high):
+    return c.shift(high, 1)
+
+
+@_node(("prev_low",), ("low",))
+def _prev_low(c, low):
+    return c.shift(low, 1)
+
+
+@_node(("emv",), ("hl_avg", "prev_high", "prev_low", "h_l", "amount"))
+def _emv(c, hl_avg, prev_high, prev_low, h_l, amount):
+    phl_avg = (prev_high + prev_low) / 2.0
+    emva_em = (hl_avg - phl_avg) * h_l / amount
+    return c.fill(c.SUM(emva_em, 14))
+
+
+@_node(("emva",), ("emv",))
+def _emva(c, emv):
+    return c.fill(c.MA(emv, 9))
+
+
+# BIAS
+@_node(("ma6",), ("close",))
+def _ma6(c, close):
+    return c.fill(c.MA(close, 6))
+
+
+@_node(("ma12",), ("close",))
+def _ma12(c, close):
+    return c.fill(c.MA(close, 12))
+
+
+@_node(("ma24",), ("close",))
+def _ma24(c, close):
+    return c.fill(c.MA(close, 24))
+
+
+@_node(("bias",), ("close", "ma6"))
+def _bias(c, close, ma6):
+    return c.fill((close - ma6) / ma6, True) * 100
+
+
+@_node(("bias_12",), ("close", "ma12"))
+def _bias_12(c, close, ma12):
+    return c.fill((close - ma12) / ma12, True) * 100
+
+
+@_node(("bias_24",), ("close", "ma24"))
+def _bias_24(c, close, ma24):
+    return c.fill((close - ma24) / ma24, True) * 100
+
+
+# DPO
+@_node(("dpo",), ("close",))
+def _dpo(c, close):
+    c_m_11 = c.MA(close, 11)
+    return c.fill(close - c.shift(c_m_11, 1))
+
+
+@_node(("madpo",), ("dpo",))
+def _madpo(c, dpo):
+    return c.fill(c.MA(dpo, 6))
+
+
+# VHF
+@_node(("vhf",), ("close", "prev_close"))
+def _vhf(c, close, prev_close):
+    hcp_lcp = c.fill(c.MAX(close, 28) - c.MIN(close, 28))
+    return c.fill(np.divide(hcp_lcp, c.SUM(abs(close - prev_close), 28)))
+
+
+# RVI
+@_node(("rvi",), ("open", "high", "low", "close", "prev_close", "prev_high", "prev_low"))
+def _rvi(c, open_price, high, low, close, prev_close, prev_high, prev_low):
+    shift = c.shift
+    rvi_x = ((close - open_price) + 2 * (prev_close - shift(open_price, 1)) + 2 * (shift(close, 2) - shift(open_price, 2))
+             + (shift(close, 3) - shift(open_price, 3))) / 6
+    rvi_y = ((high - low) + 2 * (prev_high - prev_low) + 2 * (shift(high, 2) - shift(low, 2))
+             + (shift(high, 3) - shift(low, 3))) / 6
+    return c.fill(c.MA(rvi_x, 10) / c.MA(rvi_y, 10), True)
+
+
+@_node(("rvis",), ("rvi",))
+def _rvis(c, rvi):
+    return (rvi + 2 * c.shift(rvi, 1) + 2 * c.shift(rvi, 2) + c.shift(rvi, 3)) / 6
+
+
+# FI
+@_node(("fi",), ("close", "volume"))
+def _fi(c, close, volume):
+    return c.diff(close) * volume
+
+
+@_node(("force_2",), ("fi",))
+def _force_2(c, fi):
+    return c.fill(c.EMA(fi, 2))
+
+
+@_node(("force_13",), ("fi",))
+def _force_13(c, fi):
+    return c.fill(c.EMA(fi, 13))
+
+
+# ENE
+@_node(("ene_ue",), ("ma10",))
+def _ene_ue(c, ma10):
+    return (1 + 11 / 100) * ma10
+
+
+@_node(("ene_le",), ("ma10",))
+def _ene_le(c, ma10):
+    return (1 - 9 / 100) * ma10
+
+
+@_node(("ene",), ("ene_ue", "ene_le"))
+def _ene(c, ene_ue, ene_le):
+    return (ene_ue + ene_le) / 2
+
+
+# VOL
+@_node(("vol_5",), ("volume",))
+def _vol_5(c, volume):
+    return c.fill(c.MA(volume, 5))
+
+
+@_node(("vol_10",), ("volume",))
+def _vol_10(c, volume):
+    return c.fill(c.MA(volume, 10))
+
+
+# MA
+@_node(("ma20",), ("close",))
+def _ma20(c, close):
+    return c.fill(c.MA(close, 20))
+
+
+@_node(("ma200",), ("close",))
+def _ma200(c, close):
+    return c.fill(c.MA(close, 200))
+
+
+# 可计算的全部列(不含输入列)。
+def all_columns():
+    return list(_NODES.keys())
+
+
+# 只计算columns中的列及其依赖，arrays为 {列名: (K线数, 股票数)}，返回 {列名: (K线数, 股票数)}。
+# columns可以包含输入列，为None时计算全部列。
+def compute(arrays, columns=None, counts=None):
+    try:
+        if columns is None:
+            columns = list(_NODES.keys())
+        c = _context(arrays, counts)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return {name: c.resolve(name) for name in columns}
+    except Exception as e:
+        logging.error(f"calculate_indicator_panel.compute处理异常：{e}")
+    return None
+
+
+# 计算全部指标，arrays为 {列名: (K线数, 股票数)}，返回 {指标名: (K线数, 股票数)}。
+def get_indicators(arrays, counts=None):
+    return compute(arrays, ["close"] + all_columns(), counts)
+
+
+# 全市场某日的指标结果，与逐只调用 calculate_indicator.get_indicator 得到的数据相同，
+# 只是不包含该日还没有K线的股票(逐只计算时为全0的行)。
+# 返回DataFrame，列为 date,code,name 加 STOCK_STATS_DATA 的列。
+def get_indicator(panel, date=None, calc_threshold=90, columns=None):
+    try:
+        if columns is None:
+            columns = list(tbs.STOCK_STATS_DATA['columns'])
+        if date is None:
+            end_date = None
+        else:
+            end_date = date.strftime("%Y-%m-%d")
+        arrays, counts, _ = panel.packed(INPUT_COLUMNS, end_date=end_date, length=calc_threshold)
+        total = panel.mask.sum(axis=0)
+        keep = (counts > 0) | (total <= 1)
+        d = compute(arrays, columns, counts)
+        if d is None:
+            return None
+
+        data = {}
+        keys = panel.keys()
+        data['date'] = [k[0] if end_date is None else end_date for k in keys]
+        data['code'] = [k[1] for k in keys]
+        data['name'] = [k[2] for k in keys]
+        for c in columns:
+            val = d[c][-1].copy() if len(d[c]) > 0 else np.zeros(len(keys))
+            val[np.isnan(val) | np.isinf(val) | (total <= 1)] = 0
+            data[c] = val
+        return pd.DataFrame(data).loc[keep].reset_index(drop=True)
+    except Exception as e:
+        logging.error(f"calculate_indicator_panel.get_indicator处理异常：{e}")
+    return None
+
+
+# 区间内每个交易日的指标结果，每只股票的K线只计算一遍，按股票分批返回DataFrame(格式同get_indicator)。
+# 每日的值取该日及之前最后一根K线，指标用截止区间最后一日的全部历史计算，与 indicator_state 的结果一致，
+# 和逐日只取calc_threshold根K线相比，EMA类指标的种子不同，数值略有差异。
+def get_indicator_range(panel, dates, columns=None, chunk=500):
+    if columns is None:
+        columns = list(tbs.STOCK_STATS_DATA['columns'])
+    date_strs = [d.strftime("%Y-%m-%d") for d in dates]
+    cuts = np.array([panel.date_cut(d) for d in date_strs])
+    bars = np.cumsum(panel.mask, axis=0, dtype=np.int32)
+    bars = np.where(cuts[:, None] > 0, bars[np.maximum(cuts - 1, 0)], 0)  # 每日每只股票已有的K线数
+    total = panel.mask.sum(axis=0)
+    keys = panel.keys()
+    for b in range(0, len(keys), chunk):
+        try:
+            index = np.arange(b, min(b + chunk, len(keys)))
+            arrays, counts, _ = panel.packed(INPUT_COLUMNS, end_date=date_strs[-1], index=index)
+            d = compute(arrays, columns, counts)
+            if d is None:
+                continue
+            length = arrays["close"].shape[0]
+            n = bars[:, index]
+            rows = np.clip(length - counts + n - 1, 0, max(length - 1, 0))
+            cols = np.broadcast_to(np.arange(len(index)), rows.shape)
+            keep = ((n > 0) | (total[index] <= 1)).ravel()
+            data = {'date': np.repeat(date_strs, len(index)),
+                    'code': np.tile([keys[j][1] for j in index], len(date_strs)),
+                    'name': np.tile([keys[j][2] for j in index], len(date_strs))}
+            for c in columns:
+                val = d[c][rows, cols] if length > 0 else np.zeros(rows.shape)
+                val[np.isnan(val) | np.isinf(val) | (total[index] <= 1)] = 0
+                data[c] = val.ravel()
+            yield pd.DataFrame(data).loc[keep].reset_index(drop=True)
+        except Exception as e:
+            logging.error(f"calculate_indicator_panel.get_indicator_range处理异常：{e}")
+
+
+# 对比面板计算与逐只计算的耗时，不一致的数量写入日志，结果是否一致由测试检查。
+def benchmark(panel, date=None, calc_threshold=90, workers=40):
+    import concurrent.futures
+    import instock.core.indicator.calculate_indicator as idr
+
+    columns = list(tbs.STOCK_STATS_DATA['columns'])
+    stock_column = ['date', 'code'] + columns
+
+    frames = {k: panel[k] for k in panel}
+    start = time.time()
+    legacy = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(idr.get_indicator, k, frames[k], stock_column, date=date, calc_threshold=calc_threshold): k
+                   for k in frames}
+        for future in concurrent.futures.as_completed(futures):
+            r = future.result()
+            if r is not None:
+                legacy[futures[future][1]] = r
+    legacy_time = time.time() - start
+
+    start = time.time()
+    result = get_indicator(panel, date=date, calc_threshold=calc_threshold)
+    panel_time = time.time() - start
+
+    result = result.set_index('code')
+    expected = pd.DataFrame(legacy).T.loc[result.index, columns].astype(np.float64)
+    actual = result[columns].astype(np.float64)
+    diff = ~np.isclose(actual.values, expected.values, rtol=1e-9, atol=1e-9)
+    logging.info(f"股票数：{len(result.index)}，逐只计算：{legacy_time:.2f}秒，面板计算：{panel_time:.2f}秒，"
+                 f"加速：{legacy_time / max(panel_time, 1e-9):.1f}倍，不一致：{int(diff.sum())}")
+    for c in np.array(columns)[diff.any(axis=0)]:
+        logging.info(f"  {c}：{int(diff[:, columns.index(c)].sum())}")
+    return legacy_time, panel_time
+
+
+if __name__ == "__main__":
+    # 用本地列式缓存的全市场前复权数据测试：python -m instock.core.indicator.calculate_indicator_panel
+    from instock.core.hist_panel import stock_hist_panel
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    benchmark(stock_hist_panel.from_store("qfq"))
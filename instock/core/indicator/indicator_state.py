@@ -0,0 +1,718 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+import os.path
+import threading
+import numpy as np
+import pandas as pd
+import instock.core.tablestructure as tbs
+import instock.core.indicator.calculate_indicator_panel as pidr
+
+__author__ = "myh "
+__date__ = "2023/3/10 "
+
+# 指标增量计算。
+# 每只股票保存指标计算的中间状态(EMA累计值、滑动窗口环形缓冲、RSI/ATR平滑值、SAR和Supertrend状态等)，
+# 每天只用新的一根K线推进一步，不再每次用最近90根K线从头计算。
+# 状态按股票保存最后一根K线的日期和收盘价，前复权数据重算(除权)或中间缺K线时，该股票用全部历史重新计算。
+# 指标公式直接使用 calculate_indicator_panel 的节点定义，节点中的talib函数换成这里逐步推进的状态，
+# 结果等于用状态起点以来的全部历史调用 get_indicators。
+# 状态都是 (股票数,) 或 (窗口, 股票数) 的数组，所有股票同时推进。只计算所需的列及其依赖，状态记录包含的列。
+cpath_current = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+indicator_state_path = os.path.join(cpath_current, "cache", "indicator")
+_STATE_FILE = "state.npz"
+_STATE_VERSION = 2
+
+INPUT_COLUMNS = pidr.INPUT_COLUMNS
+
+
+# talib函数的一步递推状态。
+class _node:
+    fields = ()
+
+    def __init__(self, size):
+        self.cnt = np.zeros(size, dtype=np.int64)
+
+    def state(self):
+        return {f: getattr(self, f) for f in ("cnt",) + self.fields}
+
+    def load(self, state):
+        for f, v in state.items():
+            setattr(self, f, v)
+
+    # 有新K线且已经开始(第一个非NaN值起算，与talib跳过前导NaN一致)。
+    def _active(self, x, on):
+        return on & ((self.cnt > 0) | ~np.isnan(x))
+
+
+# talib SUM：加新值、输出、减去窗口最早的值。
+class _sum(_node):
+    fields = ("total", "ring")
+
+    def __init__(self, size, n):
+        super().__init__(size)
+        self.n = n
+        self.total = np.zeros(size)
+        self.ring = np.full((n, size), np.nan)
+
+    def update(self, x, on):
+        act = self._active(x, on)
+        cols = np.arange(len(x))
+        self.total = np.where(act, self.total + x, self.total)
+        pos = self.cnt % self.n
+        self.ring[pos, cols] = np.where(act, x, self.ring[pos, cols])
+        ready = act & (self.cnt >= self.n - 1)
+        out = np.where(ready, self.total, np.nan)
+        old = self.ring[(self.cnt + 1) % self.n, cols]
+        self.total = np.where(ready, self.total - old, self.total)
+        self.cnt += act
+        return out
+
+
+# talib EMA，前n个值顺序累加的均值为种子；skip跳过开始的若干值(MACD快线)；wilder为ATR的平滑方式。
+class _ema(_node):
+    fields = ("acc", "prev")
+
+    def __init__(self, size, n, skip=0, wilder=False):
+        super().__init__(size)
+        self.n = n
+        self.skip = skip
+        self.wilder = wilder
+        self.k = 2.0 / (n + 1)
+        self.acc = np.zeros(size)
+        self.prev = np.full(size, np.nan)
+
+    def update(self, x, on):
+        act = self._active(x, on)
+        c = self.cnt
+        seeding = act & (c >= self.skip) & (c < self.skip + self.n)
+        self.acc = np.where(seeding, self.acc + x, self.acc)
+        seed = act & (c == self.skip + self.n - 1)
+        run = act & (c >= self.skip + self.n)
+        if self.wilder:
+            nxt = (self.prev * (self.n - 1) + x) / self.n
+        else:
+            nxt = (x - self.prev) * self.k + self.prev
+        self.prev = np.where(run, nxt, np.where(seed, self.acc / self.n, self.prev))
+        self.cnt += act
+        return np.where(seed | run, self.prev, np.nan)
+
+
+# 最近n个值的窗口，用于最大最小值、CCI。
+class _window(_node):
+    fields = ("ring",)
+
+    def __init__(self, size, n):
+        super().__init__(size)
+        self.n = n
+        self.ring = np.full((n, size), np.nan)
+
+    def update(self, x, on):
+        act = self._active(x, on)
+        cols = np.arange(len(x))
+        pos = self.cnt % self.n
+        self.ring[pos, cols] = np.where(act, x, self.ring[pos, cols])
+        ready = act & (self.cnt >= self.n - 1)
+        self.cnt += act
+        return ready
+
+    def max(self, ready):
+        return np.where(ready, np.max(self.ring, axis=0), np.nan)
+
+    def min(self, ready):
+        return np.where(ready, np.min(self.ring, axis=0), np.nan)
+
+    # 按时间顺序的第i个值(0为窗口最早的值)。
+    def at(self, i):
+        return self.ring[(self.cnt - self.n + i) % self.n, np.arange(self.ring.shape[1])]
+
+
+# 之前的值，past(k)为k根K线之前的值，不足k根时为fill(与Series.shift(k, fill_value)一致)。
+# update返回n根K线之前的值并加入新值。
+class _history(_node):
+    fields = ("ring",)
+
+    def __init__(self, size, n, fill=0.0):
+        super().__init__(size)
+        self.n = n
+        self.fill = fill
+        self.ring = np.full((n, size), np.nan)
+
+    def past(self, k):
+        val = self.ring[(self.cnt - k) % self.n, np.arange(self.ring.shape[1])]
+        return np.where(self.cnt >= k, val, self.fill)
+
+    def push(self, x, on):
+        cols = np.arange(len(x))
+        pos = self.cnt % self.n
+        self.ring[pos, cols] = np.where(on, x, self.ring[pos, cols])
+        self.cnt += on
+
+    def update(self, x, on):
+        prev = self.past(self.n)
+        self.push(x, on)
+        return prev
+
+
+class _rsi(_node):
+    fields = ("prev", "gain", "loss")
+
+    def __init__(self, size, n):
+        super().__init__(size)
+        self.n = n
+        self.prev = np.full(size, np.nan)
+        self.gain = np.zeros(size)
+        self.loss = np.zeros(size)
+
+    def update(self, x, on):
+        n = self.n
+        act = self._active(x, on)
+        c = self.cnt
+        d = x - self.prev
+        neg = d < 0
+        g = np.where(neg, 0.0, d)
+        lo = np.where(neg, -d, 0.0)
+        init = act & (c >= 1) & (c <= n)
+        step = act & (c > n)
+        self.gain = np.where(init, self.gain + g, np.where(step, (self.gain * (n - 1) + g), self.gain))
+        self.loss = np.where(init, self.loss + lo, np.where(step, (self.loss * (n - 1) + lo), self.loss))
+        done = act & (c >= n)
+        self.gain = np.where(done, self.gain / n, self.gain)
+        self.loss = np.where(done, self.loss / n, self.loss)
+        s = self.gain + self.loss
+        self.prev = np.where(act, x, self.prev)
+        self.cnt += act
+        return np.where(done, np.where((-0.00000001 < s) & (s < 0.00000001), 0.0, 100.0 * (self.gain / s)), np.nan)
+
+
+class _mfi(_node):
+    fields = ("prev_tp", "pos_ring", "neg_ring", "pos_sum", "neg_sum")
+
+    def __init__(self, size, n):
+        super().__init__(size)
+        self.n = n
+        self.prev_tp = np.full(size, np.nan)
+        self.pos_ring = np.zeros((n, size))
+        self.neg_ring = np.zeros((n, size))
+        self.pos_sum = np.zeros(size)
+        self.neg_sum = np.zeros(size)
+
+    def update(self, high, low, close, volume, on):
+        n = self.n
+        tp = (high + low + close) / 3.0
+        act = on & ((self.cnt > 0) | (~np.isnan(tp) & ~np.isnan(volume)))
+        c = self.cnt
+        cols = np.arange(len(tp))
+        flow = pidr.mfi_flow(tp, self.prev_tp)
+        money = tp * volume
+        pos = np.where(flow > 0, money, 0.0)
+        neg = np.where(flow < 0, money, 0.0)
+        slot = c % n
+        trail = act & (c > n)
+        self.pos_sum = np.where(trail, self.pos_sum - self.pos_ring[slot, cols], self.pos_sum)
+        self.neg_sum = np.where(trail, self.neg_sum - self.neg_ring[slot, cols], self.neg_sum)
+        add = act & (c >= 1)
+        self.pos_sum = np.where(add, self.pos_sum + pos, self.pos_sum)
+        self.neg_sum = np.where(add, self.neg_sum + neg, self.neg_sum)
+        self.pos_ring[slot, cols] = np.where(add, pos, self.pos_ring[slot, cols])
+        self.neg_ring[slot, cols] = np.where(add, neg, self.neg_ring[slot, cols])
+        s = self.pos_sum + self.neg_sum
+        out = np.where(act & (c >= n), np.where(s < 1.0, 0.0, 100.0 * (self.pos_sum / s)), np.nan)
+        self.prev_tp = np.where(act, tp, self.prev_tp)
+        self.cnt += act
+        return out
+
+
+class _obv(_node):
+    fields = ("prev", "total")
+
+    def __init__(self, size):
+        super().__init__(size)
+        self.prev = np.full(size, np.nan)
+        self.total = np.zeros(size)
+
+    def update(self, close, volume, on):
+        act = on & ((self.cnt > 0) | (~np.isnan(close) & ~np.isnan(volume)))
+        sign = np.where(close > self.prev, 1.0, np.where(close < self.prev, -1.0, 0.0))
+        self.total = np.where(act, np.where(self.cnt == 0, volume, self.total + sign * volume), self.total)
+        self.prev = np.where(act, close, self.prev)
+        self.cnt += act
+        return np.where(act, self.total, np.nan)
+
+
+# talib SAR(0.02, 0.2)。
+class _sar(_node):
+    fields = ("is_long", "af", "ep", "sar", "new_high", "new_low", "last_high", "last_low")
+
+    def __init__(self, size, acceleration=0.02, maximum=0.2):
+        super().__init__(size)
+        self.acceleration = acceleration
+        self.maximum = maximum
+        self.is_long = np.ones(size, dtype=bool)
+        self.af = np.full(size, min(acceleration, maximum))
+        self.ep = np.zeros(size)
+        self.sar = np.zeros(size)
+        self.new_high = np.zeros(size)
+        self.new_low = np.zeros(size)
+        self.last_high = np.full(size, np.nan)
+        self.last_low = np.full(size, np.nan)
+
+    def update(self, high, low, on):
+        acceleration, maximum = self.acceleration, self.maximum
+        act = on & ((self.cnt > 0) | (~np.isnan(high) & ~np.isnan(low)))
+        first = act & (self.cnt == 1)
+        if first.any():
+            diff_p = high - self.last_high
+            diff_m = self.last_low - low
+            short = (diff_m > 0) & (diff_p < diff_m)
+            self.is_long = np.where(first, ~short, self.is_long)
+            self.ep = np.where(first, np.where(short, low, high), self.ep)
+            self.sar = np.where(first, np.where(short, self.last_high, self.last_low), self.sar)
+            self.new_low = np.where(first, low, self.new_low)
+            self.new_high = np.where(first, high, self.new_high)
+        active = act & (self.cnt >= 1)
+        is_long, af, ep, sar = self.is_long, self.af, self.ep, self.sar
+        prev_low = self.new_low
+        prev_high = self.new_high
+        new_low = np.where(active, low, self.new_low)
+        new_high = np.where(active, high, self.new_high)
+
+        l_switch = is_long & (new_low <= sar)
+        s_switch = ~is_long & (new_high >= sar)
+        l_keep = is_long & ~l_switch
+        s_keep = ~is_long & ~s_switch
+
+        s1 = np.where(l_switch, np.maximum(np.maximum(ep, prev_high), new_high), sar)
+        s1 = np.where(s_switch, np.minimum(np.minimum(ep, prev_low), new_low), s1)
+        out = np.where(active, s1, np.nan)
+
+        l_ext = l_keep & (new_high > ep)
+        s_ext = s_keep & (new_low < ep)
+        af_next = np.where(l_ext | s_ext, np.minimum(af + acceleration, maximum), af)
+        af_next = np.where(l_switch | s_switch, acceleration, af_next)
+        ep_next = np.where(l_ext, new_high, ep)
+        ep_next = np.where(s_ext, new_low, ep_next)
+        ep_next = np.where(l_switch, new_low, ep_next)
+        ep_next = np.where(s_switch, new_high, ep_next)
+
+        s2 = s1 + af_next * (ep_next - s1)
+        upper = l_switch | s_keep
+        s2 = np.where(upper, np.maximum(np.maximum(s2, prev_high), new_high),
+                      np.minimum(np.minimum(s2, prev_low), new_low))
+
+        self.sar = np.where(active, s2, sar)
+        self.af = np.where(active, af_next, af)
+        self.ep = np.where(active, ep_next, ep)
+        self.is_long = np.where(active, (is_long & ~l_switch) | s_switch, is_long)
+        self.new_low = new_low
+        self.new_high = new_high
+        self.last_high = np.where(act, high, self.last_high)
+        self.last_low = np.where(act, low, self.last_low)
+        self.cnt += act
+        return out
+
+
+class _supertrend(_node):
+    fields = ("ub", "lb", "st", "last_close")
+
+    def __init__(self, size):
+        super().__init__(size)
+        self.ub = np.full(size, np.nan)
+        self.lb = np.full(size, np.nan)
+        self.st = np.full(size, np.nan)
+        self.last_close = np.full(size, np.nan)
+
+    def update(self, close, b_ub, b_lb, on):
+        f = on & (self.cnt == 0)
+        last_ub, last_lb, last_st = self.ub, self.lb, self.st
+        cur_ub = np.where((b_ub < last_ub) | (self.last_close > last_ub), b_ub, last_ub)
+        cur_lb = np.where((b_lb > last_lb) | (self.last_close < last_lb), b_lb, last_lb)
+        cur_st = np.where(last_st == last_ub, np.where(close <= cur_ub, cur_ub, cur_lb),
+                          np.where(last_st == last_lb, np.where(close > cur_lb, cur_lb, cur_ub), np.nan))
+        ub = np.where(f, b_ub, cur_ub)
+        lb = np.where(f, b_lb, cur_lb)
+        st = np.where(f, np.where(close <= b_ub, b_ub, b_lb), cur_st)
+        self.ub = np.where(on, ub, self.ub)
+        self.lb = np.where(on, lb, self.lb)
+        self.st = np.where(on, st, self.st)
+        self.last_close = np.where(on, close, self.last_close)
+        self.cnt += on
+        return ub, lb, st
+
+
+# 增量计算上下文：节点与 calculate_indicator_panel 相同，输入是一根K线 {列名: (股票数,)}，
+# 节点中每次调用talib函数按(节点, 调用顺序)取对应的状态推进一步，计算过程与整段计算逐项一致。
+class _step_context(pidr._context):
+    def __init__(self, engine, bar, on):
+        self.engine = engine
+        self.on = on
+        self.d = {c: bar[c] for c in INPUT_COLUMNS}
+        self.node = None
+        self.calls = {}
+
+    def _get(self, cls, *args, **kwargs):
+        count = self.calls.get(self.node, 0)
+        self.calls[self.node] = count + 1
+        key = f"{self.node}.{count}"
+        node = self.engine.nodes.get(key)
+        if node is None:
+            node = self.engine.nodes[key] = cls(self.engine.size, *args, **kwargs)
+        return node
+
+    def fill(self, x, inf=False):
+        bad = np.isnan(x)
+        if inf:
+            bad |= np.isinf(x)
+        return np.where(bad, 0.0, x)
+
+    def shift(self, x, k):
+        return self._get(_history, k).update(x, self.on)
+
+    def diff(self, x):
+        h = self._get(_history, 1)
+        first = h.cnt == 0
+        return np.where(first, 0.0, x - h.update(x, self.on))
+
+    def pad(self, x):
+        return np.where(self.on, x, np.nan)
+
+    def SUM(self, x, n):
+        return self._get(_sum, n).update(x, self.on)
+
+    def MA(self, x, n):
+        return self.SUM(x, n) / n
+
+    def EMA(self, x, n):
+        return self._get(_ema, n).update(x, self.on)
+
+    def MAX(self, x, n):
+        w = self._get(_window, n)
+        return w.max(w.update(x, self.on))
+
+    def MIN(self, x, n):
+        w = self._get(_window, n)
+        return w.min(w.update(x, self.on))
+
+    def MACD(self, x, fast, slow, signal):
+        slow_ema = self.EMA(x, slow)
+        macd = self._get(_ema, fast, skip=slow - fast).update(x, self.on) - slow_ema
+        macds = self.EMA(macd, signal)
+        macd = np.where(np.isnan(macds), np.nan, macd)
+        return macd, macds, macd - macds
+
+    def STOCH(self, high, low, close, fastk, slowk, slowd):
+        lowest = self.MIN(low, fastk)
+        highest = self.MAX(high, fastk)
+        diff = (highest - lowest) / 100.0
+        fk = np.where(diff != 0.0, (close - lowest) / diff, 0.0)
+        fk[np.isnan(highest) | np.isnan(lowest) | np.isnan(close)] = np.nan
+        k = self.EMA(fk, slowk)
+        d = self.EMA(k, slowd)
+        return np.where(np.isnan(d), np.nan, k), d
+
+    def BBANDS(self, x, n, nbdev):
+        mid = self.MA(x, n)
+        mean2 = self.SUM(x * x, n) / n - mid * mid
+        sd = np.where(np.isnan(mid), np.nan, np.where(mean2 < 0.00000001, 0.0, np.sqrt(np.abs(mean2))))
+        dev = sd * nbdev
+        return mid + dev, mid, mid - dev
+
+    def TRIX(self, x, n):
+        return self.ROC(self.EMA(self.EMA(self.EMA(x, n), n), n), 1)
+
+    def TEMA(self, x, n):
+        e1 = self.EMA(x, n)
+        e2 = self.EMA(e1, n)
+        e3 = self.EMA(e2, n)
+        return e3 + ((3.0 * e1) - (3.0 * e2))
+
+    def RSI(self, x, n):
+        return self._get(_rsi, n).update(x, self.on)
+
+    def ATR(self, high, low, close, n):
+        prev = self._get(_history, 1, np.nan).update(close, self.on)
+        tr = high - low
+        tr = np.where(np.abs(prev - high) > tr, np.abs(prev - high), tr)
+        tr = np.where(np.abs(prev - low) > tr, np.abs(prev - low), tr)
+        tr[np.isnan(prev)] = np.nan
+        return self._get(_ema, n, wilder=True).update(tr, self.on)
+
+    def WILLR(self, high, low, close, n):
+        highest = self.MAX(high, n)
+        lowest = self.MIN(low, n)
+        diff = (highest - lowest) / (-100.0)
+        out = np.where(diff != 0.0, (highest - close) / diff, 0.0)
+        out[np.isnan(highest) | np.isnan(lowest)] = np.nan
+        return out
+
+    def CCI(self, high, low, close, n):
+        tp = (high + low + close) / 3
+        w = self._get(_window, n)
+        ready = w.update(tp, self.on)
+        # 与talib一样顺序累加
+        avg = np.zeros(len(tp))
+        for i in range(n):
+            avg += w.at(i)
+        avg /= n
+        dev = np.zeros(len(tp))
+        for i in range(n):
+            dev += np.abs(w.at(i) - avg)
+        d = tp - avg
+        out = np.where((np.abs(d) < 0.00000001) | (np.abs(dev) < 0.00000001), 0.0, d / (0.015 * (dev / n)))
+        out[~ready] = np.nan
+        return out
+
+    def MFI(self, high, low, close, volume, n):
+        return self._get(_mfi, n).update(high, low, close, volume, self.on)
+
+    def PPO(self, x, fast, slow):
+        fast_ema = self.EMA(x, fast)
+        slow_ema = self.EMA(x, slow)
+        out = np.where((-0.00000001 < slow_ema) & (slow_ema < 0.00000001), 0.0,
+                       ((fast_ema - slow_ema) / slow_ema) * 100.0)
+        out[np.isnan(slow_ema)] = np.nan
+        return out
+
+    def ROC(self, x, n):
+        prev = self._get(_history, n, np.nan).update(x, self.on)
+        out = np.where(prev != 0.0, ((x / prev) - 1.0) * 100.0, 0.0)
+        out[np.isnan(prev) | np.isnan(x)] = np.nan
+        return out
+
+    def OBV(self, close, volume):
+        return self._get(_obv).update(close, volume, self.on)
+
+    def SAR(self, high, low):
+        return self._get(_sar).update(high, low, self.on)
+
+    def SUPERTREND(self, close, b_ub, b_lb):
+        return self._get(_supertrend).update(close, b_ub, b_lb, self.on)
+
+
+# 指定列的全部状态，step推进一根K线。
+class _engine:
+    def __init__(self, size, columns):
+        self.size = size
+        self.columns = list(columns)
+        self.nodes = {}
+        # 空推进一步，建立所有状态
+        self.step({c: np.full(size, np.nan) for c in INPUT_COLUMNS}, np.zeros(size, dtype=bool))
+
+    def state(self):
+        result = {}
+        for key, node in self.nodes.items():
+            for f, v in node.state().items():
+                result[f"{key}.{f}"] = v
+        return result
+
+    def load(self, state):
+        for key, node in self.nodes.items():
+            node.load({f: state[f"{key}.{f}"] for f in ("cnt",) + node.fields})
+
+    # bar为 {列名: (股票数,)}，on为有新K线的股票，返回 {列名: (股票数,)}。
+    def step(self, bar, on):
+        c = _step_context(self, bar, on)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return {name: c.resolve(name) for name in self.columns}
+
+
+# 所有股票的指标状态，保存在 cache/indicator/state.npz。
+class stock_indicator_state:
+    def __init__(self, path=None):
+        self.path = os.path.join(indicator_state_path, _STATE_FILE) if path is None else path
+        self._lock = threading.RLock()
+        self.codes = []
+        self.columns = []
+        self.last_date = np.empty(0, dtype=np.int32)
+        self.last_close = np.empty(0)
+        self.outputs = {}
+        self.state = {}
+        self.load()
+
+    def load(self):
+        with self._lock:
+            try:
+                if not os.path.isfile(self.path):
+                    return
+                with np.load(self.path) as f:
+                    if int(f["version"]) != _STATE_VERSION:
+                        return
+                    self.codes = f["codes"].tolist()
+                    self.columns = f["columns"].tolist()
+                    self.last_date = f["last_date"]
+                    self.last_close = f["last_close"]
+                    self.outputs = {k[4:]: f[k] for k in f.files if k.startswith("out.")}
+                    self.state = {k[6:]: f[k] for k in f.files if k.startswith("state.")}
+            except Exception as e:
+                logging.error(f"indicator_state.stock_indicator_state.load处理异常：{e}")
+
+    def save(self):
+        with self._lock:
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                data = {"version": np.int32(_STATE_VERSION), "codes": np.array(self.codes, dtype='U6'),
+                        "columns": np.array(self.columns, dtype=str),
+                        "last_date": self.last_date, "last_close": self.last_close}
+                data.update({f"out.{k}": v for k, v in self.outputs.items()})
+                data.update({f"state.{k}": v for k, v in self.state.items()})
+                tmp = f"{self.path}.{os.getpid()}.tmp.npz"
+                np.savez(tmp, **data)
+                os.replace(tmp, self.path)
+            except Exception as e:
+                logging.error(f"indicator_state.stock_indicator_state.save处理异常：{e}")
+
+    # 计算面板中所有股票截止date的指标，返回 (date行的指标 {名称: (股票数,)}, 新状态)。
+    # 已有状态正好停在上一根K线且收盘价一致的股票推进一步；已算到当天的直接取保存的结果；其余用全部历史重算。
+    # 计算状态已有的列加上columns，columns不在已有状态中时所有股票重算。
+    def compute(self, panel, date=None, columns=None):
+        with self._lock:
+            if columns is None:
+                columns = list(tbs.STOCK_STATS_DATA['columns'])
+            usable = set(columns) <= set(self.columns)
+            columns = list(dict.fromkeys(list(self.columns) + list(columns)))
+            cut = panel.date_cut(date)
+            mask = panel.mask[:cut]
+            count = mask.sum(axis=0)
+            size = len(panel.codes)
+            rows = np.arange(cut)[:, None]
+            last_row = np.where(count > 0, np.max(np.where(mask, rows, -1), axis=0), -1)
+            prev_row = np.max(np.where(mask & (rows < last_row), rows, -1), axis=0)
+            close = panel.column('close')[:cut]
+            cols = np.arange(size)
+
+            def at(r):
+                return np.where(r >= 0, close[np.maximum(r, 0), cols], np.nan), \
+                    np.where(r >= 0, panel.dates[np.maximum(r, 0)], -1)
+
+            last_close, last_date = at(last_row)
+            prev_close, prev_date = at(prev_row)
+            index = {c: i for i, c in enumerate(self.codes)}
+            sidx = np.array([index.get(c, -1) for c in panel.codes], dtype=np.int64)
+            has = (sidx >= 0) & usable
+            s_date = np.where(has, self.last_date[np.maximum(sidx, 0)] if len(self.codes) else -1, -2)
+            s_close = np.where(has, self.last_close[np.maximum(sidx, 0)] if len(self.codes) else np.nan, np.nan)
+
+            same = has & (count > 0) & (s_date == last_date) & (s_close == last_close) & bool(self.outputs)
+            step = has & (count > 1) & ~same & (s_date == prev_date) & (s_close == prev_close) & bool(self.state)
+            rebuild = (count > 0) & ~same & ~step
+
+            engine = _engine(size, columns)
+            if self.state and has.any():
+                init = engine.state()
+                for k, v in self.state.items():
+                    init[k][..., has] = v[..., sidx[has]]
+                engine.load(init)
+            outputs = {}
+            if step.any():
+                bar = {c: np.where(step, panel.cells(c, np.maximum(last_row, 0), cols), np.nan) for c in INPUT_COLUMNS}
+                outputs = engine.step(bar, step)
+            if rebuild.any():
+                sub = np.flatnonzero(rebuild)
+                re_engine = _engine(len(sub), columns)
+                arrays, counts, _ = panel.packed(INPUT_COLUMNS, end_date=date, index=sub)
+                length = arrays["close"].shape[0]
+                start = length - counts
+                re_out = None
+                for t in range(int(start.min()), length):
+                    re_out = re_engine.step({c: arrays[c][t] for c in INPUT_COLUMNS}, t >= start)
+                merged = engine.state()
+                for k, v in re_engine.state().items():
+                    merged[k][..., sub] = v
+                engine.load(merged)
+                for k, v in re_out.items():
+                    if k not in outputs:
+                        outputs[k] = np.full(size, np.nan)
+                    outputs[k][sub] = v
+            if same.any():
+                for k, v in self.outputs.items():
+                    if k not in outputs:
+                        outputs[k] = np.full(size, np.nan)
+                    outputs[k][same] = v[sidx[same]]
+            done = step | rebuild | same
+            return outputs, {"codes": panel.codes, "columns": columns, "done": done, "last_date": last_date,
+                             "last_close": last_close, "state": engine.state(), "outputs": outputs}
+
+    # 保存compute的新状态，只覆盖日期不早于原状态的股票。列变化时原状态作废。
+    def commit(self, result):
+        with self._lock:
+            if result["columns"] != self.columns:
+                self.codes, self.columns = [], list(result["columns"])
+                self.last_date, self.last_close = np.empty(0, dtype=np.int32), np.empty(0)
+                self.outputs, self.state = {}, {}
+            index = {c: i for i, c in enumerate(self.codes)}
+            codes = list(self.codes)
+            for c in result["codes"]:
+                if c not in index:
+                    index[c] = len(codes)
+                    codes.append(c)
+            size = len(codes)
+            sidx = np.array([index[c] for c in result["codes"]], dtype=np.int64)
+            old = np.full(size, -1, dtype=np.int32)
+            old[:len(self.codes)] = self.last_date
+            keep = result["done"] & (result["last_date"] >= old[sidx])
+            dst, src = sidx[keep], np.flatnonzero(keep)
+
+            self.last_date = _grow(self.last_date, size, -1)
+            self.last_date[dst] = result["last_date"][src]
+            self.last_close = _grow(self.last_close, size, np.nan)
+            self.last_close[dst] = result["last_close"][src]
+            state = _engine(size, self.columns).state()  # 新增股票为初始状态
+            for k, v in self.state.items():
+                state[k][..., :v.shape[-1]] = v
+            for k, v in result["state"].items():
+                state[k][..., dst] = v[..., src]
+            self.state = state
+            for k, v in result["outputs"].items():
+                self.outputs[k] = _grow(self.outputs.get(k, np.empty(0)), size, np.nan)
+                self.outputs[k][dst] = v[src]
+            self.codes = codes
+            self.save()
+
+
+# 数组扩展到size，新增部分填fill。
+def _grow(v, size, fill):
+    if len(v) >= size:
+        return v
+    out = np.full(size, fill, dtype=v.dtype if len(v) else np.float64)
+    out[:len(v)] = v
+    return out
+
+
+_state = None
+_state_lock = threading.Lock()
+
+
+def get_state():
+    global _state
+    with _state_lock:
+        if _state is None:
+            _state = stock_indicator_state()
+        return _state
+
+
+# 全市场某日的指标结果，格式与 calculate_indicator_panel.get_indicator 相同。
+# save为True时保存新的状态(盘中K线未完成时不要保存)。
+def get_indicator(panel, date=None, save=True, columns=None):
+    try:
+        if columns is None:
+            columns = list(tbs.STOCK_STATS_DATA['columns'])
+        state = get_state()
+        outputs, result = state.compute(panel, date, columns)
+        if save:
+            state.commit(result)
+        total = panel.mask.sum(axis=0)
+        keep = result["done"] | (total <= 1)
+        end_date = None if date is None else date.strftime("%Y-%m-%d")
+        keys = panel.keys()
+        data = {'date': [k[0] if end_date is None else end_date for k in keys],
+                'code': [k[1] for k in keys],
+                'name': [k[2] for k in keys]}
+        for c in columns:
+            val = outputs[c].copy() if c in outputs else np.zeros(len(keys))
+            val[np.isnan(val) | np.isinf(val) | (total <= 1)] = 0
+            data[c] = val
+        return pd.DataFrame(data).loc[keep].reset_index(drop=True)
+    except Exception as e:
+        logging.error(f"indicator_state.get_indicator处理异常：{e}")
+    return None
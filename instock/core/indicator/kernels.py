@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+__author__ = "myh "
+__date__ = "2023/3/10 "
+
+# 逐日递推的指标内核(Supertrend、SAR等)，只处理NumPy数组。
+# 单只股票版本输入一维数组；批量版本输入 (K线数, 股票数) 右对齐数组，一次计算多只股票。
+# 安装了numba时循环编译执行，否则单只股票在Python列表上循环(比逐个iloc取值快两个数量级)，批量按日期向量化递推。
+try:
+    import numba
+
+    _jit = numba.njit(cache=True)
+    COMPILED = True
+except ImportError:
+    COMPILED = False
+
+    def _jit(func):
+        return func
+
+
+@_jit
+def _supertrend(close, b_ub, b_lb, ub, lb, st):
+    for i in range(len(close)):
+        if i == 0:
+            ub[i] = b_ub[i]
+            lb[i] = b_lb[i]
+            if close[i] <= ub[i]:
+                st[i] = ub[i]
+            else:
+                st[i] = lb[i]
+            continue
+
+        last_close = close[i - 1]
+        last_ub = ub[i - 1]
+        last_lb = lb[i - 1]
+        last_st = st[i - 1]
+
+        # calculate current upper band
+        if b_ub[i] < last_ub or last_close > last_ub:
+            ub[i] = b_ub[i]
+        else:
+            ub[i] = last_ub
+
+        # calculate current lower band
+        if b_lb[i] > last_lb or last_close < last_lb:
+            lb[i] = b_lb[i]
+        else:
+            lb[i] = last_lb
+
+        # calculate supertrend
+        if last_st == last_ub:
+            if close[i] <= ub[i]:
+                st[i] = ub[i]
+            else:
+                st[i] = lb[i]
+        elif last_st == last_lb:
+            if close[i] > lb[i]:
+                st[i] = lb[i]
+            else:
+                st[i] = ub[i]
+
+
+@_jit
+def _supertrend_batch(close, b_ub, b_lb, begin, ub, lb, st):
+    for j in range(close.shape[1]):
+        b = begin[j]
+        _supertrend(close[b:, j], b_ub[b:, j], b_lb[b:, j], ub[b:, j], lb[b:, j], st[b:, j])
+
+
+# Supertrend，b_ub/b_lb为基础上下轨(hl_avg ± 3*atr)，返回 (supertrend_ub, supertrend_lb, supertrend)。
+# 无法确定方向时supertrend为NaN。
+def supertrend(close, b_ub, b_lb):
+    close = np.ascontiguousarray(close, dtype=np.float64)
+    b_ub = np.ascontiguousarray(b_ub, dtype=np.float64)
+    b_lb = np.ascontiguousarray(b_lb, dtype=np.float64)
+    size = len(close)
+    if COMPILED:
+        ub = np.empty(size, dtype=np.float64)
+        lb = np.empty(size, dtype=np.float64)
+        st = np.full(size, np.nan, dtype=np.float64)
+        _supertrend(close, b_ub, b_lb, ub, lb, st)
+        return ub, lb, st
+    ub = [0.0] * size
+    lb = [0.0] * size
+    st = [np.nan] * size
+    _supertrend(close.tolist(), b_ub.tolist(), b_lb.tolist(), ub, lb, st)
+    return np.array(ub, dtype=np.float64), np.array(lb, dtype=np.float64), np.array(st, dtype=np.float64)
+
+
+# 批量Supertrend，valid标记有K线的行，每只股票从第一根有效K线开始递推，无效行为NaN。
+def supertrend_batch(close, b_ub, b_lb, valid):
+    if COMPILED:
+        ub = np.full(close.shape, np.nan)
+        lb = np.full(close.shape, np.nan)
+        st = np.full(close.shape, np.nan)
+        begin = np.where(valid.any(axis=0), valid.argmax(axis=0), valid.shape[0])
+        _supertrend_batch(close, b_ub, b_lb, begin, ub, lb, st)
+        return ub, lb, st
+
+    # 逐日递推，每一步同时计算所有股票。
+    size = close.shape[0]
+    ub = np.full(close.shape, np.nan)
+    lb = np.full(close.shape, np.nan)
+    st = np.full(close.shape, np.nan)
+    first = valid & ~np.roll(valid, 1, axis=0)
+    if size > 0:
+        first[0] = valid[0]
+    for t in range(size):
+        if t == 0:
+            ub[t] = b_ub[t]
+            lb[t] = b_lb[t]
+            st[t] = np.where(close[t] <= ub[t], ub[t], lb[t])
+            continue
+        last_close = close[t - 1]
+        last_ub = ub[t - 1]
+        last_lb = lb[t - 1]
+        last_st = st[t - 1]
+        cur_ub = np.where((b_ub[t] < last_ub) | (last_close > last_ub), b_ub[t], last_ub)
+        cur_lb = np.where((b_lb[t] > last_lb) | (last_close < last_lb), b_lb[t], last_lb)
+        cur_st = np.where(last_st == last_ub, np.where(close[t] <= cur_ub, cur_ub, cur_lb),
+                          np.where(last_st == last_lb, np.where(close[t] > cur_lb, cur_lb, cur_ub), np.nan))
+        f = first[t]
+        ub[t] = np.where(f, b_ub[t], cur_ub)
+        lb[t] = np.where(f, b_lb[t], cur_lb)
+        st[t] = np.where(f, np.where(close[t] <= b_ub[t], b_ub[t], b_lb[t]), cur_st)
+    return ub, lb, st
+
+
+# 批量talib SAR(acceleration=0.02, maximum=0.2)，多空状态逐日递推，每一步同时计算所有股票。
+def sar_batch(high, low, acceleration=0.02, maximum=0.2):
+    size = high.shape[0]
+    ok = ~np.isnan(high) & ~np.isnan(low)
+    b = np.where(ok.any(axis=0), ok.argmax(axis=0), size)
+    out = np.full(high.shape, np.nan)
+    count = high.shape[1]
+    is_long = np.ones(count, dtype=bool)
+    af = np.full(count, min(acceleration, maximum))
+    ep = np.zeros(count)
+    sar = np.zeros(count)
+    new_high = np.zeros(count)
+    new_low = np.zeros(count)
+    for t in range(min(b.min(initial=size), size) + 1, size):
+        first = t == b + 1
+        if first.any():
+            diff_p = high[t] - high[t - 1]
+            diff_m = low[t - 1] - low[t]
+            short = (diff_m > 0) & (diff_p < diff_m)
+            is_long = np.where(first, ~short, is_long)
+            ep = np.where(first, np.where(short, low[t], high[t]), ep)
+            sar = np.where(first, np.where(short, high[t - 1], low[t - 1]), sar)
+            new_low = np.where(first, low[t], new_low)
+            new_high = np.where(first, high[t], new_high)
+        active = t > b
+        prev_low = new_low
+        prev_high = new_high
+        new_low = np.where(active, low[t], new_low)
+        new_high = np.where(active, high[t], new_high)
+
+        # 多头被击穿转空
+        l_switch = is_long & (new_low <= sar)
+        # 空头被突破转多
+        s_switch = ~is_long & (new_high >= sar)
+        l_keep = is_long & ~l_switch
+        s_keep = ~is_long & ~s_switch
+
+        s1 = np.where(l_switch, np.maximum(np.maximum(ep, prev_high), new_high), sar)
+        s1 = np.where(s_switch, np.minimum(np.minimum(ep, prev_low), new_low), s1)
+        out[t] = np.where(active, s1, np.nan)
+
+        l_ext = l_keep & (new_high > ep)
+        s_ext = s_keep & (new_low < ep)
+        af_next = np.where(l_ext | s_ext, np.minimum(af + acceleration, maximum), af)
+        af_next = np.where(l_switch | s_switch, acceleration, af_next)
+        ep_next = np.where(l_ext, new_high, ep)
+        ep_next = np.where(s_ext, new_low, ep_next)
+        ep_next = np.where(l_switch, new_low, ep_next)
+        ep_next = np.where(s_switch, new_high, ep_next)
+
+        s2 = s1 + af_next * (ep_next - s1)
+        upper = l_switch | s_keep  # 空头：SAR不低于前两日最高价
+        s2 = np.where(upper, np.maximum(np.maximum(s2, prev_high), new_high),
+                      np.minimum(np.minimum(s2, prev_low), new_low))
+
+        sar = np.where(active, s2, sar)
+        af = np.where(active, af_next, af)
+        ep = np.where(active, ep_next, ep)
+        is_long = np.where(active, (is_long & ~l_switch) | s_switch, is_long)
+    return out
@@ -26,11 +26,21 @@ __author__ = 'myh '
 __date__ = '2023/4/6 '
 
 
+# 图中用到的指标列，只计算这些指标。
+def plot_columns():
+    columns = ["ma10", "ma20", "ma50", "ma200", "vol_5", "vol_10"]
+    for conf in iwd.indicators_dic:
+        for name in conf["dic"]:
+            if name not in columns:
+                columns.append(name)
+    return columns
+
+
 def get_plot_kline(code, stock, date, stock_name):
     plot_list = []
     try:
 
-        data = idr.get_indicators(stock, date, threshold=360)
+        data = idr.compute(stock, plot_columns(), end_date=date, threshold=360)
         if data is None:
             return None
 
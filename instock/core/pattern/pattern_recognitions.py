@@ -2,22 +2,20 @@
 # -*- coding: utf-8 -*-
 
 import logging
+import numpy as np
+import pandas as pd
+import talib.abstract as tla
+import instock.core.hist_index as hix
+import instock.core.hist_store as hst
 
 __author__ = 'myh '
 __date__ = '2023/3/24 '
 
 
 def get_pattern_recognitions(data, stock_column, end_date=None, threshold=120, calc_threshold=None):
-    isCopy = False
-    if end_date is not None:
-        mask = (data['date'] <= end_date)
-        data = data.loc[mask]
-        isCopy = True
-    if calc_threshold is not None:
-        data = data.tail(n=calc_threshold)
-        isCopy = True
-    if isCopy:
-        data = data.copy()
+    # 按日期索引截取最后calc_threshold行，只复制截取后的行。
+    if end_date is not None or calc_threshold is not None:
+        data = hix.history(data, end_date, calc_threshold).copy()
 
     for k in stock_column:
         try:
@@ -68,3 +66,48 @@ def get_pattern_recognition(code_name, data, stock_column, date=None, calc_thres
         logging.error(f"pattern_recognitions.get_pattern_recognition处理异常：{code}代码{e}")
 
     return None
+
+
+_lookbacks = {}
+
+
+# talib形态函数需要的前置K线数。
+def lookback(func):
+    name = func.__name__
+    if name not in _lookbacks:
+        _lookbacks[name] = tla.Function(name).lookback
+    return _lookbacks[name]
+
+
+# 区间内每个交易日的形态，整段K线只计算一次，与逐日调用get_pattern_recognition的结果相同：
+# 逐日计算只取calc_threshold根K线，前置K线数不小于calc_threshold的形态不会出现，结果置0。
+# 返回DataFrame，列为 date,code 加形态列，只包含有形态的日期，没有返回None。
+def get_pattern_recognition_range(code_name, data, stock_column, dates=None, calc_threshold=12):
+    code = code_name[1]
+    try:
+        if data is None or len(data.index) <= 1:
+            return None
+        end_dates = [d.strftime("%Y-%m-%d") for d in dates]
+        rows = np.searchsorted(hix.date_index(data), hst.dates_to_num(end_dates), side='right') - 1
+        data = hix.history(data, end_dates[-1])
+        if len(data.index) == 0:
+            return None
+        keep = rows >= 0
+        rows = rows[keep]
+        open_price, high, low, close = (data[c].values.astype(np.float64) for c in ('open', 'high', 'low', 'close'))
+        result = {'date': np.array(end_dates)[keep], 'code': code}
+        is_has = np.zeros(len(rows), dtype=bool)
+        for k in stock_column:
+            func = stock_column[k]['func']
+            if calc_threshold is not None and lookback(func) >= calc_threshold:
+                val = np.zeros(len(rows), dtype=np.int32)
+            else:
+                val = func(open_price, high, low, close)[rows]
+            result[k] = val
+            is_has |= val != 0
+        if not is_has.any():
+            return None
+        return pd.DataFrame(result).loc[is_has].reset_index(drop=True)
+    except Exception as e:
+        logging.error(f"pattern_recognitions.get_pattern_recognition_range处理异常：{code}代码{e}")
+    return None
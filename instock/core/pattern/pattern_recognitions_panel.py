@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+import numpy as np
+import pandas as pd
+import instock.core.pattern.pattern_recognitions as kpr
+
+__author__ = 'myh '
+__date__ = '2023/3/24 '
+
+# 全市场K线形态一次计算。
+# 每只股票取截止日期的最后calc_threshold根K线，全部股票按顺序首尾相接成一段，每个形态函数只调用一次talib。
+# 形态在某根K线的结果只与它和之前lookback根K线有关：本股票在该K线之前不足lookback根时窗口会跨到前面，
+# 逐只计算时talib在这些位置不输出，这里同样置0。
+# lookback不小于calc_threshold的形态逐只计算时不会出现，整列为0。
+# talib形态的均值用滑动和递推，直接首尾相接时滑动和带着前面股票的舍入误差，比较恰好相等(如价格只有两位小数时)时
+# 结果可能与逐只计算不同，所以每只股票之前插入空K线：先是远大于价格的K线，滑动和中前面股票的价格在舍入中全部丢掉，
+# 再是全0的K线，滑动和减去前面的空K线后恰好为0，本股票的K线从0开始累加。
+# talib遇到NaN会影响之后的滑动和，含NaN的股票单独逐只计算。
+# 结果为 (股票数, 形态数) 的int8矩阵，值为talib结果/20(talib结果为0、±80、±100、±200)。
+INPUT_COLUMNS = ('open', 'high', 'low', 'close')
+SCALE = 20
+# 空K线的价格单位，2的幂：与价格相加减时价格在舍入中丢掉，它们之间相加减没有误差。
+_GAP_PRICE = 2.0 ** 100
+# 空K线的 开盘,最高,最低,收盘，实体、振幅和影线都不为0。
+_GAP_BAR = (0.0, 2 * _GAP_PRICE, -_GAP_PRICE, _GAP_PRICE)
+
+
+# arrays为 stock_hist_panel.packed 得到的 (K线数, 股票数) 二维数组，每只股票右对齐，counts为每只股票的K线数。
+# 返回每只股票最后一根K线的形态矩阵。
+def recognize(arrays, counts, stock_column, calc_threshold=12):
+    length = arrays[INPUT_COLUMNS[0]].shape[0]
+    size = len(counts)
+    result = np.zeros((size, len(stock_column)), dtype=np.int8)
+    if size == 0 or length == 0:
+        return result
+    valid = np.arange(length)[:, None] >= length - counts[None, :]
+    has_nan = np.zeros(size, dtype=bool)
+    for c in INPUT_COLUMNS:
+        has_nan |= (np.isnan(arrays[c]) & valid).any(axis=0)
+    ok = (counts > 0) & ~has_nan
+    single = np.flatnonzero((counts > 0) & has_nan)
+    funcs = {}
+    for k in stock_column:
+        func = stock_column[k]['func']
+        lookback = kpr.lookback(func)
+        if calc_threshold is None or lookback < calc_threshold:
+            funcs[k] = (func, lookback)
+    # 不含NaN的股票首尾相接，每只股票之前是gap根空K线和至少gap根全0的K线(不足length根的部分也为0)。
+    gap = max([lookback for _, lookback in funcs.values()], default=0)
+    rows = 2 * gap + length
+    series = []
+    for c, price in zip(INPUT_COLUMNS, _GAP_BAR):
+        block = np.zeros((rows, int(ok.sum())), dtype=np.float64)
+        block[:gap] = price
+        block[2 * gap:] = np.where(valid[:, ok], arrays[c][:, ok], 0.0)
+        series.append(block.T.ravel())
+    ends = (np.arange(block.shape[1]) + 1) * rows - 1
+
+    for i, k in enumerate(stock_column):
+        if k not in funcs:
+            continue
+        func, lookback = funcs[k]
+        try:
+            if len(ends) > 0:
+                last = func(*series)[ends]
+                last[counts[ok] - 1 < lookback] = 0
+                result[ok, i] = last // SCALE
+            for j in single:
+                bars = [arrays[c][length - counts[j]:, j] for c in INPUT_COLUMNS]
+                result[j, i] = func(*bars)[-1] // SCALE
+        except Exception as e:
+            logging.error(f"pattern_recognitions_panel.recognize处理异常：{k}形态{e}")
+    return result
+
+
+# 面板数据的当日K线形态，返回DataFrame，列为 date,code,name 加形态列，只包含有形态的股票，没有返回None。
+# 与逐只股票调用 get_pattern_recognition 的结果相同。
+def get_pattern_recognition(panel, stock_column, date=None, calc_threshold=12):
+    try:
+        end_date = None if date is None else date.strftime("%Y-%m-%d")
+        arrays, counts, _ = panel.packed(INPUT_COLUMNS, end_date=end_date, length=calc_threshold)
+        # 全部K线不超过1根的股票不计算。
+        counts = np.where(panel.mask.sum(axis=0) <= 1, 0, counts)
+        matrix = recognize(arrays, counts, stock_column, calc_threshold)
+        keep = np.flatnonzero((matrix != 0).any(axis=1))
+        if len(keep) == 0:
+            return None
+        keys = [panel.keys_list[j] for j in keep]
+        data = pd.DataFrame({'date': [k[0] if end_date is None else end_date for k in keys],
+                             'code': [k[1] for k in keys],
+                             'name': [k[2] for k in keys]})
+        values = matrix[keep].astype(np.int32) * SCALE
+        for i, k in enumerate(stock_column):
+            data[k] = values[:, i]
+        return data
+    except Exception as e:
+        logging.error(f"pattern_recognitions_panel.get_pattern_recognition处理异常：{e}")
+    return None
@@ -6,7 +6,9 @@ import concurrent.futures
 import instock.core.stockfetch as stf
 import instock.core.tablestructure as tbs
 import instock.lib.trade_time as trd
+import instock.core.crawling.http_client as http_client
 from instock.lib.singleton_type import singleton_type
+from instock.core.hist_panel import stock_hist_panel
 
 __author__ = 'myh '
 __date__ = '2023/3/10 '
@@ -26,7 +28,7 @@ class stock_data(metaclass=singleton_type):
 
 # 读取股票历史数据
 class stock_hist_data(metaclass=singleton_type):
-    def __init__(self, date=None, stocks=None, workers=16):
+    def __init__(self, date=None, stocks=None, workers=16, concurrency=200):
         if stocks is None:
             _subset = stock_data(date).get_data()[list(tbs.TABLE_CN_STOCK_FOREIGN_KEY['columns'])]
             stocks = [tuple(x) for x in _subset.values]
@@ -35,6 +37,28 @@ class stock_hist_data(metaclass=singleton_type):
             return
         date_start, is_cache = trd.get_trade_hist_interval(stocks[0][0])  # 提高运行效率，只运行一次
         _data = {}
+        # 每个主机的连接池与下载线程数一致，线程之间复用连接。
+        http_client.configure(pool_size=workers)
+        # 全部股票的请求在一个事件循环中同时进行，解析和写入缓存在线程池中进行。
+        _data.update(stf.fetch_stocks_hist(stocks, date_start, is_cache, concurrency=concurrency))
+        # 第一遍没有取得数据的股票(请求重试后仍失败或被限流返回空数据)用线程池降低并发再下载一次。
+        missing = [stock for stock in stocks if stock not in _data]
+        if missing:
+            self._download(missing, date_start, is_cache, max(1, workers // 4), _data)
+        failed = [stock[1] for stock in missing if stock not in _data]
+        logging.info(f"singleton.stock_hist_data：共{len(stocks)}只股票，取得{len(_data)}只，"
+                     f"重新下载{len(missing)}只，未取得{len(failed)}只{failed[:20]}，"
+                     f"请求统计{http_client.stats()}")
+        # 新下载的K线统一写入列式存储。
+        stf.commit_stock_hist_cache("qfq")
+        if not _data:
+            self.data = None
+        else:
+            # 转为数组面板，所有股票共用一块内存，按(date, code, name)取值时再生成DataFrame。
+            self.data = stock_hist_panel.from_frames({k: _data[k] for k in stocks if k in _data})
+
+    @staticmethod
+    def _download(stocks, date_start, is_cache, workers, _data):
         try:
             # max_workers是None还是没有给出，将默认为机器cup个数*5
             with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
@@ -50,10 +74,6 @@ class stock_hist_data(metaclass=singleton_type):
                         logging.error(f"singleton.stock_hist_data处理异常：{stock[1]}代码{e}")
         except Exception as e:
             logging.error(f"singleton.stock_hist_data处理异常：{e}")
-        if not _data:
-            self.data = None
-        else:
-            self.data = _data
 
     def get_data(self):
         return self.data
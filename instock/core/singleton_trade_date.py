@@ -2,7 +2,9 @@
 # -*- coding: utf-8 -*-
 
 import logging
+import threading
 import instock.core.stockfetch as stf
+import instock.core.trade_calendar as tcl
 from instock.lib.singleton_type import singleton_type
 
 __author__ = 'myh '
@@ -10,12 +12,38 @@ __date__ = '2023/3/10 '
 
 
 # 读取股票交易日历数据
+# 数据为本地保存的交易日历(int32天数有序数组)，只有本地没有时才同步下载；当天还没下载过时在后台线程下载更新。
 class stock_trade_date(metaclass=singleton_type):
     def __init__(self):
+        self.data = None
+        self._lock = threading.Lock()
         try:
-            self.data = stf.fetch_stocks_trade_date()
+            self.data = tcl.load()
+            if self.data is None:
+                self.data = self._fetch()
+            elif tcl.is_stale():
+                threading.Thread(target=self.refresh, daemon=True).start()
         except Exception as e:
             logging.error(f"singleton.stock_trade_date处理异常：{e}")
 
+    @staticmethod
+    def _fetch():
+        data = stf.fetch_stocks_trade_date()
+        if data is None:
+            return None
+        return tcl.save(data)
+
+    # 当天还没下载过时下载更新，返回最新的交易日历。日期超出交易日历范围时同步调用。
+    def refresh(self):
+        with self._lock:
+            try:
+                if tcl.is_stale():
+                    data = self._fetch()
+                    if data is not None:
+                        self.data = data
+            except Exception as e:
+                logging.error(f"singleton.stock_trade_date处理异常：{e}")
+        return self.data
+
     def get_data(self):
         return self.data
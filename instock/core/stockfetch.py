@@ -5,10 +5,15 @@ import logging
 import os.path
 import datetime
 import traceback
+import json
+import asyncio
+import concurrent.futures
 import numpy as np
 import pandas as pd
+import requests
 import talib as tl
 import instock.core.tablestructure as tbs
+import instock.core.hist_store as hst
 import instock.lib.trade_time as trd
 import instock.core.crawling.trade_date_hist as tdh
 import instock.core.crawling.fund_etf_em as fee
@@ -19,6 +24,7 @@ import instock.core.crawling.stock_dzjy_em as sde
 import instock.core.crawling.stock_hist_em as she
 import instock.core.crawling.stock_fund_em as sff
 import instock.core.crawling.stock_fhps_em as sfe
+import instock.core.crawling.http_client as http_client
 
 __author__ = "myh "
 __date__ = "2023/3/10 "
@@ -304,59 +310,255 @@ def fetch_stock_hist(data_base, date_start=None, is_cache=True):
             date
         )  # 提高运行效率，只运行一次
         # date_end = date_end.strftime("%Y%m%d")
+        # 单独调用时读取其它进程写入的新版本，批量调用由调用方读取一次。
+        hst.get_store("qfq").load()
     try:
-        data = stock_hist_cache(code, date_start, None, is_cache, "qfq")
-        if data is not None:
-            data.loc[:, "p_change"] = tl.ROC(data["close"].values, 1)
-            data["p_change"].values[np.isnan(data["p_change"].values)] = 0.0
-            data["volume"] = (
-                data["volume"].values.astype("double") * 100
-            )  # 成交量单位从手变成股。
-        return data
+        return _hist_change(stock_hist_cache(code, date_start, None, is_cache, "qfq"))
     except Exception as e:
         logging.error(f"stockfetch.fetch_stock_hist处理异常：{e}")
     return None
 
 
+# 计算涨跌幅，成交量单位从手变成股。
+def _hist_change(data):
+    if data is not None:
+        data.loc[:, "p_change"] = tl.ROC(data["close"].values, 1)
+        data["p_change"].values[np.isnan(data["p_change"].values)] = 0.0
+        data["volume"] = (
+            data["volume"].values.astype("double") * 100
+        )  # 成交量单位从手变成股。
+    return data
+
+
 # 增加读取股票缓存方法。加快处理速度。多线程解决效率
+# 历史数据保存在列式存储中，只下载缓存最后日期之后的K线并追加，不再按日期目录整段重新下载。
+# 更新后的数据先暂存，由调用方commit_stock_hist_cache统一写入。
 def stock_hist_cache(code, date_start, date_end=None, is_cache=True, adjust=""):
-    cache_dir = os.path.join(stock_hist_cache_path, date_start[0:6], date_start)
-    # 如果没有文件夹创建一个。月文件夹和日文件夹。方便删除。
+    store = hst.get_store(adjust)
     try:
-        if not os.path.exists(cache_dir):
-            os.makedirs(cache_dir)
-    except Exception:
-        pass
-    cache_file = os.path.join(cache_dir, "%s%s.gzip.pickle" % (code, adjust))
-    # 如果缓存存在就直接返回缓存数据。压缩方式。
-    try:
-        if os.path.isfile(cache_file):
-            return pd.read_pickle(cache_file, compression="gzip")
-        else:
-            if date_end is not None:
-                stock = she.stock_zh_a_hist(
-                    symbol=code,
-                    period="daily",
-                    start_date=date_start,
-                    end_date=date_end,
-                    adjust=adjust,
-                )
-            else:
-                stock = she.stock_zh_a_hist(
-                    symbol=code, period="daily", start_date=date_start, adjust=adjust
-                )
-
-            if stock is None or len(stock.index) == 0:
+        cache = store.get(code)
+        stock = None
+        is_changed = True
+        if _cache_usable(cache, date_start):
+            stock = _append_hist_tail(code, cache[1], date_end, adjust)
+            if stock is not None and stock is cache[1]:
+                is_changed = False  # 没有新数据，不需要重写缓存。
+        if stock is None:
+            # 没有缓存、缓存区间不够或者复权数据被重算，重新下载整段数据。
+            stock = _fetch_hist(code, date_start, date_end, adjust)
+            if stock is None:
                 return None
-            stock.columns = tuple(tbs.CN_STOCK_HIST_DATA["columns"])
-            stock = stock.sort_index()  # 将数据按照日期排序下。
-            try:
-                if is_cache:
-                    stock.to_pickle(cache_file, compression="gzip")
-            except Exception:
-                pass
-            # time.sleep(1)
-            return stock
+            cache = (date_start, stock)
+        return _stage_hist(store, code, cache[0], stock, is_changed, date_start, date_end, is_cache)
     except Exception as e:
         logging.error(f"stockfetch.stock_hist_cache处理异常：{code}代码{e}")
     return None
+
+
+# 缓存的开始日期不晚于date_start时只需下载缓存最后日期之后的部分。
+def _cache_usable(cache, date_start):
+    return cache is not None and cache[0] <= date_start and len(cache[1].index) > 0
+
+
+# 暂存有变化的数据，start为数据的开始日期，返回date_start到date_end之间的部分。
+def _stage_hist(store, code, start, stock, is_changed, date_start, date_end, is_cache):
+    # 盘中数据不完整，不写入缓存，下次从缓存最后日期继续追加。
+    if is_cache and is_changed and date_end is None:
+        store.stage(code, start, stock)
+    _date_start = f"{date_start[0:4]}-{date_start[4:6]}-{date_start[6:8]}"
+    mask = stock["date"].values >= _date_start
+    if date_end is not None:
+        mask &= stock["date"].values <= f"{date_end[0:4]}-{date_end[4:6]}-{date_end[6:8]}"
+    stock = stock.loc[mask].reset_index(drop=True)
+    if len(stock.index) == 0:
+        return None
+    return stock
+
+
+# 批量下载股票历史数据，返回 {stock: DataFrame}，没有取得数据的股票不在结果中，数据与逐只调用fetch_stock_hist相同。
+# 请求在一个线程的事件循环中同时进行，返回json的解析、列类型转换、与缓存合并和暂存在parse_workers个线程中进行，
+# 每只股票完成后立即暂存到列式存储，由调用方commit_stock_hist_cache统一写入。
+def fetch_stocks_hist(stocks, date_start=None, is_cache=True, concurrency=200, parse_workers=4):
+    if not stocks:
+        return {}
+    if date_start is None:
+        date_start, is_cache = trd.get_trade_hist_interval(
+            stocks[0][0]
+        )  # 提高运行效率，只运行一次
+    try:
+        she.code_id_map_em()  # 代码对应的市场在事件循环之外取得并缓存。
+        return _run_async(_fetch_stocks_hist(stocks, date_start, is_cache, "qfq", concurrency, parse_workers))
+    except Exception as e:
+        logging.error(f"stockfetch.fetch_stocks_hist处理异常：{e}")
+    return {}
+
+
+# 批量下载ETF历史数据，返回 {etf: DataFrame}，数据与逐只调用fetch_etf_hist相同。
+def fetch_etfs_hist(etfs, date_start=None, date_end=None, adjust="qfq", concurrency=200, parse_workers=4):
+    if not etfs:
+        return {}
+    if date_start is None:
+        date_start, is_cache = trd.get_trade_hist_interval(
+            etfs[0][0]
+        )  # 提高运行效率，只运行一次
+    try:
+        end = "20500101" if date_end is None else date_end
+        # 请求在事件循环之外生成，代码对应的市场只取一次。
+        _requests = {etf: fee.fund_etf_hist_em_request(etf[1], "daily", date_start, end, adjust) for etf in etfs}
+        return _run_async(_fetch_etfs_hist(_requests, concurrency, parse_workers))
+    except Exception as e:
+        logging.error(f"stockfetch.fetch_etfs_hist处理异常：{e}")
+    return {}
+
+
+# 同步运行协程，当前线程已有运行中的事件循环时在新线程中运行。
+def _run_async(coro):
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coro).result()
+
+
+# 解析返回的json，转换为历史数据的列。
+def _parse_hist(frame, content):
+    return _hist_frame(frame(json.loads(content)))
+
+
+# 重试后仍不是2xx的响应抛出异常，由调用方记录，该代码留给之后的逐只补下载。
+async def _fetch_hist_async(client, executor, frame, url, params):
+    status, content = await client.get(url, params=params)
+    if not 200 <= status < 300:
+        raise requests.HTTPError(f"{status}状态码：{url}")
+    return await asyncio.get_running_loop().run_in_executor(executor, _parse_hist, frame, content)
+
+
+async def _fetch_stocks_hist(stocks, date_start, is_cache, adjust, concurrency, parse_workers):
+    store = hst.get_store(adjust)
+    store.load()  # 其它进程可能已写入新版本，整批只读取一次。
+    loop = asyncio.get_running_loop()
+    client = http_client.async_client(concurrency)
+    result = {}
+
+    async def fetch(code, start):
+        url, params = she.stock_zh_a_hist_request(code, "daily", start, "20500101", adjust)
+        return await _fetch_hist_async(client, executor, she.stock_zh_a_hist_frame, url, params)
+
+    def finish(code, start, stock, is_changed):
+        return _hist_change(_stage_hist(store, code, start, stock, is_changed, date_start, None, is_cache))
+
+    # 与stock_hist_cache相同：有缓存时只下载缓存最后一日之后的部分，否则下载整段数据。
+    async def fetch_one(stock):
+        code = stock[1]
+        try:
+            cache = await loop.run_in_executor(executor, store.get, code)
+            data = None
+            is_changed = True
+            if _cache_usable(cache, date_start):
+                tail = await fetch(code, cache[1]["date"].values[-1].replace("-", ""))
+                data = await loop.run_in_executor(executor, _merge_hist_tail, cache[1], tail)
+                if data is not None and data is cache[1]:
+                    is_changed = False  # 没有新数据，不需要重写缓存。
+            if data is None:
+                data = await fetch(code, date_start)
+                if data is None:
+                    return
+                cache = (date_start, data)
+            data = await loop.run_in_executor(executor, finish, code, cache[0], data, is_changed)
+            if data is not None:
+                result[stock] = data
+        except Exception as e:
+            logging.error(f"stockfetch.fetch_stocks_hist处理异常：{code}代码{e}")
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=parse_workers) as executor:
+            await asyncio.gather(*(fetch_one(stock) for stock in stocks))
+    finally:
+        await client.close()
+    return result
+
+
+async def _fetch_etfs_hist(_requests, concurrency, parse_workers):
+    loop = asyncio.get_running_loop()
+    client = http_client.async_client(concurrency)
+    result = {}
+
+    async def fetch_one(etf, url, params):
+        try:
+            data = await _fetch_hist_async(client, executor, fee.fund_etf_hist_em_frame, url, params)
+            if data is not None:
+                result[etf] = await loop.run_in_executor(executor, _hist_change, data)
+        except Exception as e:
+            logging.error(f"stockfetch.fetch_etfs_hist处理异常：{etf[1]}代码{e}")
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=parse_workers) as executor:
+            await asyncio.gather(*(fetch_one(etf, *_requests[etf]) for etf in _requests))
+    finally:
+        await client.close()
+    return result
+
+
+# 将暂存的历史数据写入列式存储。
+def commit_stock_hist_cache(adjust="qfq"):
+    hst.get_store(adjust).commit()
+
+
+# 下载股票某时间段的历史数据
+def _fetch_hist(code, date_start, date_end=None, adjust=""):
+    if date_end is not None:
+        stock = she.stock_zh_a_hist(
+            symbol=code,
+            period="daily",
+            start_date=date_start,
+            end_date=date_end,
+            adjust=adjust,
+        )
+    else:
+        stock = she.stock_zh_a_hist(
+            symbol=code, period="daily", start_date=date_start, adjust=adjust
+        )
+    return _hist_frame(stock)
+
+
+# 下载的数据改为历史数据的列名，并按日期排序。
+def _hist_frame(stock):
+    if stock is None or len(stock.index) == 0:
+        return None
+    stock.columns = tuple(tbs.CN_STOCK_HIST_DATA["columns"])
+    stock = stock.sort_index()  # 将数据按照日期排序下。
+    return stock
+
+
+# 从缓存最后一日开始下载，重叠的一日用来校验复权数据是否被重算。
+# 返回None表示需要重新下载整段数据，返回原缓存对象表示没有新数据。
+def _append_hist_tail(code, cache_data, date_end=None, adjust=""):
+    if cache_data is None or len(cache_data.index) == 0:
+        return None
+    last_date = cache_data["date"].values[-1]
+    if date_end is not None and last_date.replace("-", "") >= date_end:
+        return cache_data
+    return _merge_hist_tail(cache_data, _fetch_hist(code, last_date.replace("-", ""), date_end, adjust))
+
+
+# 缓存数据与从缓存最后一日开始的新数据合并。
+def _merge_hist_tail(cache_data, tail):
+    if tail is None:
+        # 停牌等原因没有新数据。
+        return cache_data
+    last_row = cache_data.iloc[-1]
+    first_row = tail.iloc[0]
+    if first_row["date"] != last_row["date"]:
+        return None
+    _cols = ["open", "close", "high", "low"]
+    if not np.allclose(
+        first_row[_cols].values.astype(float),
+        last_row[_cols].values.astype(float),
+        rtol=1e-6,
+        atol=1e-6,
+    ):
+        return None  # 除权除息后前复权价格整体变化。
+    if len(tail.index) == 1:
+        return cache_data
+    return pd.concat([cache_data, tail.iloc[1:]], ignore_index=True)
@@ -1,8 +1,8 @@
 #!/usr/local/bin/python
 # -*- coding: utf-8 -*-
 
-import numpy as np
-import talib as tl
+import instock.core.strategy.features as fts
+import instock.core.hist_index as hix
 from datetime import datetime, timedelta
 
 __author__ = 'myh '
@@ -14,22 +14,24 @@ __date__ = '2023/3/10 '
 # 2.前段由年线(250日)以下向上突破
 # 3.后段必须在年线以上运行，且后段最低价日与最高价日相差必须在10-50日间
 # 4.回踩伴随缩量：最高价日交易量/后段最低价日交易量>2,后段最低价/最高价<0.8
-def check(code_name, data, date=None, threshold=60):
+# min_days、max_days为最低价日与最高价日相差天数的范围，供参数扫描调整。
+# features为作业共用的衍生数据缓存(features.feature_cache)，年线只计算一次。
+def check(code_name, data, date=None, threshold=60, min_days=10, max_days=50, features=None):
+    origin_data = data
     if date is None:
         end_date = code_name[0]
     else:
         end_date = date.strftime("%Y-%m-%d")
 
     if end_date is not None:
-        mask = (data['date'] <= end_date)
-        data = data.loc[mask].copy()
+        data = hix.history(data, end_date)
     if len(data.index) < 250:
         return False
 
-    data.loc[:, 'ma250'] = tl.MA(data['close'].values, timeperiod=250)
-    data['ma250'].values[np.isnan(data['ma250'].values)] = 0.0
+    ma250 = fts.ma(code_name, origin_data, 'close', 250, features)[:len(data.index)]
 
     data = data.tail(n=threshold)
+    data = data.assign(ma250=ma250[len(ma250) - len(data.index):])
 
     # 区间最低点
     lowest_row = [1000000, 0, '']
@@ -75,7 +77,7 @@ def check(code_name, data, date=None, threshold=60):
     date_diff = datetime.date(datetime.strptime(recent_lowest_row[2], '%Y-%m-%d')) - \
                 datetime.date(datetime.strptime(highest_row[2], '%Y-%m-%d'))
 
-    if not (timedelta(days=10) <= date_diff <= timedelta(days=50)):
+    if not (timedelta(days=min_days) <= date_diff <= timedelta(days=max_days)):
         return False
     # 回踩伴随缩量
     vol_ratio = highest_row[1] / recent_lowest_row[1]
@@ -1,9 +1,8 @@
 #!/usr/local/bin/python
 # -*- coding: utf-8 -*-
 
-from datetime import datetime
-import numpy as np
-import talib as tl
+import instock.core.strategy.features as fts
+import instock.core.hist_index as hix
 from instock.core.strategy import enter
 
 __author__ = 'myh '
@@ -14,27 +13,30 @@ __date__ = '2023/3/10 '
 # 1.60日内某日收盘价>=60日均线>开盘价
 # 2.且【1】放量上涨
 # 3.且【1】间之前时间，任意一天收盘价与60日均线偏离在-5%~20%之间。
-def check(code_name, data, date=None, threshold=60):
+# features为衍生数据缓存(features.feature_cache)，60日均线、放量上涨的结果只计算一次。
+def check(code_name, data, date=None, threshold=60, features=None):
     origin_data = data
     if date is None:
         end_date = code_name[0]
     else:
         end_date = date.strftime("%Y-%m-%d")
     if end_date is not None:
-        mask = (data['date'] <= end_date)
-        data = data.loc[mask].copy()
+        data = hix.history(data, end_date)
     if len(data.index) < threshold:
         return False
 
-    data.loc[:, 'ma60'] = tl.MA(data['close'].values, timeperiod=60)
-    data['ma60'].values[np.isnan(data['ma60'].values)] = 0.0
+    ma60 = fts.ma(code_name, origin_data, 'close', 60, features)[:len(data.index)]
 
+    size = len(data.index)
     data = data.tail(n=threshold)
+    data = data.assign(ma60=ma60[size - len(data.index):])
+    # 各行为截止日的放量上涨结果，取区间内的行。
+    volume_flags = enter.volume_flags(code_name, origin_data, threshold, features=features)[size - len(data.index):size]
 
     breakthrough_row = None
-    for _close, _open, _date, _ma60 in zip(data['close'].values, data['open'].values, data['date'].values, data['ma60'].values):
+    for _close, _open, _date, _ma60, _volume in zip(data['close'].values, data['open'].values, data['date'].values, data['ma60'].values, volume_flags):
         if _open < _ma60 <= _close:
-            if enter.check_volume(code_name, origin_data, date=datetime.date(datetime.strptime(_date, '%Y-%m-%d')), threshold=threshold):
+            if _volume:
                 breakthrough_row = _date
                 break
 
@@ -1,9 +1,8 @@
 #!/usr/local/bin/python
 # -*- coding: utf-8 -*-
 
-
-import numpy as np
-import talib as tl
+import instock.core.strategy.features as fts
+import instock.core.hist_index as hix
 
 __author__ = 'myh '
 __date__ = '2023/3/10 '
@@ -12,14 +11,16 @@ __date__ = '2023/3/10 '
 # 1.跌>9.5%
 # 2.成交额不低于2亿
 # 3.成交量至少是5日平均成交量的4倍
-def check(code_name, data, date=None, threshold=60):
+# min_amount、min_vol_ratio为成交额、量比的下限，供参数扫描调整。
+# features为作业共用的衍生数据缓存(features.feature_cache)，5日均量只计算一次。
+def check(code_name, data, date=None, threshold=60, min_amount=200000000, min_vol_ratio=4, features=None):
+    origin_data = data
     if date is None:
         end_date = code_name[0]
     else:
         end_date = date.strftime("%Y-%m-%d")
     if end_date is not None:
-        mask = (data['date'] <= end_date)
-        data = data.loc[mask].copy()
+        data = hix.history(data, end_date)
     if len(data.index) < threshold:
         return False
 
@@ -27,10 +28,6 @@ def check(code_name, data, date=None, threshold=60):
     if p_change > -9.5:
         return False
 
-    data.loc[:, 'vol_ma5'] = tl.MA(data['volume'].values, timeperiod=5)
-    data['vol_ma5'].values[np.isnan(data['vol_ma5'].values)] = 0.0
-
-    data = data.tail(n=threshold + 1)
     if len(data.index) < threshold + 1:
         return False
 
@@ -42,15 +39,15 @@ def check(code_name, data, date=None, threshold=60):
     amount = last_close * last_vol
 
     # 成交额不低于2亿
-    if amount < 200000000:
+    if amount < min_amount:
         return False
 
-    data = data.head(n=threshold)
-
-    mean_vol = data.iloc[-1]['vol_ma5']
+    vol_ma5 = fts.ma(code_name, origin_data, 'volume', 5, features)[:len(data.index)]
+    # 前一天的5日均量
+    mean_vol = vol_ma5[-2]
 
     vol_ratio = last_vol / mean_vol
-    if vol_ratio >= 4:
+    if vol_ratio >= min_vol_ratio:
         return True
     else:
         return False
@@ -2,8 +2,8 @@
 # -*- coding: utf-8 -*-
 
 import numpy as np
-import talib as tl
-
+import instock.core.strategy.features as fts
+import instock.core.hist_index as hix
 
 __author__ = 'myh '
 __date__ = '2023/3/10 '
@@ -13,45 +13,39 @@ __date__ = '2023/3/10 '
 # 1.当日比前一天上涨小于2%或收盘价小于开盘价
 # 2.当日成交额不低于2亿
 # 3.当日成交量/5日平均成交量>=2
-def check_volume(code_name, data, date=None, threshold=60):
+# min_amount、min_vol_ratio为成交额、量比的下限，供参数扫描调整。
+# features为衍生数据缓存(features.feature_cache)，各行的结果只计算一次，之后逐日检查只是查表。
+def check_volume(code_name, data, date=None, threshold=60, min_amount=200000000, min_vol_ratio=2, features=None):
     if date is None:
         end_date = code_name[0]
     else:
         end_date = date.strftime("%Y-%m-%d")
+    size = len(data.index)
     if end_date is not None:
-        mask = (data['date'] <= end_date)
-        data = data.loc[mask].copy()
-    if len(data.index) < threshold:
-        return False
-
-    p_change = data.iloc[-1]['p_change']
-    if p_change < 2 or data.iloc[-1]['close'] < data.iloc[-1]['open']:
-        return False
-
-    data.loc[:, 'vol_ma5'] = tl.MA(data['volume'].values, timeperiod=5)
-    data['vol_ma5'].values[np.isnan(data['vol_ma5'].values)] = 0.0
-
-    data = data.tail(n=threshold + 1)
-    if len(data) < threshold + 1:
-        return False
-
-    # 最后一天收盘价
-    last_close = data.iloc[-1]['close']
-    # 最后一天成交量
-    last_vol = data.iloc[-1]['volume']
-
-    amount = last_close * last_vol
-
-    # 成交额不低于2亿
-    if amount < 200000000:
-        return False
-
-    data = data.head(n=threshold)
-
-    mean_vol = data.iloc[-1]['vol_ma5']
-
-    vol_ratio = last_vol / mean_vol
-    if vol_ratio >= 2:
-        return True
-    else:
+        size = hix.cut(data, end_date)
+    if size < threshold + 1:
         return False
+    return bool(volume_flags(code_name, data, threshold, min_amount, min_vol_ratio, features)[size - 1])
+
+
+# 以每一行为截止日的放量上涨结果(与行对应)，data按日期升序，一次计算整个DataFrame。
+# 第i行的结果与 check_volume 截止到第i行的日期一致。
+def volume_flags(code_name, data, threshold=60, min_amount=200000000, min_vol_ratio=2, features=None):
+    def _flags():
+        close = data['close'].values
+        volume = data['volume'].values
+        vol_ma5 = fts.ma(code_name, data, 'volume', 5, features)
+        flags = np.zeros(len(data.index), dtype=bool)
+        if len(flags) < threshold + 1:
+            return flags
+        with np.errstate(invalid='ignore', divide='ignore'):
+            # 前一天的5日均量
+            vol_ratio = volume[1:] / vol_ma5[:-1]
+            flags[1:] = ~((data['p_change'].values[1:] < 2) | (close[1:] < data['open'].values[1:])) & \
+                ~(close[1:] * volume[1:] < min_amount) & (vol_ratio >= min_vol_ratio)
+        flags[:threshold] = False
+        return flags
+
+    if features is None:
+        return _flags()
+    return features.get(code_name, data, 'check_volume', (threshold, min_amount, min_vol_ratio), _flags)
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import inspect
+import numpy as np
+import talib as tl
+
+__author__ = 'myh '
+__date__ = '2023/3/10 '
+
+
+# 策略检查共用的衍生数据缓存，按 (代码, 数据名, 参数) 保存。
+# 值在股票的整个DataFrame上计算，与DataFrame的行对应；talib的均线等在某行的值只与之前的行有关，
+# 策略按日期截取前面的行后结果与在截取后的数据上计算一致。
+# 同一个缓存中同一代码的DataFrame必须相同，键中带行数防止误用。
+# 作业中按股票创建，该股票的全部日期、全部策略、全部参数组合共用，内存随股票释放。
+class feature_cache:
+    def __init__(self):
+        self._cache = {}
+
+    def get(self, code_name, data, name, params, func):
+        key = (code_name[1], name, params, len(data.index))
+        value = self._cache.get(key)
+        if value is None:
+            value = func()
+            self._cache[key] = value
+        return value
+
+
+# talib.MA，历史不足的为0。
+def _ma(values, period):
+    ma = tl.MA(values, timeperiod=period)
+    ma[np.isnan(ma)] = 0.0
+    return ma
+
+
+# 整个DataFrame上column列的period日均线(与行对应)，历史不足的为0，features不为None时从缓存取。
+def ma(code_name, data, column, period, features=None):
+    if features is None:
+        return _ma(data[column].values, period)
+    return features.get(code_name, data, 'ma', (column, period), lambda: _ma(data[column].values, period))
+
+
+# 策略检查函数是否接受features参数。
+def accepts(fun):
+    try:
+        return 'features' in inspect.signature(fun).parameters
+    except (TypeError, ValueError):
+        return False
@@ -1,6 +1,7 @@
 #!/usr/local/bin/python
 # -*- coding: utf-8 -*-
 
+import instock.core.hist_index as hix
 
 __author__ = 'myh '
 __date__ = '2023/3/10 '
@@ -19,8 +20,7 @@ def check_high_tight(code_name, data, date=None, threshold=60, istop=False):
     else:
         end_date = date.strftime("%Y-%m-%d")
     if end_date is not None:
-        mask = (data['date'] <= end_date)
-        data = data.loc[mask]
+        data = hix.history(data, end_date)
     if len(data.index) < threshold:
         return False
 
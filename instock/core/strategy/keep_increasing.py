@@ -1,8 +1,8 @@
 #!/usr/local/bin/python
 # -*- coding: utf-8 -*-
 
-import numpy as np
-import talib as tl
+import instock.core.strategy.features as fts
+import instock.core.hist_index as hix
 
 __author__ = 'myh '
 __date__ = '2023/3/10 '
@@ -12,21 +12,22 @@ __date__ = '2023/3/10 '
 # 均线多头
 # 1.30日前的30日均线<20日前的30日均线<10日前的30日均线<当日的30日均线
 # 3.(当日的30日均线/30日前的30日均线)>1.2
-def check(code_name, data, date=None, threshold=30):
+# features为作业共用的衍生数据缓存(features.feature_cache)，30日均线只计算一次。
+def check(code_name, data, date=None, threshold=30, features=None):
+    origin_data = data
     if date is None:
         end_date = code_name[0]
     else:
         end_date = date.strftime("%Y-%m-%d")
     if end_date is not None:
-        mask = (data['date'] <= end_date)
-        data = data.loc[mask].copy()
+        data = hix.history(data, end_date)
     if len(data.index) < threshold:
         return False
 
-    data.loc[:, 'ma30'] = tl.MA(data['close'].values, timeperiod=30)
-    data['ma30'].values[np.isnan(data['ma30'].values)] = 0.0
+    ma30 = fts.ma(code_name, origin_data, 'close', 30, features)[:len(data.index)]
 
     data = data.tail(n=threshold)
+    data = data.assign(ma30=ma30[len(ma30) - len(data.index):])
 
     step1 = round(threshold / 3)
     step2 = round(threshold * 2 / 3)
@@ -1,6 +1,7 @@
 #!/usr/local/bin/python
 # -*- coding: utf-8 -*-
 
+import instock.core.hist_index as hix
 
 __author__ = 'myh '
 __date__ = '2023/3/10 '
@@ -9,14 +10,14 @@ __date__ = '2023/3/10 '
 # 低ATR成长
 # 1.必须至少上市交易250日
 # 2.最近10个交易日的最高收盘价必须比最近10个交易日的最低收盘价高1.1倍
-def check_low_increase(code_name, data, date=None, ma_short=30, ma_long=250, threshold=10):
+# min_ratio为涨幅倍数的下限，供参数扫描调整。
+def check_low_increase(code_name, data, date=None, ma_short=30, ma_long=250, threshold=10, min_ratio=1.1):
     if date is None:
         end_date = code_name[0]
     else:
         end_date = date.strftime("%Y-%m-%d")
     if end_date is not None:
-        mask = (data['date'] <= end_date)
-        data = data.loc[mask]
+        data = hix.history(data, end_date)
     if len(data.index) < ma_long:
         return False
 
@@ -57,7 +58,7 @@ def check_low_increase(code_name, data, date=None, ma_short=30, ma_long=250, thr
 
     ratio = (highest_row - lowest_row) / lowest_row
 
-    if ratio > 1.1:
+    if ratio > min_ratio:
         return True
 
     return False
@@ -1,8 +1,8 @@
 #!/usr/local/bin/python
 # -*- coding: utf-8 -*-
 
-from datetime import datetime
 from instock.core.strategy import turtle_trade
+import instock.core.hist_index as hix
 
 __author__ = 'myh '
 __date__ = '2023/3/10 '
@@ -12,25 +12,28 @@ __date__ = '2023/3/10 '
 # 1.最近15日有涨幅大于9.5%，且必须是放量上涨
 # 2.紧接的下个交易日必须高开，收盘价必须上涨，且与开盘价不能大于等于相差3%
 # 3.接下2、3个交易日必须高开，收盘价必须上涨，且与开盘价不能大于等于相差3%，且每天涨跌幅在5%间
-def check(code_name, data, date=None, threshold=15):
+# features为衍生数据缓存(features.feature_cache)，海龟交易法则的结果只计算一次。
+def check(code_name, data, date=None, threshold=15, features=None):
     origin_data = data
     if date is None:
         end_date = code_name[0]
     else:
         end_date = date.strftime("%Y-%m-%d")
     if end_date is not None:
-        mask = (data['date'] <= end_date)
-        data = data.loc[mask]
+        data = hix.history(data, end_date)
     if len(data.index) < threshold:
         return False
 
+    # 各行为截止日的海龟交易法则结果，取区间内的行。
+    size = len(data.index)
     data = data.tail(n=threshold)
+    enter_flags = turtle_trade.enter_flags(code_name, origin_data, threshold, features)[size - len(data.index):size]
 
     limitup_row = [1000000, '']
     # 找出涨停日
-    for _close, _p_change, _date in zip(data['close'].values, data['p_change'].values, data['date'].values):
+    for _close, _p_change, _date, _enter in zip(data['close'].values, data['p_change'].values, data['date'].values, enter_flags):
         if _p_change > 9.5:
-            if turtle_trade.check_enter(code_name, origin_data, date=datetime.date(datetime.strptime(_date, '%Y-%m-%d')), threshold=threshold):
+            if _enter:
                 limitup_row[0] = _close
                 limitup_row[1] = _date
                 if check_internal(data, limitup_row):
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+import numpy as np
+import pandas as pd
+import instock.lib.executor as exe
+from instock.core.strategy import enter
+from instock.core.strategy import turtle_trade
+from instock.core.strategy import climax_limitdown
+from instock.core.strategy import low_atr
+from instock.core.strategy import backtrace_ma250
+from instock.core.strategy import breakthrough_platform
+from instock.core.strategy import parking_apron
+from instock.core.strategy import low_backtrace_increase
+from instock.core.strategy import keep_increasing
+from instock.core.strategy import high_tight_flag
+
+__author__ = 'myh '
+__date__ = '2023/3/10 '
+
+# 全部策略在历史数据面板上向量化选股。
+# 截止某日每只股票最后WINDOW根K线按股票右对齐取出 (WINDOW, 股票数) 数组，每个策略对全部股票一次计算，
+# 结果与逐只股票调用策略检查函数一致(包括各函数循环中的边界处理)，均线按talib.MA的定义计算，历史不足时为0。
+WINDOW = 310  # 回踩年线需要最近60根K线的250日均线
+_COLUMNS = ('open', 'close', 'high', 'low', 'volume', 'p_change')
+
+
+# 截止date的窗口数据。
+class _window:
+    def __init__(self, panel, date):
+        arrays, _, self.dates = panel.packed(_COLUMNS, end_date=date, length=WINDOW)
+        self.open = arrays['open']
+        self.close = arrays['close']
+        self.high = arrays['high']
+        self.low = arrays['low']
+        self.volume = arrays['volume']
+        self.p_change = arrays['p_change']
+        cut = panel.date_cut(date)
+        self.counts = panel.mask[:cut].sum(axis=0)  # 截止date的全部K线数
+        self.size = WINDOW
+
+    # 行r对应的K线是该股票截止date的第几根(从1开始)。
+    def bars(self, r):
+        return self.counts - self.size + r + 1
+
+    # talib.MA(x, period) 在行r的值，历史不足为0。
+    def ma(self, x, period, r):
+        if r - period + 1 < 0:
+            return np.zeros(x.shape[1])
+        m = x[r - period + 1:r + 1].sum(axis=0) / period
+        m[np.isnan(m)] = 0.0
+        return m
+
+
+# 以某一行为截止日的放量上涨(enter.check_volume)。
+def _volume_rise(w, r, threshold, min_amount, min_vol_ratio, rise=True):
+    c = w.close[r]
+    v = w.volume[r]
+    p = w.p_change[r]
+    if rise:
+        ok = ~((p < 2) | (c < w.open[r]))
+    else:
+        ok = ~(p > -9.5)
+    ok &= w.bars(r) >= threshold + 1
+    ok &= ~(c * v < min_amount)
+    mean_vol = w.ma(w.volume, 5, r - 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ok &= v / mean_vol >= min_vol_ratio
+    return ok
+
+
+def _enter(w, threshold=60, min_amount=200000000, min_vol_ratio=2):
+    return _volume_rise(w, w.size - 1, threshold, min_amount, min_vol_ratio)
+
+
+def _climax_limitdown(w, threshold=60, min_amount=200000000, min_vol_ratio=4):
+    return _volume_rise(w, w.size - 1, threshold, min_amount, min_vol_ratio, rise=False)
+
+
+def _keep_increasing(w, threshold=30):
+    L = w.size
+    step1 = round(threshold / 3)
+    step2 = round(threshold * 2 / 3)
+    r0 = L - threshold
+    m0 = w.ma(w.close, 30, r0)
+    m1 = w.ma(w.close, 30, r0 + step1)
+    m2 = w.ma(w.close, 30, r0 + step2)
+    m3 = w.ma(w.close, 30, L - 1)
+    return (w.counts >= threshold) & (m0 < m1) & (m1 < m2) & (m2 < m3) & (m3 > 1.2 * m0)
+
+
+# 海龟交易法则，以行r为截止日。
+def _turtle_at(w, r, threshold):
+    close = w.close[r - threshold + 1:r + 1]
+    max_price = np.maximum(np.max(close, axis=0), 0)
+    return (w.bars(r) >= threshold) & (w.close[r] >= max_price)
+
+
+def _turtle_trade(w, threshold=60):
+    return _turtle_at(w, w.size - 1, threshold)
+
+
+def _parking_apron(w, threshold=15):
+    L = w.size
+    c, o, p = w.close, w.open, w.p_change
+    result = np.zeros(c.shape[1], dtype=bool)
+    for r in range(L - threshold, L - 3):
+        price = c[r]
+        hit = (p[r] > 9.5) & _turtle_at(w, r, threshold)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            d1 = r + 1
+            hit &= (c[d1] > price) & (o[d1] > price) & (0.97 < c[d1] / o[d1]) & (c[d1] / o[d1] < 1.03)
+            for d in (r + 2, r + 3):
+                hit &= (0.97 < c[d] / o[d]) & (c[d] / o[d] < 1.03) & (-5 < p[d]) & (p[d] < 5) & \
+                       (c[d] > price) & (o[d] > price)
+        result |= hit
+    return result & (w.counts >= threshold)
+
+
+# 循环中 if close > 最高: ... elif close < 最低: ... 得到的最低点：不是新高的行中第一个最小值，没有时为-1。
+def _elif_lowest(close, start=1000000):
+    prev_max = np.vstack([np.zeros((1, close.shape[1])), np.maximum.accumulate(close, axis=0)[:-1]])
+    candidate = np.where((close > prev_max) | ~(close < start), np.inf, close)
+    low = np.argmin(candidate, axis=0)
+    exists = np.isfinite(candidate[low, np.arange(close.shape[1])])
+    return np.where(exists, low, -1)
+
+
+def _backtrace_ma250(w, threshold=60, min_days=10, max_days=50):
+    L = w.size
+    rows = np.arange(L - threshold, L)
+    c = w.close[rows]
+    v = w.volume[rows]
+    d = w.dates[rows]
+    ma = np.vstack([w.ma(w.close, 250, r) for r in rows])
+    cols = np.arange(c.shape[1])
+
+    hi = np.argmax(np.where(np.isnan(c), -np.inf, c), axis=0)
+    ok = c[hi, cols] > 0
+    lo = _elif_lowest(c)
+    ok &= (lo >= 0) & (v[np.maximum(lo, 0), cols] != 0) & (v[hi, cols] != 0)
+    ok &= hi > 0
+    ok &= (c[0] < ma[0]) & (c[np.maximum(hi - 1, 0), cols] > ma[np.maximum(hi - 1, 0), cols])
+
+    end = np.arange(threshold)[:, None] >= hi[None, :]
+    ok &= ~(end & (c < ma)).any(axis=0)
+    recent = np.argmin(np.where(end & (c < 1000000), c, np.inf), axis=0)
+    diff = d[recent, cols].astype(np.int64) - d[hi, cols].astype(np.int64)
+    ok &= (min_days <= diff) & (diff <= max_days)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vol_ratio = v[hi, cols] / v[recent, cols]
+        back_ratio = c[recent, cols] / c[hi, cols]
+    ok &= (vol_ratio > 2) & (back_ratio < 0.8)
+    return ok & (w.counts >= 250)
+
+
+def _breakthrough_platform(w, threshold=60):
+    L = w.size
+    rows = np.arange(L - threshold, L)
+    c = w.close[rows]
+    o = w.open[rows]
+    ma = np.vstack([w.ma(w.close, 60, r) for r in rows])
+    cols = np.arange(c.shape[1])
+
+    cand = np.vstack([_volume_rise(w, r, threshold, 200000000, 2) for r in rows])
+    cand &= (o < ma) & (ma <= c)
+    b = np.argmax(cand, axis=0)
+    ok = cand[b, cols]
+    front = (np.arange(threshold)[:, None] < b[None, :]) & (ma > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dev = (ma - c) / ma
+    ok &= ~(front & ~((-0.05 < dev) & (dev < 0.2))).any(axis=0)
+    return ok & (w.counts >= threshold)
+
+
+def _low_backtrace_increase(w, threshold=60):
+    L = w.size
+    c = w.close[L - threshold:]
+    o = w.open[L - threshold:]
+    p = w.p_change[L - threshold:]
+    prev_p = np.vstack([np.full((1, c.shape[1]), 100.0), p[:-1]])
+    prev_o = np.vstack([np.full((1, c.shape[1]), -1000000.0), o[:-1]])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ok = ~((c[-1] - c[0]) / c[0] < 0.6)
+        fail = (p < -7) | ((c - o) / o * 100 < -7) | (prev_p + p < -10) | ((c - prev_o) / prev_o * 100 < -10)
+    return ok & ~fail.any(axis=0) & (w.counts >= threshold)
+
+
+def _high_tight_flag(w, threshold=60, istop=None):
+    L = w.size
+    if istop is None:
+        return np.zeros(w.close.shape[1], dtype=bool)
+    rows = slice(L - 24, L - 10)
+    low = np.min(w.low[rows], axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ok = ~(w.high[L - 11] / low < 1.9)
+    p = w.p_change[rows] >= 9.5
+    ok &= (p[1:] & p[:-1]).any(axis=0)
+    return ok & istop & (w.counts >= threshold)
+
+
+def _low_atr(w, ma_long=250, threshold=10, min_ratio=1.1):
+    L = w.size
+    c = w.close[L - threshold:]
+    p = w.p_change[L - threshold:]
+    total = np.zeros(c.shape[1])
+    for k in range(threshold):
+        total += np.where((p[k] > 0) | (p[k] < 0), np.abs(p[k]), 0.0)
+    ok = ~(total / threshold > 10)
+    highest = np.maximum(np.max(c, axis=0), 0)
+    lo = _elif_lowest(c)
+    lowest = np.where(lo >= 0, c[np.maximum(lo, 0), np.arange(c.shape[1])], 1000000)
+    ok &= (highest - lowest) / lowest > min_ratio
+    return ok & (w.counts >= ma_long)
+
+
+# 策略检查函数对应的向量化实现。
+SCREENS = {
+    enter.check_volume: _enter,
+    keep_increasing.check: _keep_increasing,
+    parking_apron.check: _parking_apron,
+    backtrace_ma250.check: _backtrace_ma250,
+    breakthrough_platform.check: _breakthrough_platform,
+    low_backtrace_increase.check: _low_backtrace_increase,
+    turtle_trade.check_enter: _turtle_trade,
+    high_tight_flag.check_high_tight: _high_tight_flag,
+    climax_limitdown.check: _climax_limitdown,
+    low_atr.check_low_increase: _low_atr,
+}
+
+
+# 截止date对全部股票执行各策略，返回bool DataFrame，行为策略表名，列为股票代码。
+# strategies默认为 TABLE_CN_STOCK_STRATEGIES；tops为龙虎榜机构买入的股票代码集合，供高而窄的旗形使用。
+def screen(panel, date, strategies=None, tops=None):
+    if strategies is None:
+        import instock.core.tablestructure as tbs
+        strategies = tbs.TABLE_CN_STOCK_STRATEGIES
+    w = _window(panel, date)
+    names = []
+    values = []
+    for strategy in strategies:
+        fun = SCREENS.get(strategy['func'])
+        try:
+            if fun is None:
+                raise ValueError(f"{strategy['func'].__name__}没有向量化实现")
+            if fun is _high_tight_flag:
+                istop = None if tops is None else np.array([c in tops for c in panel.codes], dtype=bool)
+                result = fun(w, istop=istop)
+            else:
+                result = fun(w)
+        except Exception as e:
+            logging.error(f"screen.screen处理异常：{strategy['name']}策略{e}")
+            result = np.zeros(len(panel.codes), dtype=bool)
+        names.append(strategy['name'])
+        values.append(result)
+    return pd.DataFrame(np.array(values, dtype=bool).reshape(len(names), len(panel.codes)),
+                        index=names, columns=panel.codes)
+
+
+# 与逐只股票调用策略检查函数的结果比较，返回不一致的 (策略表名, 代码, 向量化结果, 检查函数结果)。
+def parity(panel, date, strategies=None, tops=None, mode=exe.MODE_THREAD, workers=None):
+    if strategies is None:
+        import instock.core.tablestructure as tbs
+        strategies = tbs.TABLE_CN_STOCK_STRATEGIES
+    result = screen(panel, date, strategies, tops)
+    rows = []
+    for strategy in strategies:
+        fun = strategy['func']
+        task_kwargs = None
+        if fun is high_tight_flag.check_high_tight:
+            task_kwargs = {k: {'istop': tops is not None and k[1] in tops} for k in panel.keys()}
+        checks = exe.map_stocks(fun, panel, panel.keys(), date=date, task_kwargs=task_kwargs, mode=mode,
+                                workers=workers, label=f"screen.parity策略{strategy['name']}")
+        for key in panel.keys():
+            expected = bool(checks.get(key, False))
+            actual = bool(result.at[strategy['name'], key[1]])
+            if expected != actual:
+                rows.append((strategy['name'], key[1], actual, expected))
+    return pd.DataFrame(rows, columns=('strategy', 'code', 'screen', 'check'))
@@ -1,6 +1,9 @@
 #!/usr/local/bin/python
 # -*- coding: utf-8 -*-
 
+import numpy as np
+import pandas as pd
+import instock.core.hist_index as hix
 
 __author__ = 'myh '
 __date__ = '2023/3/10 '
@@ -11,27 +14,31 @@ BALANCE = 200000
 # 海龟交易法则
 # 最后一个交易日收市价为指定区间内最高价
 # 1.当日收盘价>=最近60日最高收盘价
-def check_enter(code_name, data, date=None, threshold=60):
+# features为衍生数据缓存(features.feature_cache)，各行的结果只计算一次，之后逐日检查只是查表。
+def check_enter(code_name, data, date=None, threshold=60, features=None):
     if date is None:
         end_date = code_name[0]
     else:
         end_date = date.strftime("%Y-%m-%d")
+    size = len(data.index)
     if end_date is not None:
-        mask = (data['date'] <= end_date)
-        data = data.loc[mask]
-    if len(data.index) < threshold:
+        size = hix.cut(data, end_date)
+    if size < threshold:
         return False
-
-    data = data.tail(n=threshold)
-
-    max_price = 0
-    for _close in data['close'].values:
-        if _close > max_price:
-            max_price = _close
-
-    last_close = data.iloc[-1]['close']
-
-    if last_close >= max_price:
-        return True
-
-    return False
+    return bool(enter_flags(code_name, data, threshold, features)[size - 1])
+
+
+# 以每一行为截止日的海龟交易法则结果(与行对应)，data按日期升序，一次计算整个DataFrame。
+# 最近threshold日最高收盘价用滚动最大值，缺失值不参与比较。
+def enter_flags(code_name, data, threshold=60, features=None):
+    def _flags():
+        close = data['close'].values
+        max_price = pd.Series(close).rolling(threshold, min_periods=1).max().values
+        with np.errstate(invalid='ignore'):
+            flags = close >= np.fmax(max_price, 0)
+        flags[:threshold - 1] = False
+        return flags
+
+    if features is None:
+        return _flags()
+    return features.get(code_name, data, 'check_enter', (threshold,), _flags)
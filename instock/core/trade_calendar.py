@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import datetime
+import glob
+import os.path
+import numpy as np
+
+__author__ = 'myh '
+__date__ = '2023/4/10 '
+
+# 交易日历本地存储。
+# 解码后的交易日保存为有序的int32天数(1970-01-01起)数组，文件名带下载日期(trade_date_YYYYMMDD.npy)，
+# 读取时np.load(mmap_mode="r")直接映射，判断交易日和查找前后交易日用二分查找。
+# 每天最多下载一次：最新文件不是当天下载的视为过期，由调用方在后台下载后写入新文件，进程启动不依赖网络和js解码。
+# 新文件先写临时文件再改名，旧文件删除失败(其它进程正在映射)时保留到下次写入再删。
+cpath_current = os.path.dirname(os.path.dirname(__file__))
+trade_calendar_path = os.path.join(cpath_current, "cache", "calendar")
+_PREFIX = "trade_date_"
+
+
+def _files():
+    return sorted(glob.glob(os.path.join(trade_calendar_path, f"{_PREFIX}[0-9]*.npy")))
+
+
+def _stamp(file):
+    return os.path.basename(file)[len(_PREFIX):-len(".npy")]
+
+
+# 最新的交易日历(int32天数有序数组，只读映射)，没有本地文件返回None。
+def load():
+    files = _files()
+    if not files:
+        return None
+    return np.load(files[-1], mmap_mode="r")
+
+
+# 最新的交易日历不是当天下载的。
+def is_stale():
+    files = _files()
+    return not files or _stamp(files[-1]) < datetime.date.today().strftime("%Y%m%d")
+
+
+# 保存交易日历，dates为datetime.date集合，返回保存后映射的数组。
+def save(dates):
+    if not os.path.exists(trade_calendar_path):
+        os.makedirs(trade_calendar_path)
+    nums = np.unique(np.asarray(list(dates), dtype='datetime64[D]').astype(np.int32))
+    file = os.path.join(trade_calendar_path, f"{_PREFIX}{datetime.date.today().strftime('%Y%m%d')}.npy")
+    tmp_file = f"{file}.{os.getpid()}.tmp"
+    with open(tmp_file, "wb") as f:
+        np.save(f, nums)
+    os.replace(tmp_file, file)
+    for old in _files():
+        if old != file:
+            try:
+                os.remove(old)
+            except OSError:
+                pass  # 其它进程正在映射，下次写入再删。
+    return np.load(file, mmap_mode="r")
+
+
+# 日期(datetime.date或datetime.datetime)转换为int32天数。
+def date_num(date):
+    return int(np.datetime64(date, 'D').astype(np.int64))
@@ -3,7 +3,6 @@
 
 
 import logging
-import concurrent.futures
 import pandas as pd
 import os.path
 import sys
@@ -16,82 +15,72 @@ import instock.core.tablestructure as tbs
 import instock.lib.database as mdb
 import instock.core.backtest.rate_stats as rate
 from instock.core.singleton_stock import stock_hist_data
+from instock.core.hist_panel import stock_hist_panel
 
 __author__ = 'myh '
 __date__ = '2023/3/10 '
 
 
 # 股票策略回归测试。
+# 买卖指标表和全部策略表中待回测的信号一次读出，在历史数据面板上一次算出全部N日收益率，再按表分别写回。
 def prepare():
     tables = [tbs.TABLE_CN_STOCK_INDICATORS_BUY, tbs.TABLE_CN_STOCK_INDICATORS_SELL]
     tables.extend(tbs.TABLE_CN_STOCK_STRATEGIES)
-    backtest_columns = list(tbs.TABLE_CN_STOCK_BACKTEST_DATA['columns'])
-    backtest_columns.insert(0, 'code')
-    backtest_columns.insert(0, 'date')
-    backtest_column = backtest_columns
-
-    stocks_data = stock_hist_data().get_data()
-    if stocks_data is None:
-        return
-    for k in stocks_data:
-        date = k[0]
-        break
-    # 回归测试表
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        for table in tables:
-            executor.submit(process, table, stocks_data, date, backtest_column)
-
-
-def process(table, data_all, date, backtest_column):
-    table_name = table['name']
-    if not mdb.checkTableIsExist(table_name):
-        return
-
-    column_tail = tuple(table['columns'])[-1]
-    now_date = datetime.datetime.now().date()
-    sql = f"SELECT * FROM `{table_name}` WHERE `date` < '{now_date}' AND `{column_tail}` is NULL"
     try:
-        data = pd.read_sql(sql=sql, con=mdb.engine())
-        if data is None or len(data.index) == 0:
+        stocks_data = stock_hist_data().get_data()
+        if stocks_data is None:
             return
+        if not isinstance(stocks_data, stock_hist_panel):
+            stocks_data = stock_hist_panel.from_frames(stocks_data)
 
-        subset = data[list(tbs.TABLE_CN_STOCK_FOREIGN_KEY['columns'])]
-        # subset['date'] = subset['date'].values.astype('str')
-        subset = subset.astype({'date': 'string'})
-        stocks = [tuple(x) for x in subset.values]
-
-        results = run_check(stocks, data_all, date, backtest_column)
-        if results is None:
+        signals = load_signals(tables)
+        if signals is None:
+            return
+        data = run_check(signals, stocks_data)
+        if data is None:
             return
 
-        data_new = pd.DataFrame(results.values())
-        mdb.update_db_from_df(data_new, table_name, ('date', 'code'))
-
+        # 回归测试表
+        for table_name, data_new in data.groupby('table', sort=False):
+            mdb.update_db_from_df(data_new.drop(columns='table'), table_name, ('date', 'code'))
     except Exception as e:
-        logging.error(f"backtest_data_daily_job.process处理异常：{table}表{e}")
+        logging.error(f"backtest_data_daily_job.prepare处理异常：{e}")
 
 
-def run_check(stocks, data_all, date, backtest_column, workers=40):
-    data = {}
-    try:
-        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
-            future_to_data = {executor.submit(rate.get_rates, stock,
-                                              data_all.get((date, stock[1], stock[2])), backtest_column,
-                                              len(backtest_column) - 1): stock for stock in stocks}
-            for future in concurrent.futures.as_completed(future_to_data):
-                stock = future_to_data[future]
-                try:
-                    _data_ = future.result()
-                    if _data_ is not None:
-                        data[stock] = _data_
-                except Exception as e:
-                    logging.error(f"backtest_data_daily_job.run_check处理异常：{stock[1]}代码{e}")
-    except Exception as e:
-        logging.error(f"backtest_data_daily_job.run_check处理异常：{e}")
-    if not data:
+# 读出各表待回测的信号，返回DataFrame，列为 table,date,code，date为YYYY-MM-DD。
+def load_signals(tables):
+    now_date = datetime.datetime.now().date()
+    signals = []
+    for table in tables:
+        table_name = table['name']
+        try:
+            if not mdb.checkTableIsExist(table_name):
+                continue
+            column_tail = tuple(table['columns'])[-1]
+            sql = f"SELECT `date`,`code` FROM `{table_name}` WHERE `date` < %s AND `{column_tail}` is NULL"
+            data = pd.read_sql(sql=sql, con=mdb.engine(), params=(now_date,))
+            if data is None or len(data.index) == 0:
+                continue
+            data['date'] = data['date'].astype(str)
+            data.insert(0, 'table', table_name)
+            signals.append(data)
+        except Exception as e:
+            logging.error(f"backtest_data_daily_job.load_signals处理异常：{table_name}表{e}")
+    if not signals:
+        return None
+    return pd.concat(signals, ignore_index=True)
+
+
+# 返回DataFrame，列为 table,date,code 加 TABLE_CN_STOCK_BACKTEST_DATA 的列，只含能计算收益率的信号。
+def run_check(signals, data_all):
+    result = rate.get_rates_panel(data_all, signals['code'].values, signals['date'].values)
+    if result is None:
+        return None
+    rates, valid = result
+    if not valid.any():
         return None
-    else:
-        return data
+    data = pd.DataFrame(rates[valid], columns=list(tbs.TABLE_CN_STOCK_BACKTEST_DATA['columns']))
+    return pd.concat([signals.loc[valid].reset_index(drop=True), data], axis=1)
 
 
 def main():
@@ -9,6 +9,7 @@ cpath_current = os.path.dirname(os.path.dirname(__file__))
 cpath = os.path.abspath(os.path.join(cpath_current, os.pardir))
 sys.path.append(cpath)
 from instock.core.db import DatabaseSession, StockBlockTrade
+from instock.core.db import bulk
 import instock.lib.run_template as runt
 import instock.core.stockfetch as stf
 
@@ -25,17 +26,8 @@ def save_after_close_stock_blocktrade_data(date):
 
         # 使用上下文管理器处理数据库会话
         with DatabaseSession() as db:
-            # 删除当天数据
-            db.query(StockBlockTrade).filter(StockBlockTrade.date == date).delete()
-
-            # 将DataFrame转换为模型对象列表
-            blocktrade_objects = []
-            for _, row in data.iterrows():
-                blocktrade = StockBlockTrade(**row)
-                blocktrade_objects.append(blocktrade)
-
-            # 批量插入数据
-            db.bulk_save_objects(blocktrade_objects)
+            # 按主键upsert当天数据，只写入有变化的行，删除已不存在的行
+            bulk.upsert_df(db, StockBlockTrade, data, StockBlockTrade.date == date)
             db.commit()
     except Exception as e:
         # 打印错误堆栈
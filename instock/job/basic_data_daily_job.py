@@ -5,8 +5,6 @@ import logging
 import os.path
 import sys
 
-import pandas as pd
-
 cpath_current = os.path.dirname(os.path.dirname(__file__))
 cpath = os.path.abspath(os.path.join(cpath_current, os.pardir))
 sys.path.append(cpath)
@@ -14,6 +12,7 @@ import instock.lib.run_template as runt
 import instock.core.stockfetch as stf
 from instock.core.singleton_stock import stock_data
 from instock.core.db import DatabaseSession, StockSpot, StockETFSpot
+from instock.core.db import bulk
 
 __author__ = "myh "
 __date__ = "2023/3/10 "
@@ -31,19 +30,8 @@ def save_nph_stock_spot_data(date, before=True):
 
         # 使用上下文管理器处理数据库会话
         with DatabaseSession() as db:
-            # 删除当天数据
-            db.query(StockSpot).filter(StockSpot.date == date).delete()
-
-            # 将DataFrame转换为模型对象列表
-            stock_objects = []
-            for _, row in data.iterrows():
-                # 将row中nan值替换为None
-                row = {k: v if not pd.isna(v) else None for k, v in row.items()}
-                stock = StockSpot(**row)
-                stock_objects.append(stock)
-
-            # 批量插入数据
-            db.bulk_save_objects(stock_objects)
+            # 按主键upsert当天数据，只写入有变化的行，删除已不存在的行
+            bulk.upsert_df(db, StockSpot, data, StockSpot.date == date)
             db.commit()
 
     except Exception as e:
@@ -62,19 +50,8 @@ def save_nph_etf_spot_data(date, before=True):
 
         # 使用上下文管理器处理数据库会话
         with DatabaseSession() as db:
-            # 删除当天数据
-            db.query(StockETFSpot).filter(StockETFSpot.date == date).delete()
-
-            # 构建ETF对象列表
-            etf_objects = []
-            for _, row in data.iterrows():
-                # 将row中nan值替换为None
-                row = {k: v if not pd.isna(v) else None for k, v in row.items()}
-                etf = StockETFSpot(**row)
-                etf_objects.append(etf)
-
-            # 批量插入数据
-            db.bulk_save_objects(etf_objects)
+            # 按主键upsert当天数据，只写入有变化的行，删除已不存在的行
+            bulk.upsert_df(db, StockETFSpot, data, StockETFSpot.date == date)
             db.commit()
     except Exception as e:
         logging.error(f"basic_data_daily_job.save_nph_etf_spot_data处理异常：{e}")
@@ -6,7 +6,6 @@ import concurrent.futures
 import os.path
 import sys
 import pandas as pd
-import numpy as np
 
 cpath_current = os.path.dirname(os.path.dirname(__file__))
 cpath = os.path.abspath(os.path.join(cpath_current, os.pardir))
@@ -21,6 +20,7 @@ from instock.core.db import (
     StockSpotBuy,
     StockTop,
 )
+from instock.core.db import bulk
 import instock.lib.run_template as runt
 import instock.core.stockfetch as stf
 
@@ -40,17 +40,8 @@ def save_nph_stock_top_data(date, before=True):
 
         # 使用上下文管理器处理数据库会话
         with DatabaseSession() as db:
-            # 删除当天数据
-            db.query(StockTop).filter(StockTop.date == date).delete()
-
-            # 将DataFrame转换为模型对象列表
-            stock_objects = []
-            for _, row in data.iterrows():
-                stock = StockTop(**row)
-                stock_objects.append(stock)
-
-            # 批量插入数据
-            db.bulk_save_objects(stock_objects)
+            # 按主键upsert当天数据，只写入有变化的行，删除已不存在的行
+            bulk.upsert_df(db, StockTop, data, StockTop.date == date)
             db.commit()
     except Exception as e:
         logging.error(f"basic_data_other_daily_job.save_stock_top_data处理异常：{e}")
@@ -80,24 +71,12 @@ def save_nph_stock_fund_flow_data(date, before=True):
         if data is None or len(data.index) == 0:
             return
 
-        # 将NaN替换为None
-        data = data.replace({np.nan: None})
-
         data.insert(0, "date", date.strftime("%Y-%m-%d"))
 
         # 使用上下文管理器处理数据库会话
         with DatabaseSession() as db:
-            # 删除当天的老数据
-            db.query(StockFundFlow).filter(StockFundFlow.date == date).delete()
-
-            # 将DataFrame转换为模型对象列表
-            fund_flow_objects = []
-            for _, row in data.iterrows():
-                fund_flow = StockFundFlow(**row)
-                fund_flow_objects.append(fund_flow)
-
-            # 批量插入数据
-            db.bulk_save_objects(fund_flow_objects)
+            # 按主键upsert当天数据，只写入有变化的行，删除已不存在的行
+            bulk.upsert_df(db, StockFundFlow, data, StockFundFlow.date == date)
             db.commit()
     except Exception as e:
         logging.error(
@@ -165,9 +144,6 @@ def stock_sector_fund_flow_data(date, index_sector):
         if data is None or len(data.index) == 0:
             return
 
-        # 将NaN替换为None
-        data = data.replace({np.nan: None})
-
         data.insert(0, "date", date.strftime("%Y-%m-%d"))
 
         # 使用上下文管理器处理数据库会话
@@ -178,16 +154,8 @@ def stock_sector_fund_flow_data(date, index_sector):
             else:
                 model_class = StockFundFlowConcept
 
-            # 删除当天的老数据
-            db.query(model_class).filter(model_class.date == date).delete()
-
-            # 将DataFrame转换为模型对象列表并批量插入
-            records = []
-            for _, row in data.iterrows():
-                record = model_class(**row)
-                records.append(record)
-
-            db.bulk_save_objects(records)
+            # 按主键upsert当天数据，只写入有变化的行，删除已不存在的行
+            bulk.upsert_df(db, model_class, data, model_class.date == date)
             db.commit()
     except Exception as e:
         logging.error(
@@ -233,22 +201,10 @@ def save_nph_stock_bonus(date, before=True):
         if data is None or len(data.index) == 0:
             return
 
-        # 将NaN替换为None
-        data = data.replace({np.nan: None})
-
         # 使用上下文管理器处理数据库会话
         with DatabaseSession() as db:
-            # 删除当天的老数据
-            db.query(StockBonus).filter(StockBonus.date == date).delete()
-
-            # 将DataFrame转换为模型对象列表
-            bonus_objects = []
-            for _, row in data.iterrows():
-                bonus = StockBonus(**row)
-                bonus_objects.append(bonus)
-
-            # 批量插入数据
-            db.bulk_save_objects(bonus_objects)
+            # 按主键upsert当天数据，只写入有变化的行，删除已不存在的行
+            bulk.upsert_df(db, StockBonus, data, StockBonus.date == date)
             db.commit()
     except Exception as e:
         logging.error(f"basic_data_other_daily_job.save_nph_stock_bonus处理异常：{e}")
@@ -274,17 +230,8 @@ def stock_spot_buy(date):
             if len(data.index) == 0:
                 return
 
-            # 删除当天数据
-            db.query(StockSpotBuy).filter(StockSpotBuy.date == date).delete()
-
-            # 将DataFrame转换为模型对象列表
-            spot_buy_objects = []
-            for _, row in data.iterrows():
-                spot_buy = StockSpotBuy(**row)
-                spot_buy_objects.append(spot_buy)
-
-            # 批量插入数据
-            db.bulk_save_objects(spot_buy_objects)
+            # 按主键upsert当天数据，只写入有变化的行，删除已不存在的行
+            bulk.upsert_df(db, StockSpotBuy, data, StockSpotBuy.date == date)
             db.commit()
     except Exception as e:
         logging.error(f"basic_data_other_daily_job.stock_spot_buy处理异常：{e}")
@@ -3,7 +3,6 @@
 
 
 import logging
-import concurrent.futures
 import pandas as pd
 import os.path
 import sys
@@ -14,8 +13,13 @@ sys.path.append(cpath)
 import instock.lib.run_template as runt
 import instock.core.tablestructure as tbs
 import instock.lib.database as mdb
+import instock.lib.trade_time as trd
+import instock.lib.executor as exe
 import instock.core.indicator.calculate_indicator as idr
+import instock.core.indicator.calculate_indicator_panel as pidr
+import instock.core.indicator.indicator_state as ist
 from instock.core.singleton_stock import stock_hist_data
+from instock.core.hist_panel import stock_hist_panel
 
 __author__ = 'myh '
 __date__ = '2023/3/10 '
@@ -26,61 +30,87 @@ def prepare(date):
         stocks_data = stock_hist_data(date=date).get_data()
         if stocks_data is None:
             return
-        results = run_check(stocks_data, date=date)
-        if results is None:
+        data = run_check(stocks_data, date=date)
+        if data is None:
             return
 
         table_name = tbs.TABLE_CN_STOCK_INDICATORS['name']
-        # 删除老数据。
+        # 按主键upsert，只写入有变化的行，删除当天已不存在的行。
         if mdb.checkTableIsExist(table_name):
-            del_sql = f"DELETE FROM `{table_name}` where `date` = '{date}'"
-            mdb.executeSql(del_sql)
             cols_type = None
         else:
             cols_type = tbs.get_field_types(tbs.TABLE_CN_STOCK_INDICATORS['columns'])
 
-        dataKey = pd.DataFrame(results.keys())
-        _columns = tuple(tbs.TABLE_CN_STOCK_FOREIGN_KEY['columns'])
-        dataKey.columns = _columns
-
-        dataVal = pd.DataFrame(results.values())
-        dataVal.drop('date', axis=1, inplace=True)  # 删除日期字段，然后和原始数据合并。
-
-        data = pd.merge(dataKey, dataVal, on=['code'], how='left')
         # data.set_index('code', inplace=True)
         # 单例，时间段循环必须改时间
         date_str = date.strftime("%Y-%m-%d")
         if date.strftime("%Y-%m-%d") != data.iloc[0]['date']:
             data['date'] = date_str
-        mdb.insert_db_from_df(data, table_name, cols_type, False, "`date`,`code`")
+        mdb.upsert_db_from_df(data, table_name, cols_type, False, "`date`,`code`",
+                              where="`date` = %s", params=(date_str,))
 
     except Exception as e:
         logging.error(f"indicators_data_daily_job.prepare处理异常：{e}")
 
 
-def run_check(stocks, date=None, workers=40):
-    data = {}
+# 区间作业，全部交易日的指标一次计算，按股票分批写入。
+def prepare_range(dates):
+    try:
+        stocks_data = stock_hist_data(date=dates[0]).get_data()
+        if stocks_data is None:
+            return
+        if not isinstance(stocks_data, stock_hist_panel):
+            stocks_data = stock_hist_panel.from_frames(stocks_data)
+
+        table_name = tbs.TABLE_CN_STOCK_INDICATORS['name']
+        # 按主键upsert，只写入有变化的行，删除区间内已不存在的行。
+        if mdb.checkTableIsExist(table_name):
+            cols_type = None
+        else:
+            cols_type = tbs.get_field_types(tbs.TABLE_CN_STOCK_INDICATORS['columns'])
+
+        for data in pidr.get_indicator_range(stocks_data, dates):
+            if len(data.index) == 0:
+                continue
+            # 每批只比较本批股票的已有数据。
+            codes = data['code'].unique().tolist()
+            mdb.upsert_db_from_df(data, table_name, cols_type, False, "`date`,`code`",
+                                  where=f"`date` >= %s and `date` <= %s and `code` in ({','.join(['%s'] * len(codes))})",
+                                  params=(dates[0], dates[-1], *codes))
+            cols_type = None
+    except Exception as e:
+        logging.error(f"indicators_data_daily_job.prepare_range处理异常：{e}")
+
+
+# 返回DataFrame，列为 date,code,name 加 STOCK_STATS_DATA 的列。
+# 面板数据按保存的指标状态每只股票只推进一根K线，否则逐只股票计算，执行方式见 executor.job_mode。
+# 盘中K线未完成，只计算不保存状态。
+def run_check(stocks, date=None, workers=None, mode=None):
+    if isinstance(stocks, stock_hist_panel):
+        save = date is None or trd.get_trade_hist_interval(date.strftime("%Y-%m-%d"))[1]
+        data = ist.get_indicator(stocks, date=date, save=save)
+        if data is None or len(data.index) == 0:
+            return None
+        return data
+
     columns = list(tbs.STOCK_STATS_DATA['columns'])
     columns.insert(0, 'code')
     columns.insert(0, 'date')
     data_column = columns
-    try:
-        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
-            future_to_data = {executor.submit(idr.get_indicator, k, stocks[k], data_column, date=date): k for k in stocks}
-            for future in concurrent.futures.as_completed(future_to_data):
-                stock = future_to_data[future]
-                try:
-                    _data_ = future.result()
-                    if _data_ is not None:
-                        data[stock] = _data_
-                except Exception as e:
-                    logging.error(f"indicators_data_daily_job.run_check处理异常：{stock[1]}代码{e}")
-    except Exception as e:
-        logging.error(f"indicators_data_daily_job.run_check处理异常：{e}")
+    data = exe.map_stocks(idr.get_indicator, stocks, stocks.keys(), data_column, date=date,
+                          mode=exe.job_mode("indicators", mode), workers=workers,
+                          label="indicators_data_daily_job.run_check")
     if not data:
         return None
-    else:
-        return data
+
+    dataKey = pd.DataFrame(data.keys())
+    _columns = tuple(tbs.TABLE_CN_STOCK_FOREIGN_KEY['columns'])
+    dataKey.columns = _columns
+
+    dataVal = pd.DataFrame(data.values())
+    dataVal.drop('date', axis=1, inplace=True)  # 删除日期字段，然后和原始数据合并。
+
+    return pd.merge(dataKey, dataVal, on=['code'], how='left')
 
 
 # 对每日指标数据，进行筛选。将符合条件的。二次筛选出来。
@@ -104,17 +134,16 @@ def guess_buy(date):
             return
 
         table_name = tbs.TABLE_CN_STOCK_INDICATORS_BUY['name']
-        # 删除老数据。
+        # 按主键upsert，只写入有变化的行，删除当天已不存在的行。
         if mdb.checkTableIsExist(table_name):
-            del_sql = f"DELETE FROM `{table_name}` where `date` = '{date}'"
-            mdb.executeSql(del_sql)
             cols_type = None
         else:
             cols_type = tbs.get_field_types(tbs.TABLE_CN_STOCK_INDICATORS_BUY['columns'])
-
-        _columns_backtest = tuple(tbs.TABLE_CN_STOCK_BACKTEST_DATA['columns'])
-        data = pd.concat([data, pd.DataFrame(columns=_columns_backtest)])
-        mdb.insert_db_from_df(data, table_name, cols_type, False, "`date`,`code`")
+            # 建表时带上回测列，已有的表不写回测列，保留已计算的回测结果。
+            _columns_backtest = tuple(tbs.TABLE_CN_STOCK_BACKTEST_DATA['columns'])
+            data = pd.concat([data, pd.DataFrame(columns=_columns_backtest)])
+        mdb.upsert_db_from_df(data, table_name, cols_type, False, "`date`,`code`",
+                              where="`date` = %s", params=(date,))
     except Exception as e:
         logging.error(f"indicators_data_daily_job.guess_buy处理异常：{e}")
 
@@ -138,24 +167,23 @@ def guess_sell(date):
             return
 
         table_name = tbs.TABLE_CN_STOCK_INDICATORS_SELL['name']
-        # 删除老数据。
+        # 按主键upsert，只写入有变化的行，删除当天已不存在的行。
         if mdb.checkTableIsExist(table_name):
-            del_sql = f"DELETE FROM `{table_name}` where `date` = '{date}'"
-            mdb.executeSql(del_sql)
             cols_type = None
         else:
             cols_type = tbs.get_field_types(tbs.TABLE_CN_STOCK_INDICATORS_SELL['columns'])
-
-        _columns_backtest = tuple(tbs.TABLE_CN_STOCK_BACKTEST_DATA['columns'])
-        data = pd.concat([data, pd.DataFrame(columns=_columns_backtest)])
-        mdb.insert_db_from_df(data, table_name, cols_type, False, "`date`,`code`")
+            # 建表时带上回测列，已有的表不写回测列，保留已计算的回测结果。
+            _columns_backtest = tuple(tbs.TABLE_CN_STOCK_BACKTEST_DATA['columns'])
+            data = pd.concat([data, pd.DataFrame(columns=_columns_backtest)])
+        mdb.upsert_db_from_df(data, table_name, cols_type, False, "`date`,`code`",
+                              where="`date` = %s", params=(date,))
     except Exception as e:
         logging.error(f"indicators_data_daily_job.guess_sell处理异常：{e}")
 
 
 def main():
     # 使用方法传递。
-    runt.run_with_args(prepare)
+    runt.run_with_args(prepare, range_fun=prepare_range)
     # 二次筛选数据。直接计算买卖股票数据。
     runt.run_with_args(guess_buy)
     runt.run_with_args(guess_sell)
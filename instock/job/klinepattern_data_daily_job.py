@@ -3,7 +3,6 @@
 
 
 import logging
-import concurrent.futures
 import pandas as pd
 import os.path
 import sys
@@ -14,8 +13,11 @@ sys.path.append(cpath)
 import instock.lib.run_template as runt
 import instock.core.tablestructure as tbs
 import instock.lib.database as mdb
+import instock.lib.executor as exe
 from instock.core.singleton_stock import stock_hist_data
 import instock.core.pattern.pattern_recognitions as kpr
+import instock.core.pattern.pattern_recognitions_panel as pkpr
+from instock.core.hist_panel import stock_hist_panel
 
 __author__ = 'myh '
 __date__ = '2023/3/10 '
@@ -26,62 +28,83 @@ def prepare(date):
         stocks_data = stock_hist_data(date=date).get_data()
         if stocks_data is None:
             return
-        results = run_check(stocks_data, date=date)
-        if results is None:
+        data = run_check(stocks_data, date=date)
+        if data is None:
             return
 
         table_name = tbs.TABLE_CN_STOCK_KLINE_PATTERN['name']
-        # 删除老数据。
+        # 按主键upsert，只写入有变化的行，删除当天已不存在的行。
         if mdb.checkTableIsExist(table_name):
-            del_sql = f"DELETE FROM `{table_name}` where `date` = '{date}'"
-            mdb.executeSql(del_sql)
             cols_type = None
         else:
             cols_type = tbs.get_field_types(tbs.TABLE_CN_STOCK_KLINE_PATTERN['columns'])
 
-        dataKey = pd.DataFrame(results.keys())
-        _columns = tuple(tbs.TABLE_CN_STOCK_FOREIGN_KEY['columns'])
-        dataKey.columns = _columns
-
-        dataVal = pd.DataFrame(results.values())
-
-        data = pd.merge(dataKey, dataVal, on=['code'], how='left')
         # 单例，时间段循环必须改时间
         date_str = date.strftime("%Y-%m-%d")
         if date.strftime("%Y-%m-%d") != data.iloc[0]['date']:
             data['date'] = date_str
-        mdb.insert_db_from_df(data, table_name, cols_type, False, "`date`,`code`")
+        mdb.upsert_db_from_df(data, table_name, cols_type, False, "`date`,`code`",
+                              where="`date` = %s", params=(date_str,))
 
     except Exception as e:
         logging.error(f"klinepattern_data_daily_job.prepare处理异常：{e}")
 
 
-def run_check(stocks, date=None, workers=40):
-    data = {}
-    columns = tbs.STOCK_KLINE_PATTERN_DATA['columns']
-    data_column = columns
+# 区间作业，每只股票的全部交易日形态一次计算，一次写入。
+def prepare_range(dates):
     try:
-        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
-            future_to_data = {executor.submit(kpr.get_pattern_recognition, k, stocks[k], data_column, date=date): k for k in stocks}
-            for future in concurrent.futures.as_completed(future_to_data):
-                stock = future_to_data[future]
-                try:
-                    _data_ = future.result()
-                    if _data_ is not None:
-                        data[stock] = _data_
-                except Exception as e:
-                    logging.error(f"klinepattern_data_daily_job.run_check处理异常：{stock[1]}代码{e}")
+        stocks_data = stock_hist_data(date=dates[0]).get_data()
+        if stocks_data is None:
+            return
+        results = exe.map_stocks(kpr.get_pattern_recognition_range, stocks_data, stocks_data.keys(),
+                                 tbs.STOCK_KLINE_PATTERN_DATA['columns'], dates=dates,
+                                 mode=exe.job_mode("klinepattern"),
+                                 label="klinepattern_data_daily_job.prepare_range")
+        if not results:
+            return
+
+        table_name = tbs.TABLE_CN_STOCK_KLINE_PATTERN['name']
+        # 按主键upsert，只写入有变化的行，删除区间内已不存在的行。
+        if mdb.checkTableIsExist(table_name):
+            cols_type = None
+        else:
+            cols_type = tbs.get_field_types(tbs.TABLE_CN_STOCK_KLINE_PATTERN['columns'])
+
+        for stock, data in results.items():
+            data.insert(2, 'name', stock[2])
+        data = pd.concat(results.values(), ignore_index=True)
+        mdb.upsert_db_from_df(data, table_name, cols_type, False, "`date`,`code`",
+                              where="`date` >= %s and `date` <= %s", params=(dates[0], dates[-1]))
     except Exception as e:
-        logging.error(f"klinepattern_data_daily_job.run_check处理异常：{e}")
+        logging.error(f"klinepattern_data_daily_job.prepare_range处理异常：{e}")
+
+
+# 返回DataFrame，列为 date,code,name 加形态列，只包含有形态的股票。
+# 面板数据全市场一次计算，否则逐只股票计算，执行方式见 executor.job_mode。
+def run_check(stocks, date=None, workers=None, mode=None):
+    columns = tbs.STOCK_KLINE_PATTERN_DATA['columns']
+    if isinstance(stocks, stock_hist_panel):
+        return pkpr.get_pattern_recognition(stocks, columns, date=date)
+
+    data_column = columns
+    data = exe.map_stocks(kpr.get_pattern_recognition, stocks, stocks.keys(), data_column, date=date,
+                          mode=exe.job_mode("klinepattern", mode), workers=workers,
+                          label="klinepattern_data_daily_job.run_check")
     if not data:
         return None
-    else:
-        return data
+
+    dataKey = pd.DataFrame(data.keys())
+    _columns = tuple(tbs.TABLE_CN_STOCK_FOREIGN_KEY['columns'])
+    dataKey.columns = _columns
+
+    dataVal = pd.DataFrame(data.values())
+
+    return pd.merge(dataKey, dataVal, on=['code'], how='left')
 
 
 def main():
     # 使用方法传递。
-    runt.run_with_args(prepare)
+    runt.run_with_args(prepare, range_fun=prepare_range)
 
 
 # main函数入口
@@ -3,7 +3,6 @@
 
 
 import logging
-import numpy as np
 import os.path
 import sys
 
@@ -26,24 +25,13 @@ def save_nph_stock_selection_data(date, before=True):
         if data is None:
             return
 
-        # 将NaN替换为None
-        data = data.replace({np.nan: None})
+        from instock.core.db import DatabaseSession, StockSelection, bulk
 
-        from instock.core.db import DatabaseSession, StockSelection
-
-        # 删除老数据
-        logging.info("######## 删除老数据：StockSelection #######")
+        # 按主键upsert当天数据，只写入有变化的行，删除已不存在的行
+        logging.info("######## 写入数据：StockSelection #######")
         _date = data.iloc[0]["date"]
         with DatabaseSession() as db:
-            db.query(StockSelection).filter(StockSelection.date == _date).delete()
-
-            # 插入新数据
-            records = []
-            for _, row in data.iterrows():
-                record = StockSelection(**row.to_dict())
-                records.append(record)
-
-            db.bulk_save_objects(records)
+            bulk.upsert_df(db, StockSelection, data, StockSelection.date == _date)
             db.commit()
     except Exception as e:
         logging.error(
@@ -2,7 +2,6 @@
 # -*- coding: utf-8 -*-
 
 import logging
-import concurrent.futures
 import pandas as pd
 import os.path
 import sys
@@ -13,28 +12,54 @@ sys.path.append(cpath)
 import instock.lib.run_template as runt
 import instock.core.tablestructure as tbs
 import instock.lib.database as mdb
+import instock.lib.executor as exe
+import instock.core.strategy.screen as scr
+import instock.core.strategy.features as fts
 from instock.core.singleton_stock import stock_hist_data
+from instock.core.hist_panel import stock_hist_panel
 from instock.core.stockfetch import fetch_stock_top_entity_data
 
 __author__ = "myh "
 __date__ = "2023/3/10 "
 
 
-def prepare(date, strategy):
+# 全部策略一次选股：面板数据用向量化选股一次得到全部策略的结果，否则逐只股票检查全部策略，均线等衍生数据各策略共用。
+def prepare_all(date):
     try:
         stocks_data = stock_hist_data(date=date).get_data()
         if stocks_data is None:
             return
-        table_name = strategy["name"]
-        strategy_func = strategy["func"]
-        results = run_check(strategy_func, table_name, stocks_data, date)
-        if results is None:
-            return
+        strategies = tbs.TABLE_CN_STOCK_STRATEGIES
+        if isinstance(stocks_data, stock_hist_panel):
+            data = screen_check(strategies, stocks_data, [date])
+        else:
+            data = run_check_all(strategies, stocks_data, [date])
+        for strategy, results in zip(strategies, data):
+            if results:
+                save(date, strategy, results)
+    except Exception as e:
+        logging.error(f"strategy_data_daily_job.prepare_all处理异常：{e}")
+
+
+# 面板数据逐日向量化选股，返回与strategies对应的 (date, code, name) 列表。
+def screen_check(strategies, panel, dates):
+    data = [[] for _ in strategies]
+    keys = panel.keys()
+    for date in dates:
+        date_str = date.strftime("%Y-%m-%d")
+        result = scr.screen(panel, date, strategies, tops=fetch_stock_top_entity_data(date))
+        for i, strategy in enumerate(strategies):
+            hits = result.loc[strategy["name"]].values
+            data[i].extend((date_str, k[1], k[2]) for k, hit in zip(keys, hits) if hit)
+    return data
+
 
-        # 删除老数据。
+# 写入策略选出的 (date, code, name) 列表。
+def save(date, strategy, results):
+    try:
+        table_name = strategy["name"]
+        # 按主键upsert，只写入有变化的行，删除当天已不存在的行。
         if mdb.checkTableIsExist(table_name):
-            del_sql = f"DELETE FROM `{table_name}` where `date` = '{date}'"
-            mdb.executeSql(del_sql)
             cols_type = None
         else:
             cols_type = tbs.get_field_types(tbs.TABLE_CN_STOCK_STRATEGIES[0]["columns"])
@@ -42,65 +67,123 @@ def prepare(date, strategy):
         data = pd.DataFrame(results)
         columns = tuple(tbs.TABLE_CN_STOCK_FOREIGN_KEY["columns"])
         data.columns = columns
-        _columns_backtest = tuple(tbs.TABLE_CN_STOCK_BACKTEST_DATA["columns"])
-        data = pd.concat([data, pd.DataFrame(columns=_columns_backtest)])
+        # 建表时带上回测列，已有的表不写回测列，保留已计算的回测结果。
+        if cols_type is not None:
+            _columns_backtest = tuple(tbs.TABLE_CN_STOCK_BACKTEST_DATA["columns"])
+            data = pd.concat([data, pd.DataFrame(columns=_columns_backtest)])
         # 单例，时间段循环必须改时间
         date_str = date.strftime("%Y-%m-%d")
         if date.strftime("%Y-%m-%d") != data.iloc[0]["date"]:
             data["date"] = date_str
-        mdb.insert_db_from_df(data, table_name, cols_type, False, "`date`,`code`")
+        mdb.upsert_db_from_df(data, table_name, cols_type, False, "`date`,`code`",
+                              where="`date` = %s", params=(date_str,))
+    except Exception as e:
+        logging.error(f"strategy_data_daily_job.save处理异常：{strategy}策略{e}")
+
+
+# 写入区间内策略选出的 (date, code, name) 列表。
+def save_range(dates, strategy, results):
+    try:
+        table_name = strategy["name"]
+        # 按主键upsert，只写入有变化的行，删除区间内已不存在的行。
+        if mdb.checkTableIsExist(table_name):
+            cols_type = None
+        else:
+            cols_type = tbs.get_field_types(tbs.TABLE_CN_STOCK_STRATEGIES[0]["columns"])
 
+        data = pd.DataFrame(results)
+        columns = tuple(tbs.TABLE_CN_STOCK_FOREIGN_KEY["columns"])
+        data.columns = columns
+        # 建表时带上回测列，已有的表不写回测列，保留已计算的回测结果。
+        if cols_type is not None:
+            _columns_backtest = tuple(tbs.TABLE_CN_STOCK_BACKTEST_DATA["columns"])
+            data = pd.concat([data, pd.DataFrame(columns=_columns_backtest)])
+        mdb.upsert_db_from_df(data, table_name, cols_type, False, "`date`,`code`",
+                              where="`date` >= %s and `date` <= %s", params=(dates[0], dates[-1]))
     except Exception as e:
-        logging.error(f"strategy_data_daily_job.prepare处理异常：{strategy}策略{e}")
+        logging.error(f"strategy_data_daily_job.save_range处理异常：{strategy}策略{e}")
+
+
+# 单只股票在各交易日的策略检查，DataFrame只生成一次。返回命中的日期列表。
+# top_dates不为None时为该股票上龙虎榜的日期。features为该股票的衍生数据缓存，None时新建，各日期共用。
+def check_range(code_name, data, strategy_fun, dates, top_dates=None, features=None):
+    hits = []
+    if data is None:
+        return hits
+    kwargs = {}
+    if fts.accepts(strategy_fun):
+        kwargs["features"] = fts.feature_cache() if features is None else features
+    for date in dates:
+        if top_dates is None:
+            is_hit = strategy_fun(code_name, data, date=date, **kwargs)
+        else:
+            is_hit = strategy_fun(code_name, data, date=date, istop=(date in top_dates), **kwargs)
+        if is_hit:
+            hits.append(date)
+    return hits
+
+
+# 单只股票在各交易日检查全部策略，均线等衍生数据只计算一次，各策略、各日期共用。返回与strategy_funs对应的命中日期列表。
+def check_range_all(code_name, data, strategy_funs, dates, top_dates=None):
+    features = fts.feature_cache()
+    return [check_range(code_name, data, fun, dates, top_dates if fun.__name__ == "check_high_tight" else None,
+                        features) for fun in strategy_funs]
+
 
+# 全部策略逐只股票一次检查，返回与strategies对应的 (date, code, name) 列表。
+def run_check_all(strategies, stocks, dates, workers=None, mode=None):
+    strategy_funs = [strategy["func"] for strategy in strategies]
+    task_kwargs = None
+    if any(fun.__name__ == "check_high_tight" for fun in strategy_funs):
+        top_dates = {}
+        for date in dates:
+            stock_tops = fetch_stock_top_entity_data(date)
+            if stock_tops is not None:
+                for code in stock_tops:
+                    top_dates.setdefault(code, set()).add(date)
+        task_kwargs = {k: {"top_dates": top_dates.get(k[1], set())} for k in stocks}
+    results = exe.map_stocks(
+        check_range_all,
+        stocks,
+        stocks.keys(),
+        strategy_funs,
+        dates,
+        task_kwargs=task_kwargs,
+        mode=exe.job_mode("strategy", mode),
+        workers=workers,
+        label="strategy_data_daily_job.run_check_all",
+    )
+    data = [[] for _ in strategies]
+    for k, hits in results.items():
+        if not hits:
+            continue
+        for i, strategy_hits in enumerate(hits):
+            for date in strategy_hits:
+                data[i].append((date.strftime("%Y-%m-%d"), k[1], k[2]))
+    return data
 
-def run_check(strategy_fun, table_name, stocks, date, workers=40):
-    is_check_high_tight = False
-    if strategy_fun.__name__ == "check_high_tight":
-        stock_tops = fetch_stock_top_entity_data(date)
-        if stock_tops is not None:
-            is_check_high_tight = True
-    data = []
+
+# 区间作业，面板数据逐日向量化选股，否则全部策略逐只股票一次检查，各策略分别写入。
+def prepare_range_all(dates):
     try:
-        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
-            if is_check_high_tight:
-                future_to_data = {
-                    executor.submit(
-                        strategy_fun,
-                        k,
-                        stocks[k],
-                        date=date,
-                        istop=(k[1] in stock_tops),
-                    ): k
-                    for k in stocks
-                }
-            else:
-                future_to_data = {
-                    executor.submit(strategy_fun, k, stocks[k], date=date): k
-                    for k in stocks
-                }
-            for future in concurrent.futures.as_completed(future_to_data):
-                stock = future_to_data[future]
-                try:
-                    if future.result():
-                        data.append(stock)
-                except Exception as e:
-                    logging.error(
-                        f"strategy_data_daily_job.run_check处理异常：{stock[1]}代码{e}策略{table_name}"
-                    )
+        stocks_data = stock_hist_data(date=dates[0]).get_data()
+        if stocks_data is None:
+            return
+        strategies = tbs.TABLE_CN_STOCK_STRATEGIES
+        if isinstance(stocks_data, stock_hist_panel):
+            data = screen_check(strategies, stocks_data, dates)
+        else:
+            data = run_check_all(strategies, stocks_data, dates)
+        for strategy, results in zip(strategies, data):
+            if results:
+                save_range(dates, strategy, results)
     except Exception as e:
-        logging.error(f"strategy_data_daily_job.run_check处理异常：{e}策略{table_name}")
-    if not data:
-        return None
-    else:
-        return data
+        logging.error(f"strategy_data_daily_job.prepare_range_all处理异常：{e}")
 
 
 def main():
     # 使用方法传递。
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        for strategy in tbs.TABLE_CN_STOCK_STRATEGIES:
-            executor.submit(runt.run_with_args, prepare, strategy)
+    runt.run_with_args(prepare_all, range_fun=prepare_range_all)
 
 
 # main函数入口
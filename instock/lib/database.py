@@ -3,6 +3,9 @@
 
 import logging
 import os
+import time
+import numpy as np
+import pandas as pd
 import pymysql
 from sqlalchemy import create_engine
 from sqlalchemy.types import NVARCHAR
@@ -162,53 +165,160 @@ def insert_other_db_from_df(
             )
 
 
-# 更新数据
-def update_db_from_df(data, table_name, where):
-    data = data.where(data.notnull(), None)
-    update_string = f"UPDATE `{table_name}` set "
-    where_string = " where "
-    cols = tuple(data.columns)
+UPSERT_BATCH_SIZE = 5000  # 每批写入的行数，executemany会把一批合并成一条多行语句
+FLOAT_RTOL = 1e-6  # FLOAT列只有约7位有效数字，判断数值是否变化时按相对误差比较
+
+
+# DataFrame转换为行列表，NaN/NaT/NA统一转换为None。
+def df_to_rows(data, columns):
+    values = data[columns].to_numpy(dtype=object)
+    values[pd.isna(data[columns]).to_numpy()] = None
+    return values.tolist()
+
+
+# 主键列转换为字符串用于比较，日期统一为YYYY-MM-DD。
+def _key_frame(data, keys):
+    frame = {}
+    for k in keys:
+        col = data[k]
+        if pd.api.types.is_datetime64_any_dtype(col):
+            col = col.dt.strftime("%Y-%m-%d")
+        frame[k] = col.astype(str).to_numpy()
+    return pd.MultiIndex.from_arrays(list(frame.values()), names=keys)
+
+
+# 与已有数据比较，返回 (新增或有变化的行, 已有但不在data中的主键列表)。
+# 只比较data中有的列，数值按FLOAT_RTOL相对误差比较，都为空视为相同。
+def diff_rows(data, existing, keys, rtol=FLOAT_RTOL):
+    if existing is None or len(existing.index) == 0:
+        return data, []
+    existing = existing.reset_index(drop=True)
+    new_index = _key_frame(data, keys)
+    old_index = _key_frame(existing, keys)
+    stale = ~old_index.isin(new_index)
+    stale_keys = [tuple(r) for r in existing.loc[stale, keys].itertuples(index=False)]
+
+    keep = ~old_index.duplicated(keep="last")
+    pos = pd.Series(np.arange(len(existing.index))[keep], index=old_index[keep]).reindex(new_index)
+    found = pos.notna().to_numpy()
+    if not found.any():
+        return data, stale_keys
+    old = existing.iloc[pos.to_numpy()[found].astype(np.int64)]
+    changed = ~found
+    changed_found = np.zeros(found.sum(), dtype=bool)
+    for c in data.columns:
+        if c in keys or c not in existing.columns:
+            continue
+        a = data[c].to_numpy()[found]
+        b = old[c].to_numpy()
+        na_a = pd.isna(a)
+        na_b = pd.isna(b)
+        try:
+            fa = a.astype(np.float64)
+            fb = b.astype(np.float64)
+            same = np.isclose(fa, fb, rtol=rtol, atol=0.0)
+        except (TypeError, ValueError):
+            same = a.astype(str) == b.astype(str)
+        changed_found |= ~((na_a & na_b) | (~na_a & ~na_b & same))
+    changed[found] = changed_found
+    return data[changed], stale_keys
+
+
+# INSERT ... ON DUPLICATE KEY UPDATE 语句，主键以外的列按新值更新。
+def upsert_sql(table_name, columns, keys):
+    values = ",".join(["%s"] * len(columns))
+    update = [c for c in columns if c not in keys]
+    if not update:
+        return f"INSERT IGNORE INTO `{table_name}` (`{'`,`'.join(columns)}`) VALUES ({values})"
+    update_string = ",".join([f"`{c}`=VALUES(`{c}`)" for c in update])
+    return f"INSERT INTO `{table_name}` (`{'`,`'.join(columns)}`) VALUES ({values}) ON DUPLICATE KEY UPDATE {update_string}"
+
+
+# 用游标分批upsert，返回写入的行数。
+def upsert_rows(cursor, table_name, data, keys, batch_size=UPSERT_BATCH_SIZE):
+    if data is None or len(data.index) == 0:
+        return 0
+    columns = data.columns.tolist()
+    sql = upsert_sql(table_name, columns, keys)
+    rows = df_to_rows(data, columns)
+    for b in range(0, len(rows), batch_size):
+        cursor.executemany(sql, rows[b:b + batch_size])
+    return len(rows)
+
+
+# 用游标按主键分批删除，返回删除的行数。
+def delete_rows(cursor, table_name, keys, key_values, batch_size=UPSERT_BATCH_SIZE):
+    one = f"({','.join(['%s'] * len(keys))})"
+    for b in range(0, len(key_values), batch_size):
+        batch = key_values[b:b + batch_size]
+        sql = f"DELETE FROM `{table_name}` WHERE (`{'`,`'.join(keys)}`) IN ({','.join([one] * len(batch))})"
+        cursor.execute(sql, [v for k in batch for v in k])
+    return len(key_values)
+
+
+# 幂等写入，代替先删除再插入：表不存在时按insert_db_from_df建表；
+# 存在时读出where范围内的已有数据，只upsert新增或有变化的行，删除范围内已不存在的行，在一个事务中完成。
+# where为空时不比较，直接upsert全部行。
+def upsert_db_from_df(
+    data, table_name, cols_type, write_index, primary_keys, indexs=None, where=None, params=()
+):
+    if not checkTableIsExist(table_name):
+        insert_db_from_df(data, table_name, cols_type, write_index, primary_keys, indexs)
+        return
+    if write_index:
+        data = data.reset_index()
+    keys = [k.strip(" `") for k in primary_keys.split(",")]
+    start = time.time()
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as db:
+                conn.begin()
+                stale = []
+                if where is not None:
+                    db.execute(f"SELECT * FROM `{table_name}` WHERE {where}", params)
+                    existing = pd.DataFrame(list(db.fetchall()), columns=[d[0] for d in db.description])
+                    data, stale = diff_rows(data, existing, keys)
+                    delete_rows(db, table_name, keys, stale)
+                count = upsert_rows(db, table_name, data, keys)
+                conn.commit()
+        elapsed = time.time() - start
+        logging.info(f"database.upsert_db_from_df：{table_name}表写入{count}行，删除{len(stale)}行，{elapsed:.2f}秒")
+    except Exception as e:
+        logging.error(f"database.upsert_db_from_df处理异常：{table_name}表{e}")
+
+
+# 更新数据，where为匹配行的列。
+# 数据先用多行INSERT写入临时表，再用一条 UPDATE ... JOIN 更新，全部使用绑定参数，往返次数与行数无关。
+def update_db_from_df(data, table_name, where, batch_size=UPSERT_BATCH_SIZE):
+    if data is None or len(data.index) == 0:
+        return
+    cols = data.columns.tolist()
+    keys = [c for c in cols if c in where]
+    sets = [c for c in cols if c not in where]
+    if not keys or not sets:
+        return
+    tmp_name = f"tmp_{table_name}"
+    col_string = "`,`".join(cols)
+    on_string = " and ".join([f"t.`{c}` = s.`{c}`" for c in keys])
+    set_string = ", ".join([f"t.`{c}` = s.`{c}`" for c in sets])
+    start = time.time()
     with get_connection() as conn:
         with conn.cursor() as db:
             try:
-                for row in data.values:
-                    sql = update_string
-                    sql_where = where_string
-                    for index, col in enumerate(cols):
-                        if col in where:
-                            if len(sql_where) == len(where_string):
-                                if type(row[index]) == str:
-                                    sql_where = (
-                                        f"""{sql_where}`{col}` = '{row[index]}' """
-                                    )
-                                else:
-                                    sql_where = (
-                                        f"""{sql_where}`{col}` = {row[index]} """
-                                    )
-                            else:
-                                if type(row[index]) == str:
-                                    sql_where = (
-                                        f"""{sql_where} and `{col}` = '{row[index]}' """
-                                    )
-                                else:
-                                    sql_where = (
-                                        f"""{sql_where} and `{col}` = {row[index]} """
-                                    )
-                        else:
-                            if type(row[index]) == str:
-                                if row[index] is None or row[index] != row[index]:
-                                    sql = f"""{sql}`{col}` = NULL, """
-                                else:
-                                    sql = f"""{sql}`{col}` = '{row[index]}', """
-                            else:
-                                if row[index] is None or row[index] != row[index]:
-                                    sql = f"""{sql}`{col}` = NULL, """
-                                else:
-                                    sql = f"""{sql}`{col}` = {row[index]}, """
-                    sql = f"{sql[:-2]}{sql_where}"
-                    db.execute(sql)
+                db.execute(f"DROP TEMPORARY TABLE IF EXISTS `{tmp_name}`")
+                # 临时表与原表列类型一致，不带主键，按匹配列建索引。
+                db.execute(f"CREATE TEMPORARY TABLE `{tmp_name}` SELECT `{col_string}` FROM `{table_name}` WHERE 1 = 0")
+                db.execute(f"ALTER TABLE `{tmp_name}` ADD INDEX IN_KEY(`{'`,`'.join(keys)}`)")
+                sql = f"INSERT INTO `{tmp_name}` (`{col_string}`) VALUES ({','.join(['%s'] * len(cols))})"
+                rows = df_to_rows(data, cols)
+                for b in range(0, len(rows), batch_size):
+                    db.executemany(sql, rows[b:b + batch_size])
+                db.execute(f"UPDATE `{table_name}` t JOIN `{tmp_name}` s ON {on_string} SET {set_string}")
+                db.execute(f"DROP TEMPORARY TABLE IF EXISTS `{tmp_name}`")
+                elapsed = time.time() - start
+                logging.info(f"database.update_db_from_df：{table_name}表更新{len(rows)}行，{elapsed:.2f}秒")
             except Exception as e:
-                logging.error(f"database.update_db_from_df处理异常：{sql}{e}")
+                logging.error(f"database.update_db_from_df处理异常：{table_name}表{e}")
 
 
 # 检查表是否存在
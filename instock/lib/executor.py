@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import threading
+import weakref
+import concurrent.futures
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+from instock.core.hist_panel import stock_hist_panel
+
+__author__ = 'myh '
+__date__ = '2023/3/10 '
+
+# 逐只股票计算的执行层，支持线程池、进程池、串行三种方式。
+# 进程池按物理核数启动，面板数据放入共享内存，子进程直接映射，只传股票序号，不序列化DataFrame。
+MODE_THREAD = "thread"
+MODE_PROCESS = "process"
+MODE_SERIAL = "serial"
+MODES = (MODE_THREAD, MODE_PROCESS, MODE_SERIAL)
+
+THREAD_WORKERS = 40  # 线程池默认线程数
+
+# 各作业的默认执行方式。
+# 可用环境变量覆盖，docker -e 传递：executor_mode 设置全部作业，executor_mode_作业名 设置单个作业，
+# 如 executor_mode_strategy=process。
+JOB_MODES = {
+    "indicators": MODE_THREAD,
+    "klinepattern": MODE_THREAD,
+    "strategy": MODE_THREAD,
+}
+
+
+# 作业的执行方式，mode不为None时直接使用。
+def job_mode(job, mode=None):
+    if mode is None:
+        mode = os.environ.get(f"executor_mode_{job}") or os.environ.get("executor_mode") or JOB_MODES.get(job, MODE_THREAD)
+    if mode not in MODES:
+        logging.error(f"executor.job_mode处理异常：{job}作业不支持{mode}执行方式")
+        return MODE_THREAD
+    return mode
+
+
+# 物理核数(超线程不算)，取不到时用逻辑核数。
+def physical_cores():
+    try:
+        import psutil
+        n = psutil.cpu_count(logical=False)
+        if n:
+            return n
+    except ImportError:
+        pass
+    n = None
+    try:
+        cores = set()
+        with open("/proc/cpuinfo", "r") as f:
+            phys = core = None
+            for line in f:
+                if line.startswith("physical id"):
+                    phys = line.split(":")[1].strip()
+                elif line.startswith("core id"):
+                    core = line.split(":")[1].strip()
+                elif not line.strip():
+                    if core is not None:
+                        cores.add((phys, core))
+                    phys = core = None
+            if core is not None:
+                cores.add((phys, core))
+        if cores:
+            n = len(cores)
+    except OSError:
+        pass
+    if n is None:
+        n = os.cpu_count() or 1
+    if hasattr(os, "sched_getaffinity"):
+        n = min(n, len(os.sched_getaffinity(0)))
+    return max(n, 1)
+
+
+# 放入共享内存的面板及其进程池，每个面板一份，面板释放或进程退出时关闭。
+class _shared_panel:
+    def __init__(self, panel):
+        self.keys = panel.keys()
+        self.codecs = panel.codecs
+        self.specs = {}
+        self.segments = []
+        self.pool = None
+        self.lock = threading.Lock()
+        arrays = {'dates': panel.dates, 'mask': panel.mask}
+        arrays.update({f"column.{c}": v for c, v in panel.arrays.items()})
+        for name, arr in arrays.items():
+            arr = np.ascontiguousarray(arr)
+            shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+            np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+            self.segments.append(shm)
+            self.specs[name] = (shm.name, arr.shape, arr.dtype.str)
+
+    def executor(self, workers):
+        with self.lock:
+            if self.pool is None:
+                self.pool = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_attach, initargs=(self.keys, self.specs, self.codecs))
+            return self.pool
+
+    def close(self):
+        with self.lock:
+            if self.pool is not None:
+                self.pool.shutdown(wait=True, cancel_futures=True)
+                self.pool = None
+            for shm in self.segments:
+                try:
+                    shm.close()
+                    shm.unlink()
+                except Exception:
+                    pass
+            self.segments = []
+
+
+_shared = weakref.WeakKeyDictionary()
+_shared_lock = threading.Lock()
+
+
+def _share(panel):
+    with _shared_lock:
+        shared = _shared.get(panel)
+        if shared is None:
+            shared = _shared_panel(panel)
+            _shared[panel] = shared
+            weakref.finalize(panel, shared.close)
+        return shared
+
+
+# 以下在子进程中运行。
+_worker_panel = None
+_worker_segments = []
+
+
+# 子进程启动时映射共享内存，重建只读面板。
+def _attach(keys, specs, codecs):
+    global _worker_panel
+    arrays = {}
+    for name, (shm_name, shape, dtype) in specs.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        _worker_segments.append(shm)
+        arr = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+        arr.flags.writeable = False
+        arrays[name] = arr
+    columns = {name[len("column."):]: arr for name, arr in arrays.items() if name.startswith("column.")}
+    _worker_panel = stock_hist_panel(keys, arrays['dates'], columns, arrays['mask'], codecs)
+
+
+# 计算一批股票，data为面板中的股票序号(共享内存)或DataFrame本身。
+def _run_chunk(fn, tasks, args, kwargs):
+    out = []
+    for i, stock, data, kw in tasks:
+        try:
+            if isinstance(data, (int, np.integer)):
+                data = _worker_panel.frame(data)
+            out.append((i, True, fn(stock, data, *args, **kwargs, **kw)))
+        except Exception as e:
+            out.append((i, False, str(e)))
+    return out
+
+
+# 对每只股票执行 fn(stock, data[key], *args, **kwargs)，返回 {stock: 结果}，结果为None的不返回。
+# data为stock_hist_panel或 {key: DataFrame}；keys为与stocks对应的数据键，默认与stocks相同；
+# task_kwargs为 {stock: 该股票额外的参数}。
+# workers默认线程池THREAD_WORKERS，进程池为物理核数。
+def map_stocks(fn, data, stocks, *args, keys=None, task_kwargs=None, mode=MODE_THREAD, workers=None, label="",
+               **kwargs):
+    stocks = list(stocks)
+    keys = stocks if keys is None else list(keys)
+    task_kwargs = {} if task_kwargs is None else task_kwargs
+    results = [None] * len(stocks)
+    try:
+        if mode == MODE_PROCESS:
+            if workers is None:
+                workers = physical_cores()
+            if isinstance(data, stock_hist_panel):
+                tasks = [(i, stock, data.key_index(key), task_kwargs.get(stock, {}))
+                         for i, (stock, key) in enumerate(zip(stocks, keys))]
+                tasks = [t for t in tasks if t[2] is not None]
+                executor = _share(data).executor(workers)
+                _map_chunks(executor, fn, tasks, args, kwargs, workers, stocks, results, label)
+            else:
+                tasks = [(i, stock, data.get(key), task_kwargs.get(stock, {}))
+                         for i, (stock, key) in enumerate(zip(stocks, keys))]
+                with concurrent.futures.ProcessPoolExecutor(
+                        max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+                    _map_chunks(executor, fn, tasks, args, kwargs, workers, stocks, results, label)
+        elif mode == MODE_SERIAL:
+            for i, (stock, key) in enumerate(zip(stocks, keys)):
+                try:
+                    results[i] = fn(stock, data.get(key), *args, **kwargs, **task_kwargs.get(stock, {}))
+                except Exception as e:
+                    logging.error(f"{label}处理异常：{stock[1]}代码{e}")
+        else:
+            if workers is None:
+                workers = THREAD_WORKERS
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                future_to_data = {executor.submit(fn, stock, data.get(key), *args, **kwargs,
+                                                  **task_kwargs.get(stock, {})): i
+                                  for i, (stock, key) in enumerate(zip(stocks, keys))}
+                for future in concurrent.futures.as_completed(future_to_data):
+                    i = future_to_data[future]
+                    try:
+                        results[i] = future.result()
+                    except Exception as e:
+                        logging.error(f"{label}处理异常：{stocks[i][1]}代码{e}")
+    except Exception as e:
+        logging.error(f"{label}处理异常：{e}")
+    return {stocks[i]: r for i, r in enumerate(results) if r is not None}
+
+
+# 任务分成约 workers*4 批提交，减少进程间通信次数。
+def _map_chunks(executor, fn, tasks, args, kwargs, workers, stocks, results, label):
+    size = max(1, -(-len(tasks) // (workers * 4)))
+    futures = [executor.submit(_run_chunk, fn, tasks[b:b + size], args, kwargs) for b in range(0, len(tasks), size)]
+    for future in concurrent.futures.as_completed(futures):
+        for i, ok, value in future.result():
+            if ok:
+                results[i] = value
+            else:
+                logging.error(f"{label}处理异常：{stocks[i][1]}代码{value}")
+
+
+# 在进程池中对每个任务执行 fn(面板, task, *args, **kwargs)，面板放入共享内存，子进程直接映射。
+# 用于按策略、按参数等整体任务分发，返回与tasks对应的结果列表，异常的为None。
+def map_panel(fn, panel, tasks, *args, workers=None, label="", **kwargs):
+    tasks = list(tasks)
+    results = [None] * len(tasks)
+    if workers is None:
+        workers = physical_cores()
+    try:
+        executor = _share(panel).executor(workers)
+        future_to_data = {executor.submit(_run_panel, fn, task, args, kwargs): i for i, task in enumerate(tasks)}
+        for future in concurrent.futures.as_completed(future_to_data):
+            i = future_to_data[future]
+            try:
+                results[i] = future.result()
+            except Exception as e:
+                logging.error(f"{label}处理异常：{tasks[i]}{e}")
+    except Exception as e:
+        logging.error(f"{label}处理异常：{e}")
+    return results
+
+
+def _run_panel(fn, task, args, kwargs):
+    return fn(_worker_panel, task, *args, **kwargs)
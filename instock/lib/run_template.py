@@ -14,7 +14,8 @@ __date__ = '2023/3/10 '
 
 
 # 通用函数，获得日期参数，支持批量作业。
-def run_with_args(run_fun, *args):
+# range_fun不为None时，区间作业和N个时间作业调用一次 range_fun(交易日列表, *args)，一次计算全部日期。
+def run_with_args(run_fun, *args, range_fun=None):
     if len(sys.argv) == 3:
         # 区间作业 python xxx.py 2023-03-01 2023-03-21
         tmp_year, tmp_month, tmp_day = sys.argv[1].split("-")
@@ -22,6 +23,14 @@ def run_with_args(run_fun, *args):
         tmp_year, tmp_month, tmp_day = sys.argv[2].split("-")
         end_date = datetime.datetime(int(tmp_year), int(tmp_month), int(tmp_day)).date()
         run_date = start_date
+        if range_fun is not None:
+            dates = []
+            while run_date <= end_date:
+                if trd.is_trade_date(run_date):
+                    dates.append(run_date)
+                run_date += datetime.timedelta(days=1)
+            run_range(range_fun, dates, *args)
+            return
         try:
             with concurrent.futures.ThreadPoolExecutor() as executor:
                 while run_date <= end_date:
@@ -34,6 +43,15 @@ def run_with_args(run_fun, *args):
     elif len(sys.argv) == 2:
         # N个时间作业 python xxx.py 2023-03-01,2023-03-02
         dates = sys.argv[1].split(',')
+        if range_fun is not None:
+            run_dates = []
+            for date in dates:
+                tmp_year, tmp_month, tmp_day = date.split("-")
+                run_date = datetime.datetime(int(tmp_year), int(tmp_month), int(tmp_day)).date()
+                if trd.is_trade_date(run_date):
+                    run_dates.append(run_date)
+            run_range(range_fun, sorted(run_dates), *args)
+            return
         try:
             with concurrent.futures.ThreadPoolExecutor() as executor:
                 for date in dates:
@@ -56,3 +74,12 @@ def run_with_args(run_fun, *args):
                 run_fun(run_date_nph, *args)
         except Exception as e:
             logging.error(f"run_template.run_with_args处理异常：{run_fun}{sys.argv}{e}")
+
+
+def run_range(range_fun, dates, *args):
+    if not dates:
+        return
+    try:
+        range_fun(dates, *args)
+    except Exception as e:
+        logging.error(f"run_template.run_range处理异常：{range_fun}{sys.argv}{e}")
@@ -2,44 +2,49 @@
 # -*- coding: utf-8 -*-
 
 import datetime
+import numpy as np
+import instock.core.trade_calendar as tcl
 from instock.core.singleton_trade_date import stock_trade_date
 
 __author__ = 'myh '
 __date__ = '2023/4/10 '
 
 
+# 交易日历为int32天数有序数组，用二分查找。
 def is_trade_date(date=None):
     trade_date = stock_trade_date().get_data()
-    if trade_date is None:
-        return False
-    if date in trade_date:
-        return True
-    else:
+    if trade_date is None or date is None:
         return False
+    num = tcl.date_num(date)
+    i = np.searchsorted(trade_date, num)
+    return bool(i < len(trade_date) and trade_date[i] == num)
 
 
-def get_previous_trade_date(date):
+# date之前(previous为True)或之后最近的交易日。超出交易日历范围时先更新交易日历，仍然超出则抛出ValueError，
+# 没有交易日历时返回date。
+def _near_trade_date(date, previous):
+    num = tcl.date_num(date)
     trade_date = stock_trade_date().get_data()
-    if trade_date is None:
-        return date
-    tmp_date = date
-    while True:
-        tmp_date += datetime.timedelta(days=-1)
-        if tmp_date in trade_date:
-            break
-    return tmp_date
+    for refresh in (False, True):
+        if refresh:
+            trade_date = stock_trade_date().refresh()
+        if trade_date is None:
+            return date
+        if previous:
+            i = np.searchsorted(trade_date, num, side='left') - 1
+        else:
+            i = np.searchsorted(trade_date, num, side='right')
+        if 0 <= i < len(trade_date):
+            return date + datetime.timedelta(days=int(trade_date[i]) - num)
+    raise ValueError(f"{date}{'之前' if previous else '之后'}没有交易日，超出交易日历范围")
+
+
+def get_previous_trade_date(date):
+    return _near_trade_date(date, True)
 
 
 def get_next_trade_date(date):
-    trade_date = stock_trade_date().get_data()
-    if trade_date is None:
-        return date
-    tmp_date = date
-    while True:
-        tmp_date += datetime.timedelta(days=1)
-        if tmp_date in trade_date:
-            break
-    return tmp_date
+    return _near_trade_date(date, False)
 
 
 OPEN_TIME = (
@@ -0,0 +1,11 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os.path
+import sys
+
+__author__ = 'myh '
+__date__ = '2023/5/12 '
+
+# 从项目根目录导入instock。
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import instock.core.indicator.calculate_indicator_panel as pidr
+import instock.core.tablestructure as tbs
+from instock.core.hist_panel import stock_hist_panel
+
+tl = pytest.importorskip("talib")
+
+__author__ = 'myh '
+__date__ = '2023/5/12 '
+
+
+# 两位小数价格，30%的交易日沿用前一日的最高、最低、收盘价，典型价格相等但浮点舍入不同。
+def _tie_prone(seed=0, size=400, count=60):
+    rng = np.random.default_rng(seed)
+    close = np.round(10 * np.exp(np.cumsum(rng.normal(0, 0.01, (size, count)), axis=0)), 2)
+    high = np.round(close * (1 + np.abs(rng.normal(0, 0.005, (size, count)))), 2)
+    low = np.round(close * (1 - np.abs(rng.normal(0, 0.005, (size, count)))), 2)
+    same = rng.random((size, count)) < 0.3
+    high = np.where(same, np.roll(high, 1, 0), high)
+    low = np.where(same, np.roll(low, 1, 0), low)
+    close = np.where(same, np.roll(close, 1, 0), close)
+    # 最高、最低、收盘价顺序打乱，和相同的情况下浮点舍入不同
+    high, low = np.maximum(high, np.maximum(low, close)), np.minimum(low, np.minimum(high, close))
+    volume = rng.integers(1, 1000, (size, count)) * 100.0
+    return high, low, close, volume
+
+
+def test_mfi_ties_match_talib():
+    high, low, close, volume = _tie_prone()
+    tp = (high + low + close) / 3.0
+    diff = np.diff(tp, axis=0)
+    assert np.count_nonzero((diff != 0) & (np.abs(diff) < 1e-12)) > 0  # 数据里有浮点噪声
+
+    mfi = pidr.MFI(high, low, close, volume, 14)
+    mfisma = pidr.MA(mfi, 6)
+    for j in range(close.shape[1]):
+        expect = tl.MFI(high[:, j], low[:, j], close[:, j], volume[:, j], 14)
+        np.testing.assert_allclose(mfi[:, j], expect, rtol=1e-9, atol=1e-9, err_msg=f"mfi {j}")
+        np.testing.assert_allclose(mfisma[:, j], tl.MA(expect, 6), rtol=1e-9, atol=1e-9, err_msg=f"mfisma {j}")
+
+
+def test_mfi_flow_ties():
+    tp = np.array([(10.01 + 9.97 + 10.0) / 3.0, (10.0 + 10.01 + 9.97) / 3.0, 10.5, 10.4, np.nan])
+    prev = np.array([(10.0 + 10.01 + 9.97) / 3.0, (10.01 + 9.97 + 10.0) / 3.0, 10.4, 10.5, 10.0])
+    np.testing.assert_array_equal(pidr.mfi_flow(tp, prev), [0, 0, 1, -1, 0])
+
+
+# 两位小数价格，股票的上市日期和最后交易日不同，包含只有1、2根K线和不足calc_threshold根K线的股票。
+def _panel(seed=0, size=200, count=40):
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range('2022-01-03', periods=size)
+    lengths = [1, 2, 5, 30, 89, 90, 91] + [size] * (count - 7)
+    frames = {}
+    for j, length in enumerate(lengths):
+        end = size if j % 4 else size - int(rng.integers(1, 20))
+        d = dates[max(end - length, 0):end]
+        n = len(d)
+        close = np.round(10 * np.exp(np.cumsum(rng.normal(0, 0.02, n))), 2)
+        close = np.where(rng.random(n) < 0.1, np.roll(close, 1), close)
+        open_price = np.round(close * (1 + rng.normal(0, 0.01, n)), 2)
+        high = np.round(np.maximum(open_price, close) * (1 + np.abs(rng.normal(0, 0.01, n))), 2)
+        low = np.round(np.minimum(open_price, close) * (1 - np.abs(rng.normal(0, 0.01, n))), 2)
+        volume = rng.integers(1000, 100000, n) * 100.0
+        frame = pd.DataFrame({'date': [x.strftime('%Y-%m-%d') for x in d], 'open': open_price, 'close': close,
+                              'high': high, 'low': low, 'volume': volume, 'amount': volume * close,
+                              'amplitude': 0.0, 'quote_change': 0.0, 'ups_downs': 0.0, 'turnover': 0.0})
+        frames[(frame['date'].iloc[-1], f'{j:06d}', f'n{j}')] = frame
+    return stock_hist_panel.from_frames(frames), dates
+
+
+# 面板计算与逐只股票 calculate_indicator.get_indicator 的结果相同，覆盖全部指标列。
+@pytest.mark.parametrize("calc_threshold", [90, None])
+def test_get_indicator_matches_single(calc_threshold):
+    import instock.core.indicator.calculate_indicator as idr
+
+    panel, dates = _panel()
+    columns = list(tbs.STOCK_STATS_DATA['columns'])
+    stock_column = ['date', 'code'] + columns
+    for date in (None, dates[-10].date(), dates[60].date()):
+        result = pidr.get_indicator(panel, date=date, calc_threshold=calc_threshold).set_index('code')
+        expected = {}
+        for k in panel:
+            r = idr.get_indicator(k, panel[k], stock_column, date=date, calc_threshold=calc_threshold)
+            if r is not None:
+                expected[k[1]] = r
+        expected = pd.DataFrame(expected).T
+        # 该日还没有K线的股票面板计算不输出，逐只计算为全0的行。
+        listed = [k[1] for k in panel if date is None or len(panel[k]) <= 1 or panel[k]['date'].iloc[0] <= str(date)]
+        assert sorted(result.index) == sorted(listed)
+        assert (expected.drop(index=listed)[columns] == 0).all().all()
+        expected = expected.loc[result.index]
+        for c in columns:
+            np.testing.assert_allclose(result[c].astype(np.float64).values, expected[c].astype(np.float64).values,
+                                       rtol=1e-9, atol=1e-9, err_msg=f"{date} {c}")
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import multiprocessing
+import os.path
+
+import numpy as np
+import pandas as pd
+
+import instock.core.hist_store as hst
+
+__author__ = 'myh '
+__date__ = '2023/5/12 '
+
+
+def _frame(days, price):
+    dates = pd.bdate_range('2023-01-02', periods=days)
+    data = {'date': [x.strftime('%Y-%m-%d') for x in dates]}
+    for k in hst.HIST_VALUE_COLUMNS:
+        data[k] = np.full(days, price)
+    return data['date'][0].replace('-', ''), pd.DataFrame(data)
+
+
+def _store(path):
+    hst.stock_hist_columnar_path = path
+    return hst.stock_hist_store()
+
+
+def _commit(path, code, barrier):
+    store = _store(path)
+    store.stage(code, *_frame(5, 1.0))
+    barrier.wait()
+    store.commit()
+
+
+# 两个进程从同一版本开始各自写入，后提交的进程合并前一个进程写入的数据。
+def test_commit_keeps_other_process_data(tmp_path, monkeypatch):
+    monkeypatch.setattr(hst, "stock_hist_columnar_path", str(tmp_path))
+    base = _store(str(tmp_path))
+    base.stage('000001', *_frame(3, 1.0))
+    base.commit()
+
+    first = _store(str(tmp_path))
+    second = _store(str(tmp_path))
+    first.stage('000002', *_frame(4, 2.0))
+    second.stage('000003', *_frame(5, 3.0))
+    first.commit()
+    second.commit()
+
+    store = _store(str(tmp_path))
+    assert sorted(store.arrays()[0].tolist()) == ['000001', '000002', '000003']
+    assert len(store.get('000002')[1]) == 4
+    generations = [n for n in os.listdir(store.path) if os.path.isdir(os.path.join(store.path, n))]
+    assert store._generation in generations and first._generation in generations
+    assert base._generation not in generations
+
+
+# 多个进程同时提交，全部数据都写入。
+def test_commit_processes(tmp_path, monkeypatch):
+    monkeypatch.setattr(hst, "stock_hist_columnar_path", str(tmp_path))
+    context = multiprocessing.get_context("spawn")
+    codes = [f'{j:06d}' for j in range(4)]
+    barrier = context.Barrier(len(codes))
+    processes = [context.Process(target=_commit, args=(str(tmp_path), c, barrier)) for c in codes]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join(60)
+        assert p.exitcode == 0
+    store = _store(str(tmp_path))
+    assert sorted(store.arrays()[0].tolist()) == codes
+
+
+# 清理只删除比刚写入的版本更早的目录。
+def test_cleanup_keeps_newer(tmp_path, monkeypatch):
+    monkeypatch.setattr(hst, "stock_hist_columnar_path", str(tmp_path))
+    store = _store(str(tmp_path))
+    os.makedirs(os.path.join(store.path, "99991231000000_000000000_1"))
+    os.makedirs(os.path.join(store.path, "19700101000000_000000000_1"))
+    store.stage('000001', *_frame(3, 1.0))
+    store.commit()
+    names = os.listdir(store.path)
+    assert "99991231000000_000000000_1" in names
+    assert "19700101000000_000000000_1" not in names
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pd
+
+import instock.core.indicator.calculate_indicator_panel as pidr
+import instock.core.indicator.indicator_state as ist
+from instock.core.hist_panel import stock_hist_panel
+
+__author__ = 'myh '
+__date__ = '2023/5/12 '
+
+
+# 两位小数价格，部分交易日价格不变，股票上市日期不同。
+def _panel(seed=0, size=160, count=24):
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range('2022-01-03', periods=size)
+    frames = {}
+    for j in range(count):
+        begin = 0 if j % 3 else int(rng.integers(0, size // 2))
+        d = dates[begin:]
+        length = len(d)
+        close = np.round(10 * np.exp(np.cumsum(rng.normal(0, 0.02, length))), 2)
+        same = rng.random(length) < 0.2
+        close = np.where(same, np.roll(close, 1), close)
+        open_price = np.round(close * (1 + rng.normal(0, 0.01, length)), 2)
+        high = np.round(np.maximum(open_price, close) * (1 + np.abs(rng.normal(0, 0.01, length))), 2)
+        low = np.round(np.minimum(open_price, close) * (1 - np.abs(rng.normal(0, 0.01, length))), 2)
+        volume = rng.integers(1000, 100000, length) * 100.0
+        frame = pd.DataFrame({'date': [x.strftime('%Y-%m-%d') for x in d], 'open': open_price, 'close': close,
+                              'high': high, 'low': low, 'volume': volume, 'amount': volume * (high + low) / 2,
+                              'amplitude': 0.0, 'quote_change': 0.0, 'ups_downs': 0.0, 'turnover': 0.0})
+        frame['p_change'] = frame['close'].pct_change().fillna(0) * 100
+        frames[(frame['date'].iloc[-1], f'{j:06d}', f'n{j}')] = frame
+    return stock_hist_panel.from_frames(frames), dates
+
+
+def _expected(panel, date, columns):
+    arrays, counts, _ = panel.packed(pidr.INPUT_COLUMNS, end_date=date.strftime("%Y-%m-%d"))
+    d = pidr.compute(arrays, columns, counts)
+    return {c: d[c][-1] for c in columns}, counts > 0
+
+
+def _assert_same(outputs, expected, ok):
+    for c, v in expected.items():
+        np.testing.assert_array_equal(outputs[c][ok], v[ok], err_msg=c)
+
+
+# 每天推进一步的结果与用全部历史计算完全相同。
+def test_step_matches_full_history(tmp_path):
+    panel, dates = _panel()
+    columns = list(pidr.all_columns())
+    state = ist.stock_indicator_state(str(tmp_path / "state.npz"))
+    for date in dates[100:130]:
+        outputs, result = state.compute(panel, date.date(), columns)
+        expected, ok = _expected(panel, date, columns)
+        _assert_same(outputs, expected, ok)
+        assert result["done"][ok].all()
+        state.commit(result)
+    # 重新读取保存的状态继续推进
+    state = ist.stock_indicator_state(str(tmp_path / "state.npz"))
+    outputs, _ = state.compute(panel, dates[130].date(), columns)
+    _assert_same(outputs, *_expected(panel, dates[130], columns))
+
+
+# 只计算部分列，之后需要其它列时重算。
+def test_columns_subset(tmp_path):
+    panel, dates = _panel(1)
+    state = ist.stock_indicator_state(str(tmp_path / "state.npz"))
+    outputs, result = state.compute(panel, dates[100].date(), ["ma20", "mfi"])
+    assert set(outputs) == {"ma20", "mfi"}
+    _assert_same(outputs, *_expected(panel, dates[100], ["ma20", "mfi"]))
+    state.commit(result)
+    assert state.columns == ["ma20", "mfi"]
+    assert not any(k.startswith("macd") for k in state.state)
+
+    outputs, result = state.compute(panel, dates[101].date(), ["ma20", "macd"])
+    _assert_same(outputs, *_expected(panel, dates[101], ["ma20", "mfi", "macd"]))
+    state.commit(result)
+    assert state.columns == ["ma20", "mfi", "macd"]
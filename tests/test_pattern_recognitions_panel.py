@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+import instock.core.pattern.pattern_recognitions as kpr
+import instock.core.pattern.pattern_recognitions_panel as kprp
+import instock.core.tablestructure as tbs
+
+__author__ = 'myh '
+__date__ = '2023/5/12 '
+
+
+# 两位小数价格，价格从几毛到几千元，很多K线实体或影线相等，部分股票K线不足、含NaN。
+def _arrays(seed=0, size=3000, length=12):
+    rng = np.random.default_rng(seed)
+    arrays = {c: np.full((length, size), np.nan) for c in kprp.INPUT_COLUMNS}
+    counts = np.where(np.arange(size) % 5, length, rng.integers(1, length + 1, size))
+    for j in range(size):
+        n = counts[j]
+        close = np.round(10 ** rng.uniform(-0.5, 3) * np.exp(np.cumsum(rng.normal(0, 0.02, n))), 2)
+        close = np.where(rng.random(n) < 0.2, np.roll(close, 1), close)
+        open_price = np.round(close * (1 + rng.normal(0, 0.01, n)), 2)
+        high = np.round(np.maximum(open_price, close) * (1 + np.abs(rng.normal(0, 0.01, n))), 2)
+        low = np.round(np.minimum(open_price, close) * (1 - np.abs(rng.normal(0, 0.01, n))), 2)
+        if j % 4 == 0:
+            high = np.where(rng.random(n) < 0.3, np.maximum(open_price, close), high)
+        if j % 97 == 3 and n > 3:
+            open_price[-3] = np.nan
+        for c, v in zip(kprp.INPUT_COLUMNS, (open_price, high, low, close)):
+            arrays[c][length - n:, j] = v
+    return arrays, counts
+
+
+# 首尾相接一次计算的结果与逐只股票计算完全相同，前面股票的舍入误差不影响后面的股票。
+def test_recognize_matches_single():
+    stock_column = tbs.STOCK_KLINE_PATTERN_DATA['columns']
+    arrays, counts = _arrays()
+    length = len(arrays['close'])
+    matrix = kprp.recognize(arrays, counts, stock_column)
+    for i, k in enumerate(stock_column):
+        func = stock_column[k]['func']
+        lookback = kpr.lookback(func)
+        expected = np.zeros(len(counts), dtype=np.int32)
+        for j, n in enumerate(counts):
+            if lookback < min(n, 12):
+                expected[j] = func(*[arrays[c][length - n:, j] for c in kprp.INPUT_COLUMNS])[-1]
+        np.testing.assert_array_equal(matrix[:, i].astype(np.int32) * kprp.SCALE, expected, err_msg=k)
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pd
+
+import instock.core.strategy.low_backtrace_increase as low_backtrace_increase
+import instock.core.strategy.screen as scr
+import instock.core.tablestructure as tbs
+from instock.core.hist_panel import stock_hist_panel
+
+__author__ = 'myh '
+__date__ = '2023/5/12 '
+
+_SIZE = 320
+_DATES = pd.bdate_range('2022-01-03', periods=_SIZE)
+
+
+def _flat(rng, size=_SIZE, price=10.0):
+    return price * (1 + rng.normal(0, 0.003, size))
+
+
+# 放量上涨：最后一天涨5%，成交量为之前的5倍。
+def _enter(rng):
+    close = _flat(rng)
+    close[-1] = close[-2] * 1.05
+    volume = np.full(_SIZE, 1e7)
+    volume[-1] = 5e7
+    return close, None, volume
+
+
+# 持续上涨：每天涨1%，同时满足均线多头和海龟交易法则，60日涨幅超过60%且没有回撤。
+def _increasing(rng):
+    return 10 * np.exp(np.cumsum(np.full(_SIZE, 0.01))), None, None
+
+
+# 停机坪：创60日新高的涨停后连续3天在涨停价之上小幅震荡。
+def _parking_apron(rng):
+    close = _flat(rng)
+    close[-4] = 11.0
+    close[-3:] = (11.2, 11.25, 11.3)
+    open_price = np.roll(close, 1)
+    open_price[-3:] = (11.1, 11.2, 11.25)
+    return close, open_price, None
+
+
+# 回踩年线：由年线下方放量涨到年线上方，缩量回落到高点的八成以下，没有跌破年线。
+def _backtrace_ma250(rng):
+    close = _flat(rng)
+    close[-60] = 9.5
+    close[-59:-29] = np.linspace(9.8, 15, 30)
+    close[-29:] = np.linspace(14.8, 11.5, 29)
+    volume = np.full(_SIZE, 1e6)
+    volume[-30] = 3e6
+    return close, None, volume
+
+
+# 突破平台：长期横盘，最后一天低开放量上穿60日均线。
+def _breakthrough_platform(rng):
+    close = _flat(rng)
+    close[-1] = 10.5
+    open_price = np.roll(close, 1)
+    open_price[-1] = 9.9
+    volume = np.full(_SIZE, 1e7)
+    volume[-1] = 5e7
+    return close, open_price, volume
+
+
+# 高而窄的旗形：连续涨停翻倍后横盘。
+def _high_tight_flag(rng):
+    close = _flat(rng)
+    close[-17:-10] = 10 * 1.1 ** np.arange(1, 8)
+    close[-10:] = close[-11] * (1 + rng.normal(0, 0.003, 10))
+    return close, None, None
+
+
+# 放量跌停：最后一天跌10%，成交量为之前的5倍。
+def _climax_limitdown(rng):
+    close = _flat(rng)
+    close[-1] = close[-2] * 0.9
+    volume = np.full(_SIZE, 1e7)
+    volume[-1] = 5e7
+    return close, None, volume
+
+
+# 低ATR成长：最近10天先小跌，再连续8天涨9.9%。
+def _low_atr(rng):
+    close = _flat(rng)
+    close[-10] = 10.0
+    close[-9] = 9.9
+    close[-8:] = 9.9 * 1.099 ** np.arange(1, 9)
+    return close, None, None
+
+
+def _random(rng):
+    return 10 * np.exp(np.cumsum(rng.normal(0, 0.02, _SIZE))), None, None
+
+
+def _frame(rng, close, open_price=None, volume=None):
+    close = np.round(close, 2)
+    if open_price is None:
+        open_price = np.roll(close, 1) * (1 + rng.normal(0, 0.002, _SIZE))
+        open_price[0] = close[0]
+    open_price = np.round(open_price, 2)
+    if volume is None:
+        volume = rng.integers(1000, 100000, _SIZE) * 100.0
+    high = np.round(np.maximum(open_price, close) * 1.005, 2)
+    low = np.round(np.minimum(open_price, close) * 0.995, 2)
+    frame = pd.DataFrame({'date': [x.strftime('%Y-%m-%d') for x in _DATES], 'open': open_price, 'close': close,
+                          'high': high, 'low': low, 'volume': volume, 'amount': volume * close,
+                          'amplitude': 0.0, 'quote_change': 0.0, 'ups_downs': 0.0, 'turnover': 0.0})
+    frame['p_change'] = frame['close'].pct_change().fillna(0) * 100
+    return frame
+
+
+# 每个策略至少有一只股票在最后一天选中，其余为随机走势；部分股票只有最近的历史。
+def _universe(seed=0):
+    rng = np.random.default_rng(seed)
+    makers = [_enter, _increasing, _parking_apron, _backtrace_ma250, _breakthrough_platform, _high_tight_flag,
+              _climax_limitdown, _low_atr] + [_random] * 8
+    frames = {}
+    for j, maker in enumerate(makers):
+        frame = _frame(rng, *maker(rng))
+        if maker is _random and j % 2:
+            frame = frame.iloc[int(rng.integers(200, _SIZE - 20)):].reset_index(drop=True)
+        frames[(frame['date'].iloc[-1], f'{j:06d}', f'n{j}')] = frame
+    tops = {f'{j:06d}' for j in range(0, len(makers), 5)} | {f'{makers.index(_high_tight_flag):06d}'}
+    return stock_hist_panel.from_frames(frames), tops
+
+
+# 向量化筛选与逐只股票的检查函数结果相同，每个策略都有选中和未选中的股票。
+# 无大幅回撤的检查函数第一行用previous_open=-1000000.0比较，两日高开低走条件总是成立，任何股票都不会选中。
+def test_parity():
+    panel, tops = _universe()
+    for date in (_DATES[-1].date(), _DATES[-3].date()):
+        assert scr.parity(panel, date, tops=tops).empty
+    result = scr.screen(panel, _DATES[-1].date(), tops=tops)
+    for strategy in tbs.TABLE_CN_STOCK_STRATEGIES:
+        hits = result.loc[strategy['name']]
+        if strategy['func'] is low_backtrace_increase.check:
+            assert not hits.any()
+        else:
+            assert hits.any() and not hits.all(), strategy['name']